@@ -0,0 +1,419 @@
+import zlib
+from collections import OrderedDict
+import numpy as np
+from scipy import sparse
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from snapshot import pack_strings, unpack_strings
+from topk import top_k_indices
+
+
+class ExactIndex:
+    """Brute-force cosine index, used as the reference for recall checks"""
+
+    needs_training = False  # nothing to train
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.keys: List[Optional[str]] = []
+        self.slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._vectors = np.zeros((16, dim), dtype=np.float32)
+        self._alive = np.zeros(16, dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.slots
+
+    def add(self, key: str, vector: np.ndarray) -> int:
+        """Insert or replace the vector stored under ``key``"""
+        slot = self._slot(key)
+        self._vectors[slot] = _normalize(vector)
+        self._alive[slot] = True
+        return slot
+
+    def add_many(self, keys: List[str], vectors: np.ndarray) -> np.ndarray:
+        """Insert or replace one vector per key (keys must be distinct)"""
+        slots = np.asarray([self._slot(key) for key in keys], dtype=np.int64)
+        self._vectors[slots] = _normalize(vectors)
+        self._alive[slots] = True
+        return slots
+
+    def remove(self, key: str) -> Optional[int]:
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.keys[slot] = None
+            self._alive[slot] = False
+            self._free.append(slot)
+        return slot
+
+    def vector(self, key: str) -> Optional[np.ndarray]:
+        slot = self.slots.get(key)
+        return None if slot is None else self._vectors[slot]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        n = len(self.keys)
+        return {
+            "keys": pack_strings(key or "" for key in self.keys),
+            "vectors": self._vectors[:n],
+            "alive": self._alive[:n],
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], **kwargs) -> "ExactIndex":
+        """Rebuild from snapshot arrays; vectors stay backed by the (mapped) array"""
+        vectors, alive = arrays["vectors"], np.array(arrays["alive"])
+        index = cls(vectors.shape[1], **kwargs)
+        keys = unpack_strings(arrays["keys"], len(alive))
+        index.keys = [key if live else None for key, live in zip(keys, alive)]
+        index.slots = {key: slot for slot, key in enumerate(index.keys) if key is not None}
+        index._free = np.flatnonzero(~alive).tolist()
+        index._vectors, index._alive = vectors, alive
+        return index
+
+    def search(self, query: np.ndarray, k: int, exclude: Optional[str] = None,
+               **kwargs) -> List[Tuple[str, float]]:
+        """Top ``k`` keys by cosine similarity to ``query``"""
+        candidates = np.flatnonzero(self._alive[:len(self.keys)])
+        return self._rank(candidates, query, k, exclude)
+
+    def _rank(self, candidates: np.ndarray, query: np.ndarray, k: int,
+              exclude: Optional[str]) -> List[Tuple[str, float]]:
+        if exclude is not None and exclude in self.slots:
+            candidates = candidates[candidates != self.slots[exclude]]
+        if not len(candidates) or k <= 0:
+            return []
+
+        scores = self._vectors[candidates] @ _normalize(query)
+        return [(self.keys[candidates[i]], float(scores[i])) for i in top_k_indices(scores, k)]
+
+    def _slot(self, key: str) -> int:
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self._free.pop() if self._free else len(self.keys)
+            if slot == len(self.keys):
+                self.keys.append(key)
+                self._grow(slot + 1)
+            else:
+                self.keys[slot] = key
+            self.slots[key] = slot
+        return slot
+
+    def _grow(self, size: int):
+        if size <= len(self._alive):
+            return
+        capacity = max(size, 2 * len(self._alive))
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:len(self._vectors)] = self._vectors
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:len(self._alive)] = self._alive
+        self._vectors, self._alive = vectors, alive
+
+
+class IVFIndex(ExactIndex):
+    """Inverted-file cosine index.
+
+    Vectors are bucketed under the nearest of ``n_lists`` k-means centroids,
+    and a query only scans the ``nprobe`` buckets closest to it. Raising
+    ``nprobe`` trades latency for recall; ``nprobe == n_lists`` is an exact
+    scan. Until ``min_train_size`` vectors have been added the index answers
+    exactly, and ``needs_training`` turns on whenever it has grown
+    ``retrain_growth`` times past the size it was last trained on.
+
+    With ``auto_train`` the index retrains itself inside ``add``. Otherwise
+    the owner trains it in three steps so that only the first and last need
+    exclusive access: ``prepare_training``, ``fit`` on the returned arrays,
+    then ``install``. Vectors added or removed in between are relabelled
+    on install.
+    """
+
+    def __init__(self, dim: int, n_lists: Optional[int] = None, nprobe: int = 8,
+                 min_train_size: int = 1024, retrain_growth: float = 4.0, seed: int = 0,
+                 auto_train: bool = True):
+        super().__init__(dim)
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.auto_train = auto_train
+        self.centroids: Optional[np.ndarray] = None
+        self._rng = np.random.default_rng(seed)
+        self._trained_size = 0
+        self._pending: Optional[set] = None
+        self._assignment = np.full(16, -1, dtype=np.int32)
+        self._position = np.zeros(16, dtype=np.int64)
+        self._lists: List[np.ndarray] = []
+        self._list_sizes = np.zeros(0, dtype=np.int64)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def needs_training(self) -> bool:
+        return len(self) >= max(self.min_train_size, self.retrain_growth * self._trained_size)
+
+    def add(self, key: str, vector: np.ndarray) -> int:
+        slot = super().add(key, vector)
+        if self._pending is not None:
+            self._pending.add(slot)
+        if self.is_trained:
+            self._unlink(slot)
+            self._link(slot, int(np.argmax(self.centroids @ self._vectors[slot])))
+
+        self._maybe_train()
+        return slot
+
+    def add_many(self, keys: List[str], vectors: np.ndarray) -> np.ndarray:
+        slots = super().add_many(keys, vectors)
+        if self._pending is not None:
+            self._pending.update(slots.tolist())
+        if self.is_trained and len(slots):
+            labels = np.argmax(self._vectors[slots] @ self.centroids.T, axis=1)
+            for slot, label in zip(slots, labels):
+                self._unlink(slot)
+                self._link(slot, int(label))
+        self._maybe_train()
+        return slots
+
+    def remove(self, key: str) -> Optional[int]:
+        slot = super().remove(key)
+        if slot is not None and self._pending is not None:
+            self._pending.add(slot)
+        if slot is not None and self.is_trained:
+            self._unlink(slot)
+        return slot
+
+    def _maybe_train(self):
+        if self.auto_train and self.needs_training:
+            self.train()
+
+    def train(self, iterations: int = 10, sample_size: int = 65536):
+        """Fit centroids with spherical k-means and rebuild the inverted lists"""
+        self.install(*self.fit(*self.prepare_training(), iterations, sample_size))
+
+    def prepare_training(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Start training: return the vectors and live slots to fit, and track updates from now on.
+
+        The vectors are a view; slots written to later are relabelled on install.
+        """
+        self._pending = set()
+        return self._vectors[:len(self.keys)], np.flatnonzero(self._alive[:len(self.keys)])
+
+    def fit(self, vectors: np.ndarray, alive: np.ndarray, iterations: int = 10,
+            sample_size: int = 65536) -> Tuple[Optional[np.ndarray], np.ndarray, np.ndarray]:
+        """Fit centroids and label the ``alive`` slots of ``vectors``; touches no index state"""
+        if not len(alive):
+            return None, alive, alive
+        n_lists = self.n_lists or max(1, int(np.sqrt(len(alive))))
+        n_lists = min(n_lists, len(alive))
+
+        sample = alive
+        if len(sample) > sample_size:
+            sample = self._rng.choice(alive, sample_size, replace=False)
+        data = vectors[sample]
+
+        centroids = data[self._rng.choice(len(data), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            empty = ~sums.any(axis=1)
+            # Reseed empty buckets with random points so every list is used
+            sums[empty] = data[self._rng.choice(len(data), int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        centroids = centroids.astype(np.float32)
+        return centroids, alive, np.argmax(vectors[alive] @ centroids.T, axis=1)
+
+    def install(self, centroids: Optional[np.ndarray], alive: np.ndarray, labels: np.ndarray):
+        """Swap in fitted centroids; slots changed since ``prepare_training`` are relabelled"""
+        pending, self._pending = self._pending or set(), None
+        if centroids is None:
+            return
+        n = len(self.keys)
+        assignment = np.full(n, -1, dtype=np.int64)
+        assignment[alive] = labels
+        changed = np.fromiter(pending, dtype=np.int64, count=len(pending))
+        changed = changed[self._alive[changed]]
+        if len(changed):
+            assignment[changed] = np.argmax(self._vectors[changed] @ centroids.T, axis=1)
+
+        self.centroids = centroids
+        self._trained_size = len(alive)
+        live = np.flatnonzero(self._alive[:n])
+        self._build_lists(live, assignment[live])
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super().to_arrays()
+        if self.is_trained:
+            arrays["centroids"] = self.centroids
+            arrays["assignment"] = self._assignment[:len(self.keys)]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], **kwargs) -> "IVFIndex":
+        index = super().from_arrays(arrays, **kwargs)
+        capacity = len(index._alive)
+        index._assignment = np.full(capacity, -1, dtype=np.int32)
+        index._position = np.zeros(capacity, dtype=np.int64)
+        if "centroids" in arrays:
+            index.centroids = np.asarray(arrays["centroids"])
+            index._trained_size = len(index)
+            alive = np.flatnonzero(index._alive)
+            index._build_lists(alive, np.asarray(arrays["assignment"])[alive])
+        return index
+
+    def _build_lists(self, alive: np.ndarray, labels: np.ndarray):
+        """Rebuild the inverted lists from each live slot's list label"""
+        n_lists = len(self.centroids)
+        self._lists = [np.zeros(0, dtype=np.int64) for _ in range(n_lists)]
+        self._list_sizes = np.zeros(n_lists, dtype=np.int64)
+        self._assignment[:] = -1
+
+        order = np.argsort(labels, kind="stable")
+        bounds = np.searchsorted(labels[order], np.arange(n_lists + 1))
+        for list_id in range(n_lists):
+            members = alive[order[bounds[list_id]:bounds[list_id + 1]]]
+            self._lists[list_id] = members.astype(np.int64)
+            self._list_sizes[list_id] = len(members)
+            self._assignment[members] = list_id
+            self._position[members] = np.arange(len(members))
+
+    def search(self, query: np.ndarray, k: int, exclude: Optional[str] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[str, float]]:
+        if not self.is_trained:
+            return super().search(query, k, exclude)
+
+        nprobe = min(nprobe or self.nprobe, len(self._lists))
+        query = _normalize(query)
+        centroid_scores = self.centroids @ query
+        if nprobe < len(self._lists):
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(len(self._lists))
+
+        candidates = np.concatenate(
+            [self._lists[l][:self._list_sizes[l]] for l in probe]
+        )
+        return self._rank(candidates, query, k, exclude)
+
+    def _grow(self, size: int):
+        capacity = len(self._alive)
+        super()._grow(size)
+        if len(self._alive) != capacity:
+            assignment = np.full(len(self._alive), -1, dtype=np.int32)
+            assignment[:capacity] = self._assignment
+            position = np.zeros(len(self._alive), dtype=np.int64)
+            position[:capacity] = self._position
+            self._assignment, self._position = assignment, position
+
+    def _link(self, slot: int, list_id: int):
+        size = self._list_sizes[list_id]
+        members = self._lists[list_id]
+        if size == len(members):
+            grown = np.zeros(max(16, 2 * size), dtype=np.int64)
+            grown[:size] = members[:size]
+            self._lists[list_id] = members = grown
+        members[size] = slot
+        self._assignment[slot] = list_id
+        self._position[slot] = size
+        self._list_sizes[list_id] = size + 1
+
+    def _unlink(self, slot: int):
+        list_id = self._assignment[slot]
+        if list_id < 0:
+            return
+        # Swap-remove: move the list's last member into the vacated position
+        members = self._lists[list_id]
+        last = self._list_sizes[list_id] - 1
+        position = self._position[slot]
+        moved = members[last]
+        members[position] = moved
+        self._position[moved] = position
+        self._list_sizes[list_id] = last
+        self._assignment[slot] = -1
+
+
+INDEX_TYPES = {"exact": ExactIndex, "ivf": IVFIndex}
+
+
+def create_index(kind: str, dim: int, **kwargs) -> ExactIndex:
+    """Build a vector index by name (``exact`` or ``ivf``)"""
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {kind}")
+    if kind == "exact":
+        return ExactIndex(dim)
+    return INDEX_TYPES[kind](dim, **kwargs)
+
+
+class RandomProjector:
+    """Maps sparse token sets to dense vectors with a fixed Gaussian projection.
+
+    Each token gets its own random direction, so the cosine between two
+    embedded sets approximates the cosine between their binary indicator
+    vectors. Tokens are either integer column indices or strings, which are
+    hashed to a stable seed. String directions are regenerated from that
+    seed on demand; only the ``token_cache_size`` most recently used are kept.
+    """
+
+    BLOCK = 1024
+
+    def __init__(self, dim: int = 64, seed: int = 0, token_cache_size: int = 4096):
+        self.dim = dim
+        self.seed = seed
+        self.token_cache_size = token_cache_size
+        self._table = np.zeros((0, dim), dtype=np.float32)
+        self._token_vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def embed_indices(self, indices: np.ndarray) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        if not len(indices):
+            return np.zeros(self.dim, dtype=np.float32)
+        self._ensure(int(indices.max()) + 1)
+        return self._table[indices].sum(axis=0)
+
+    def embed_rows(self, indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        """``embed_indices`` for every row of a CSR-style (indptr, indices) pair"""
+        rows = len(indptr) - 1
+        self._ensure(int(indices.max()) + 1 if len(indices) else 0)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(rows, len(self._table)),
+        )
+        return np.asarray(incidence @ self._table, dtype=np.float32)
+
+    def embed_tokens(self, tokens: Iterable[str]) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in tokens:
+            # Categories and tags repeat heavily, so recent directions are cached
+            direction = self._token_vectors.get(token)
+            if direction is None:
+                seed = zlib.crc32(token.encode("utf-8")) ^ self.seed
+                direction = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+                self._token_vectors[token] = direction
+                if len(self._token_vectors) > self.token_cache_size:
+                    self._token_vectors.popitem(last=False)
+            else:
+                self._token_vectors.move_to_end(token)
+            vector += direction
+        return vector
+
+    def _ensure(self, size: int):
+        # Rows are generated in fixed blocks so a token's direction depends
+        # only on its index, not on the order the table happened to grow in
+        blocks = [self._table]
+        for block in range(len(self._table) // self.BLOCK, -(-size // self.BLOCK)):
+            rng = np.random.default_rng((self.seed, block))
+            blocks.append(rng.standard_normal((self.BLOCK, self.dim), dtype=np.float32))
+        if len(blocks) > 1:
+            self._table = np.vstack(blocks)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
@@ -0,0 +1,123 @@
+"""Recall and latency of the IVF similar-user index against the exact paths.
+
+Usage: python benchmarks/ann_benchmark.py --users 100000 --items 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import ExactIndex, IVFIndex, RandomProjector  # noqa: E402
+from user_item_matrix import UserItemMatrix  # noqa: E402
+
+
+def build(num_users: int, num_items: int, history: int, seed: int):
+    rng = np.random.default_rng(seed)
+    # Zipf-like item popularity and history lengths
+    popularity = 1.0 / np.arange(1, num_items + 1) ** 0.8
+    popularity /= popularity.sum()
+    lengths = np.minimum(rng.zipf(1.8, num_users), history * 10)
+
+    matrix = UserItemMatrix()
+    for u in range(num_users):
+        items = rng.choice(num_items, int(lengths[u]) + 1, p=popularity)
+        matrix.set_user_items(f"u{u}", [f"p{i}" for i in items])
+    matrix.compact()
+    return matrix
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {"p50_ms": float(np.percentile(samples, 50)), "p99_ms": float(np.percentile(samples, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--candidates", type=int, default=50)
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    matrix = build(args.users, args.items, args.history, args.seed)
+    projector = RandomProjector(args.dim, seed=1)
+    exact = ExactIndex(args.dim)
+    ivf = IVFIndex(args.dim, min_train_size=args.users + 1)
+    for user_id in matrix.user_ids:
+        vector = projector.embed_indices(matrix.user_items(user_id))
+        exact.add(user_id, vector)
+        ivf.add(user_id, vector)
+
+    started = time.perf_counter()
+    ivf.train()
+    train_seconds = time.perf_counter() - started
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = [matrix.user_ids[i] for i in rng.choice(matrix.num_users, args.queries, replace=False)]
+
+    # Reference: exact cosine over the same vectors, and exact Jaccard
+    exact_vectors, exact_latency = {}, []
+    jaccard, jaccard_latency = {}, []
+    for user_id in queries:
+        query = exact.vector(user_id)
+        started = time.perf_counter()
+        exact_vectors[user_id] = {key for key, _ in exact.search(query, args.k, exclude=user_id)}
+        exact_latency.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        jaccard[user_id] = [s for _, s in matrix.similar_users(user_id)[:args.k]]
+        jaccard_latency.append(time.perf_counter() - started)
+
+    results = {
+        "users": matrix.num_users,
+        "items": matrix.num_items,
+        "nnz": matrix.nnz,
+        "k": args.k,
+        "n_lists": len(ivf.centroids),
+        "train_seconds": train_seconds,
+        "exact_vector_scan": percentiles(exact_latency),
+        "exact_jaccard": percentiles(jaccard_latency),
+        "ivf": [],
+    }
+
+    for nprobe in args.nprobe:
+        recalls, jaccard_recalls, latency = [], [], []
+        for user_id in queries:
+            query = ivf.vector(user_id)
+            started = time.perf_counter()
+            found = ivf.search(query, max(args.k, args.candidates), exclude=user_id, nprobe=nprobe)
+            reranked = matrix.similarities(user_id, [key for key, _ in found])[:args.k]
+            latency.append(time.perf_counter() - started)
+
+            truth = exact_vectors[user_id]
+            if truth:
+                recalls.append(len(truth & {key for key, _ in found[:args.k]}) / len(truth))
+            # Ties make neighbour IDs ambiguous, so compare the score profile:
+            # the share of the exact top-k Jaccard mass the ANN path recovers
+            best = sum(jaccard[user_id])
+            if best > 0:
+                jaccard_recalls.append(min(1.0, sum(s for _, s in reranked) / best))
+
+        results["ivf"].append({
+            "nprobe": nprobe,
+            "vector_recall_at_k": float(np.mean(recalls)) if recalls else None,
+            "jaccard_mass_recall_at_k": float(np.mean(jaccard_recalls)) if jaccard_recalls else None,
+            **percentiles(latency),
+        })
+
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
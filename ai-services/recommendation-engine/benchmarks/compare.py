@@ -0,0 +1,66 @@
+"""Compare two engine_benchmark.py result files and flag regressions.
+
+Usage: python benchmarks/compare.py baseline.json candidate.json --threshold 0.1
+
+Exits with status 1 when any metric got worse by more than ``threshold``
+(a fraction). Times and sizes should go down; rates (``*_per_second``)
+should go up.
+"""
+import argparse
+import json
+import sys
+
+SECTIONS = ("ingest", "background", "latency", "api", "memory")
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not key == "n":
+            flat[name] = float(value)
+    return flat
+
+
+def change(name: str, before: float, after: float) -> float:
+    """Relative change, positive when ``after`` is worse"""
+    if not before:
+        return 0.0
+    if name.endswith("_per_second"):
+        return (before - after) / before
+    return (after - before) / before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    settings = [{k: v for k, v in run["meta"]["args"].items() if k != "output"} for run in (baseline, candidate)]
+    if settings[0] != settings[1]:
+        print("warning: runs used different arguments", file=sys.stderr)
+
+    before = flatten({s: baseline[s] for s in SECTIONS if s in baseline})
+    after = flatten({s: candidate[s] for s in SECTIONS if s in candidate})
+    regressions = 0
+    print(f"{'metric':60} {baseline['meta']['commit']:>12} {candidate['meta']['commit']:>12} {'change':>8}")
+    for name in sorted(before.keys() & after.keys()):
+        delta = change(name, before[name], after[name])
+        flag = ""
+        if delta > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{name:60} {before[name]:12.4g} {after[name]:12.4g} {delta:+8.1%}{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""Latency, throughput and memory of every RecommendationEngine path on synthetic data.
+
+Runs fully offline: Redis is replaced by an in-process fake and the API is
+driven through FastAPI's test client. Results are one JSON document; use
+benchmarks/compare.py to diff two runs, e.g. from two commits.
+
+Usage: python benchmarks/engine_benchmark.py --users 100000 --products 50000 --output run.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.WARNING)
+
+import main as service  # noqa: E402
+from fake_redis import install  # noqa: E402
+from memory_benchmark import measure  # noqa: E402
+from synthetic import make_events, make_products, make_profiles  # noqa: E402
+
+SCORING_TYPES = ("collaborative", "content", "social", "general")
+
+
+def summarize(samples) -> dict:
+    samples = np.asarray(samples) * 1000.0
+    return {
+        "n": len(samples),
+        "mean_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+    }
+
+
+def timed(fn, args_list) -> dict:
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_ingest(engine, profiles, products, updates, rng) -> dict:
+    start = time.perf_counter()
+    counts = engine.bulk_load(profiles, products)
+    bulk = time.perf_counter() - start
+
+    # Single updates replay existing profiles, as a profile edit would
+    chosen = rng.choice(len(profiles), min(updates, len(profiles)), replace=False)
+    single = timed(engine.add_user_profile, [(profiles[i],) for i in chosen])
+    start = time.perf_counter()
+    engine.user_item_matrix.compact()
+    compact = time.perf_counter() - start
+    return {
+        "bulk_seconds": bulk,
+        "bulk_records_per_second": (counts["profiles"] + counts["products"]) / bulk,
+        "add_user_profile": single,
+        "compact_seconds": compact,
+    }
+
+
+def bench_background(engine, events, als: bool) -> dict:
+    results = {}
+    start = time.perf_counter()
+    engine.record_events(events)
+    results["record_events_per_second"] = len(events) / (time.perf_counter() - start)
+    purchases = [e for e in events if e.event_type == "purchase"]
+    start = time.perf_counter()
+    engine.add_purchases(purchases)
+    results["add_purchases_per_second"] = len(purchases) / (time.perf_counter() - start)
+    for name, fn in [("refresh_trending", engine.refresh_trending),
+                     ("refit_text_index", engine.refit_text_index)]:
+        start = time.perf_counter()
+        fn()
+        results[f"{name}_seconds"] = time.perf_counter() - start
+    if als:
+        start = time.perf_counter()
+        engine.train_factor_model(**service.ALS_OPTIONS)
+        results["train_factor_model_seconds"] = time.perf_counter() - start
+    return results
+
+
+def bench_queries(engine, users, products, k) -> dict:
+    queries = [(u, k) for u in users]
+    product_ids = [p.product_id for p in products]
+    results = {
+        "collaborative": timed(engine.get_collaborative_recommendations, queries),
+        "content": timed(engine.get_content_based_recommendations, queries),
+        "social": timed(engine.get_social_recommendations, queries),
+        "hybrid": timed(engine.get_hybrid_recommendations, queries),
+        "trending": timed(engine.get_trending_recommendations, [(k,)] * len(users)),
+        "similar_products": timed(engine.find_similar_products, [(p, k) for p in product_ids]),
+        "similar_text_products": timed(engine.find_similar_text_products, [(p, k) for p in product_ids]),
+        # Queries are the first words of product descriptions
+        "search_products": timed(
+            engine.search_products, [(" ".join(p.description.split()[:3]), k) for p in products]
+        ),
+    }
+    for recommendation_type in SCORING_TYPES:
+        start = time.perf_counter()
+        for _ in engine.get_batch_recommendations(users, k, recommendation_type):
+            pass
+        results[f"batch_{recommendation_type}"] = {
+            "n": len(users),
+            "mean_ms": (time.perf_counter() - start) * 1000.0 / len(users),
+        }
+    return results
+
+
+def bench_api(engine, users, k) -> dict:
+    """/recommendations end to end, first on a cold then on a warm cache"""
+    from fastapi.testclient import TestClient
+
+    service.recommendation_engine = engine
+    install(service.redis_client)
+    client = TestClient(service.app)  # no lifespan: background tasks stay off
+    results = {}
+    for recommendation_type in SCORING_TYPES:
+        for phase in ("cold", "warm"):
+            samples = []
+            for user_id in users:
+                body = {"user_id": user_id, "num_recommendations": k,
+                        "recommendation_type": recommendation_type}
+                start = time.perf_counter()
+                response = client.post("/recommendations", json=body)
+                samples.append(time.perf_counter() - start)
+                response.raise_for_status()
+            results[f"{recommendation_type}_{phase}"] = summarize(samples)
+    return results
+
+
+def bench_memory(profiles, products, similarity_index: str) -> dict:
+    def build():
+        engine = service.RecommendationEngine(similarity_index=similarity_index)
+        engine.bulk_load(profiles, products)
+        engine.user_item_matrix.compact()
+        return engine
+
+    engine, used = measure(build)
+    return {
+        "engine_bytes": used,
+        "bytes_per_user": used / max(len(profiles), 1),
+        "bytes_per_purchase": used / max(engine.user_item_matrix.nnz, 1),
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--updates", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--index", choices=service.INDEX_TYPES, default=service.SIMILARITY_INDEX)
+    parser.add_argument("--als", action="store_true", help="also train and time the factor model")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--skip-memory", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    start = time.perf_counter()
+    products = list(make_products(args.products, args.seed))
+    profiles = list(make_profiles(args.users, args.products, args.seed))
+    events = make_events(args.events, args.users, args.products, args.seed)
+    generate = time.perf_counter() - start
+
+    engine = service.RecommendationEngine(
+        similarity_index=args.index, collaborative_model="als" if args.als else "neighbours"
+    )
+    results = {
+        "meta": {
+            "commit": commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+            "generate_seconds": generate,
+        },
+        "ingest": bench_ingest(engine, profiles, products, args.updates, rng),
+        "background": bench_background(engine, events, args.als),
+    }
+    results["sizes"] = {
+        "users": engine.user_item_matrix.num_users,
+        "products": len(engine.product_features),
+        "purchases": engine.user_item_matrix.nnz,
+        "text_terms": engine.text_index.num_terms,
+    }
+
+    buyers = [p.user_id for p in profiles if p.purchase_history]
+    users = [buyers[i] for i in rng.choice(len(buyers), min(args.queries, len(buyers)), replace=False)]
+    sample = [products[i] for i in rng.choice(len(products), min(args.queries, len(products)), replace=False)]
+    results["latency"] = bench_queries(engine, users, sample, args.k)
+    if not args.skip_api:
+        results["api"] = bench_api(engine, users, args.k)
+    if not args.skip_memory:
+        del engine
+        results["memory"] = bench_memory(profiles, products, args.index)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""In-process stand-in for the Redis client so benchmarks run offline."""
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cache import RedisCache
+
+
+class FakeRedis:
+    """The subset of ``redis.asyncio.Redis`` that ``RedisCache`` uses, held in a dict"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, str]] = {}
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    async def mget(self, keys: Iterable[str]) -> List[Optional[str]]:
+        return [await self.get(key) for key in keys]
+
+    async def setex(self, key: str, ttl: int, value: str):
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def delete(self, *keys: str) -> int:
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client: FakeRedis):
+        self.client = client
+        self._calls = []
+
+    def setex(self, key: str, ttl: int, value: str):
+        self._calls.append((self.client.setex, (key, ttl, value)))
+
+    def delete(self, *keys: str):
+        self._calls.append((self.client.delete, keys))
+
+    async def execute(self) -> list:
+        return [await call(*args) for call, args in self._calls]
+
+
+def install(cache: RedisCache) -> FakeRedis:
+    """Point ``cache`` at a fresh in-process store"""
+    cache.client = FakeRedis()
+    return cache.client
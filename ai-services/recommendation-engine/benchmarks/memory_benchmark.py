@@ -0,0 +1,79 @@
+"""Bytes per user and per product: Pydantic objects vs the engine's compact stores.
+
+Usage: python benchmarks/memory_benchmark.py --users 100000 --products 50000
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+logging.disable(logging.INFO)
+
+from main import RecommendationEngine  # noqa: E402
+from synthetic import make_products, make_profiles  # noqa: E402
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    # Before: the engine held one Pydantic model per entity in plain dicts
+    _, legacy_users = measure(lambda: {p.user_id: p for p in make_profiles(args.users, args.products, args.seed)})
+    _, legacy_products = measure(lambda: {p.product_id: p for p in make_products(args.products, args.seed)})
+
+    def build_users():
+        engine = RecommendationEngine(similarity_index="exact")
+        for profile in make_profiles(args.users, args.products, args.seed):
+            engine.add_user_profile(profile)
+        engine.user_item_matrix.compact()
+        return engine
+
+    def build_products(engine):
+        for product in make_products(args.products, args.seed):
+            engine.add_product_features(product)
+        return engine
+
+    engine, engine_users = measure(build_users)
+    # Vector indexes are reported separately; they did not exist before
+    user_vectors = engine.user_vectors._vectors.nbytes
+    _, engine_products = measure(lambda: build_products(engine))
+    product_vectors = engine.product_vectors._vectors.nbytes
+
+    results = {
+        "users": args.users,
+        "products": args.products,
+        "bytes_per_user": {
+            "pydantic": legacy_users / args.users,
+            "compact": (engine_users - user_vectors) / args.users,
+            "compact_with_vector_index": engine_users / args.users,
+        },
+        "bytes_per_product": {
+            "pydantic": legacy_products / args.products,
+            "compact": (engine_products - product_vectors) / args.products,
+            "compact_with_vector_index": engine_products / args.products,
+        },
+    }
+    json.dump(results, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Seeded synthetic catalogues, users and events for the benchmarks.
+
+Product popularity, history lengths, follower counts and out-degrees all
+follow power laws, so a few products and users dominate as they do in
+production traffic. The same arguments always generate the same data.
+"""
+import time
+from typing import Iterator, List, Optional
+
+import numpy as np
+
+from main import ProductEvent, ProductFeatures, UserProfile
+
+EVENT_MIX = {"view": 0.6, "click": 0.2, "like": 0.08, "add_to_cart": 0.07, "share": 0.02, "purchase": 0.03}
+
+
+def power_law(n: int, exponent: float, rng: np.random.Generator) -> np.ndarray:
+    """Cumulative probabilities proportional to rank ** -exponent, ranks shuffled over ``n`` ids"""
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    cdf = np.cumsum(weights[rng.permutation(n)])
+    return cdf / cdf[-1]
+
+
+def draw(cdf: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    """``count`` ids sampled with replacement from a ``power_law`` distribution"""
+    return np.minimum(np.searchsorted(cdf, rng.random(count), side="right"), len(cdf) - 1)
+
+
+def lengths(count: int, exponent: float, cap: int, rng: np.random.Generator) -> np.ndarray:
+    """Zipf-distributed sizes from 1 up to ``cap``"""
+    return np.minimum(rng.zipf(exponent, count), cap)
+
+
+def make_products(num_products: int, seed: int, num_categories: int = 50,
+                  num_tags: int = 2000) -> Iterator[ProductFeatures]:
+    rng = np.random.default_rng(seed + 1)
+    tag_cdf = power_law(num_tags, 1.0, rng)
+    words = [f"word{w}" for w in range(5000)]
+    word_cdf = power_law(len(words), 1.1, rng)
+    for p in range(num_products):
+        tags = np.unique(draw(tag_cdf, int(rng.integers(1, 8)), rng))
+        text = draw(word_cdf, int(rng.integers(5, 40)), rng)
+        yield ProductFeatures(
+            product_id=f"product_{p:08d}",
+            category=f"category_{rng.integers(0, num_categories)}",
+            price=float(rng.lognormal(3.0, 1.0)),
+            rating=float(rng.uniform(1, 5)),
+            tags=[f"tag_{t}" for t in tags],
+            description=" ".join(words[w] for w in text),
+        )
+
+
+def make_profiles(num_users: int, num_products: int, seed: int, num_categories: int = 50,
+                  item_exponent: float = 0.9, history_exponent: float = 1.8, max_history: int = 500,
+                  follower_exponent: float = 0.8, degree_exponent: float = 1.7,
+                  max_connections: int = 2000) -> Iterator[UserProfile]:
+    """Users whose purchases and connections are drawn from power-law popularity.
+
+    Connections pick targets in proportion to a per-user popularity, so
+    follower counts are heavy-tailed as well as out-degrees.
+    """
+    rng = np.random.default_rng(seed)
+    item_cdf = power_law(num_products, item_exponent, rng)
+    user_cdf = power_law(num_users, follower_exponent, rng)
+    histories = lengths(num_users, history_exponent, max_history, rng)
+    degrees = lengths(num_users, degree_exponent, max_connections, rng) - 1
+    categories = [f"category_{i}" for i in range(num_categories)]
+    for u in range(num_users):
+        history = draw(item_cdf, int(histories[u]), rng)
+        connections = draw(user_cdf, int(degrees[u]), rng)
+        yield UserProfile(
+            user_id=f"user_{u:08d}",
+            preferences={categories[c]: float(rng.random()) for c in rng.integers(0, num_categories, 5)},
+            purchase_history=[f"product_{p:08d}" for p in np.unique(history)],
+            social_connections=[f"user_{f:08d}" for f in np.unique(connections) if f != u],
+            demographics={"age_band": str(rng.integers(1, 8)), "country": f"C{rng.integers(0, 40)}"},
+        )
+
+
+def make_events(num_events: int, num_users: int, num_products: int, seed: int,
+                span: float = 86400.0, now: Optional[float] = None,
+                item_exponent: float = 0.9) -> List[ProductEvent]:
+    """Engagement events over the ``span`` seconds before ``now``"""
+    rng = np.random.default_rng(seed + 2)
+    now = time.time() if now is None else now
+    products = draw(power_law(num_products, item_exponent, rng), num_events, rng)
+    users = rng.integers(0, num_users, num_events)
+    kinds = rng.choice(list(EVENT_MIX), num_events, p=list(EVENT_MIX.values()))
+    times = now - rng.uniform(0, span, num_events)
+    return [
+        ProductEvent(
+            product_id=f"product_{p:08d}", event_type=str(kind), user_id=f"user_{u:08d}", timestamp=float(t)
+        )
+        for p, u, kind, t in zip(products, users, kinds, times)
+    ]
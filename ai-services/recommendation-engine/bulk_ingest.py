@@ -0,0 +1,159 @@
+import asyncio
+import io
+import json
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Type, get_origin
+
+from pydantic import BaseModel, ValidationError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow/Parquet uploads are optional
+    pa = None
+    pq = None
+
+NDJSON = "ndjson"
+JSON = "json"
+ARROW = "arrow"
+PARQUET = "parquet"
+
+CONTENT_TYPES = {
+    "application/x-ndjson": NDJSON,
+    "application/jsonl": NDJSON,
+    "application/json": JSON,
+    "application/vnd.apache.arrow.stream": ARROW,
+    "application/vnd.apache.parquet": PARQUET,
+    "application/x-parquet": PARQUET,
+}
+
+# Rejected records reported back in full; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+class BulkFormatError(ValueError):
+    """Raised for an unsupported or unreadable upload"""
+
+
+def upload_format(content_type: Optional[str]) -> str:
+    """Map a request Content-Type to an upload format (NDJSON by default)"""
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if not media_type:
+        return NDJSON
+    if media_type not in CONTENT_TYPES:
+        raise BulkFormatError(f"Unsupported content type: {media_type}")
+    upload = CONTENT_TYPES[media_type]
+    if upload in (ARROW, PARQUET) and pa is None:
+        raise BulkFormatError(f"{upload} uploads require pyarrow")
+    return upload
+
+
+async def iter_records(chunks: AsyncIterator[bytes], upload: str) -> AsyncIterator[Tuple[int, object]]:
+    """Yield ``(row, record)`` pairs from an uploaded body.
+
+    NDJSON is parsed as it streams in; a line that is not valid JSON is
+    yielded as its ``ValueError`` so the caller can report it. A JSON array,
+    Arrow and Parquet need the whole body and are decoded off the event loop.
+    """
+    if upload == NDJSON:
+        row, buffer = 0, b""
+        async for chunk in chunks:
+            buffer += chunk
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            for line in lines:
+                row += 1
+                if line.strip():
+                    yield row, _parse_line(line)
+        if buffer.strip():
+            yield row + 1, _parse_line(buffer)
+        return
+
+    body = b"".join([chunk async for chunk in chunks])
+    if upload == JSON:
+        for row, record in enumerate(await asyncio.to_thread(_read_array, body), 1):
+            yield row, record
+        return
+
+    table = await asyncio.to_thread(_read_table, body, upload)
+    row = 0
+    for record_batch in table.to_batches():
+        for record in record_batch.to_pylist():
+            row += 1
+            yield row, record
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def _read_array(body: bytes) -> list:
+    try:
+        records = json.loads(body)
+    except ValueError as e:
+        raise BulkFormatError(f"Unreadable {JSON} upload: {e}")
+    if not isinstance(records, list):
+        raise BulkFormatError(f"A {JSON} upload must be an array of records")
+    return records
+
+
+def _read_table(body: bytes, upload: str):
+    try:
+        if upload == ARROW:
+            return pa.ipc.open_stream(body).read_all()
+        return pq.read_table(io.BytesIO(body))
+    except pa.ArrowException as e:
+        raise BulkFormatError(f"Unreadable {upload} upload: {e}")
+
+
+class IngestReport:
+    """Validates uploaded records and tallies what was loaded or rejected"""
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        # Arrow map columns come back as lists of (key, value) pairs
+        self.map_fields = [
+            name for name, field in model.model_fields.items() if get_origin(field.annotation) is dict
+        ]
+        self.loaded = 0
+        self.rejected = 0
+        self.errors: List[Dict] = []
+
+    def validate(self, row: int, record) -> Optional[BaseModel]:
+        if isinstance(record, dict):
+            try:
+                for name in self.map_fields:
+                    if isinstance(record.get(name), list):
+                        record[name] = dict(record[name])
+                return self.model(**record)
+            except ValidationError as e:
+                error = e.errors()[0]
+                message = f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}"
+            except (TypeError, ValueError) as e:
+                message = str(e)
+        elif isinstance(record, Exception):
+            message = f"Invalid JSON: {record}"
+        else:
+            message = "Record must be an object"
+
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+        return None
+
+    def summary(self) -> Dict:
+        return {"loaded": self.loaded, "rejected": self.rejected, "errors": self.errors}
+
+
+def batched(items: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most ``size`` items"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import redis.asyncio as aioredis
+
+logger = logging.getLogger(__name__)
+
+
+class RedisCache:
+    """Non-blocking Redis access for the recommendation service.
+
+    All calls go through a bounded asyncio connection pool and are capped by
+    ``timeout`` seconds. Redis is treated as an optional accelerator: any
+    error or timeout is logged and swallowed, reads return ``None`` and the
+    caller falls back to the in-process engine. After a failure the cache
+    stays bypassed for ``backoff`` seconds so a dead or slow Redis costs
+    nothing per request instead of one timeout each.
+    """
+
+    def __init__(self, url: str, max_connections: int = 32, timeout: float = 0.05,
+                 backoff: float = 5.0):
+        self.timeout = timeout
+        self.backoff = backoff
+        self.pool = aioredis.ConnectionPool.from_url(
+            url,
+            max_connections=max_connections,
+            decode_responses=True,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout,
+        )
+        self.client = aioredis.Redis(connection_pool=self.pool)
+        self._bypass_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._bypass_until
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._call(self.client.get(key), "get")
+
+    async def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        if not keys:
+            return []
+        values = await self._call(self.client.mget(keys), "mget")
+        return values if values is not None else [None] * len(keys)
+
+    async def setex(self, key: str, ttl: int, value: str):
+        await self._call(self.client.setex(key, ttl, value), "setex")
+
+    async def setex_many(self, items: Dict[str, str], ttl: int, delete: Iterable[str] = ()):
+        """Write (and optionally delete) several keys with one pipelined round trip"""
+        delete = list(delete)
+        if not items and not delete:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.setex(key, ttl, value)
+        if delete:
+            pipe.delete(*delete)
+        await self._call(pipe.execute(), "pipeline")
+
+    async def delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        if keys:
+            await self._call(self.client.delete(*keys), "delete")
+
+    async def close(self):
+        await self.pool.disconnect()
+
+    async def _call(self, operation, name: str):
+        if not self.available:
+            operation.close()
+            return None
+        try:
+            return await asyncio.wait_for(operation, self.timeout)
+        except Exception as e:
+            self._bypass_until = time.monotonic() + self.backoff
+            logger.warning(f"Redis {name} failed, bypassing cache for {self.backoff}s: {e!r}")
+            return None
+
+
+class LocalCache:
+    """Size-bounded in-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, keys: Iterable[str]):
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+class RecommendationCache:
+    """Two-tier recommendation cache: in-process LRU in front of Redis.
+
+    Entries are keyed by user and recommendation type only. Each entry holds
+    the engine's ranked source lists computed to some ``depth``, and any
+    request for ``num_recommendations <= depth`` is served by slicing them,
+    so different page sizes share one entry. The local tier uses a short TTL
+    because invalidations only reach the local tier of the worker that
+    handled the update.
+    """
+
+    def __init__(self, redis_cache: RedisCache, recommendation_types: Iterable[str],
+                 ttl: int = 1800, local_entries: int = 10000, local_ttl: float = 60.0):
+        self.redis = redis_cache
+        self.recommendation_types = list(recommendation_types)
+        self.ttl = ttl
+        self.local = LocalCache(local_entries, local_ttl)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        # Bumped on invalidation so results computed before it are not stored
+        self._epochs = [0] * 4096
+
+    def epoch(self, user_id: str) -> int:
+        return self._epochs[hash(user_id) % len(self._epochs)]
+
+    def key(self, user_id: str, recommendation_type: str) -> str:
+        return f"recommendations:{user_id}:{recommendation_type}"
+
+    def keys(self, user_id: str) -> List[str]:
+        return [self.key(user_id, t) for t in self.recommendation_types]
+
+    async def get(self, user_id: str, recommendation_type: str,
+                  num_recommendations: int) -> Optional[List[List[Dict]]]:
+        """Cached source lists deep enough for ``num_recommendations``, if any"""
+        key = self.key(user_id, recommendation_type)
+        entry = self.local.get(key)
+        if entry is not None and entry["depth"] >= num_recommendations:
+            self.local_hits += 1
+            return entry["sources"]
+
+        cached = await self.redis.get(key)
+        if cached:
+            entry = json.loads(cached)
+            if entry["depth"] >= num_recommendations:
+                self.local.set(key, entry)
+                self.redis_hits += 1
+                return entry["sources"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, user_id: str, recommendation_type: str, depth: int,
+                  sources: List[List[Dict]], epoch: Optional[int] = None):
+        """Store source lists unless the user was invalidated since ``epoch``"""
+        if epoch is not None and epoch != self.epoch(user_id):
+            return
+        key = self.key(user_id, recommendation_type)
+        entry = {"depth": depth, "sources": sources}
+        self.local.set(key, entry)
+        await self.redis.setex(key, self.ttl, json.dumps(entry))
+
+    def invalidate_local(self, user_id: str):
+        self._epochs[hash(user_id) % len(self._epochs)] += 1
+        self.local.delete(self.keys(user_id))
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        redis_lookups = self.redis_hits + self.misses
+        return {
+            "lookups": lookups,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "local_hit_ratio": self.local_hits / lookups if lookups else 0.0,
+            "redis_hit_ratio": self.redis_hits / redis_lookups if redis_lookups else 0.0,
+            "hit_ratio": (self.local_hits + self.redis_hits) / lookups if lookups else 0.0,
+            "local_entries": len(self.local),
+        }
@@ -0,0 +1,226 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Reasons attached to recommendations, stored as one byte per candidate
+REASONS = (
+    "users_like_you", "based_on_interests", "friends_purchased", "friends_of_friends_purchased", "trending",
+)
+_REASON_CODES = {reason: code for code, reason in enumerate(REASONS)}
+
+# One packed record per candidate: interned product ID, score, reason code
+CANDIDATE_DTYPE = np.dtype([("product", np.int32), ("score", np.float32), ("reason", np.uint8)])
+
+
+class _Pool:
+    __slots__ = ("built_at", "depths", "bounds", "candidates")
+
+    def __init__(self, built_at: float, depths: List[int], bounds: np.ndarray, candidates: np.ndarray):
+        self.built_at = built_at
+        self.depths = depths  # depth each source list was scored to
+        self.bounds = bounds  # source i is candidates[bounds[i]:bounds[i + 1]]
+        self.candidates = candidates
+
+
+class _User:
+    __slots__ = ("active", "changed", "invalidated", "built", "pools")
+
+    def __init__(self):
+        self.active = 0.0
+        self.changed = 0.0  # last change to the user's inputs
+        self.invalidated = 0.0  # last change that makes existing pools unusable
+        self.built = 0.0  # oldest pool's build time, once every type has one
+        self.pools: Dict[str, _Pool] = {}
+
+
+class CandidatePools:
+    """Precomputed ranked source lists for recently active users.
+
+    A pool holds what ``get_recommendation_sources`` returned for a user
+    and recommendation type, packed as ``CANDIDATE_DTYPE`` records. A
+    request then only drops the products bought since the pool was built
+    and composes the result, instead of scoring from scratch. Products and
+    their order are kept as scored; scores are rounded to float32.
+
+    Activity is recorded with ``touch``; only the ``max_users`` most
+    recently active users are tracked, and their pools go with them.
+    ``due`` ranks users for the background refresh: those with a missing
+    or outdated pool come first, most recently active first, then pools
+    older than ``max_age``, oldest first. Both groups are kept in heaps
+    that skip superseded entries lazily, so ``due`` costs about the number
+    of users returned and ``touch`` never waits behind a scan of every
+    tracked user. ``changed`` marks a user's pools outdated but still
+    servable, as after a purchase, which the purchase filter covers.
+    ``invalidate`` also stops them being served, as after a profile update.
+    """
+
+    def __init__(self, recommendation_types: Iterable[str], depth: int = 100, max_users: int = 100000,
+                 max_age: float = 600.0):
+        self.recommendation_types = list(recommendation_types)
+        self.depth = depth
+        self.max_users = max_users
+        self.max_age = max_age
+        self.product_ids: List[str] = []
+        self.product_index: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self._users: "OrderedDict[str, _User]" = OrderedDict()
+        # (-active, user_id) for users whose pools need building and
+        # (built + max_age, user_id) for the rest
+        self._stale: List[tuple] = []
+        self._expiry: List[tuple] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @property
+    def num_pools(self) -> int:
+        with self._lock:
+            return sum(len(user.pools) for user in self._users.values())
+
+    def touch(self, user_id: str, now: Optional[float] = None):
+        """Record activity by ``user_id``, evicting the least recently active user past ``max_users``"""
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                user = self._users[user_id] = _User()
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            user.active = time.time() if now is None else now
+            if self._is_stale(user):
+                self._push(self._stale, (-user.active, user_id))
+
+    def changed(self, user_ids: Iterable[str], invalidate: bool = False):
+        """Queue tracked users' pools for rebuilding, optionally refusing to serve them meanwhile"""
+        now = time.time()
+        with self._lock:
+            for user_id in user_ids:
+                user = self._users.get(user_id)
+                if user is None:
+                    continue
+                user.changed = now
+                if invalidate:
+                    user.invalidated = now
+                self._push(self._stale, (-user.active, user_id))
+
+    def invalidate(self, user_ids: Iterable[str]):
+        self.changed(user_ids, invalidate=True)
+
+    def due(self, limit: int, now: Optional[float] = None) -> List[str]:
+        """Up to ``limit`` users whose pools should be rebuilt, most urgent first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            due = []
+            due += self._take(self._stale, limit, lambda user, key: user.active == -key and self._is_stale(user))
+            due += self._take(
+                self._expiry, limit - len(due),
+                lambda user, key: key == user.built + self.max_age and key < now and not self._is_stale(user),
+                stop=lambda key: key >= now, skip=set(due),
+            )
+        return due
+
+    def store(self, user_id: str, recommendation_type: str, depths: List[int],
+              sources: List[List[Dict]], built_at: float):
+        """Pack and keep ``sources``, scored with ``depths`` from state as of ``built_at``"""
+        candidates = np.zeros(sum(len(source) for source in sources), dtype=CANDIDATE_DTYPE)
+        bounds = np.zeros(len(sources) + 1, dtype=np.int32)
+        np.cumsum([len(source) for source in sources], out=bounds[1:])
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is None:
+                return
+            recs = [rec for source in sources for rec in source]
+            candidates["product"] = [self._intern(rec["product_id"]) for rec in recs]
+            candidates["score"] = [rec["score"] for rec in recs]
+            candidates["reason"] = [_REASON_CODES[rec["reason"]] for rec in recs]
+            user.pools[recommendation_type] = _Pool(built_at, list(depths), bounds, candidates)
+            if len(user.pools) == len(self.recommendation_types):
+                user.built = min(pool.built_at for pool in user.pools.values())
+            if self._is_stale(user):
+                self._push(self._stale, (-user.active, user_id))
+            else:
+                self._push(self._expiry, (user.built + self.max_age, user_id))
+
+    def lookup(self, user_id: str, recommendation_type: str, depths: List[int],
+               purchased: Callable[[List[str]], np.ndarray]) -> Optional[List[List[Dict]]]:
+        """Source lists ``depths`` deep from the user's pool, less the products ``purchased`` flags.
+
+        None when there is no usable pool, or when filtering left a source
+        list shorter than asked for while more candidates might exist.
+        """
+        with self._lock:
+            user = self._users.get(user_id)
+            pool = None if user is None else user.pools.get(recommendation_type)
+            if pool is None or pool.built_at <= user.invalidated or len(pool.depths) != len(depths) \
+                    or any(built < wanted for built, wanted in zip(pool.depths, depths)):
+                self.misses += 1
+                return None
+            product_ids = [self.product_ids[p] for p in pool.candidates["product"]]
+
+        bought = purchased(product_ids)
+        sources = []
+        for i, wanted in enumerate(depths):
+            start, end = pool.bounds[i], pool.bounds[i + 1]
+            keep = np.flatnonzero(~bought[start:end])[:wanted] + start
+            # A source shorter than its depth was exhaustive when scored
+            if len(keep) < wanted and end - start >= pool.depths[i]:
+                with self._lock:
+                    self.misses += 1
+                return None
+            candidates = pool.candidates[keep]
+            sources.append([
+                {"product_id": product_ids[k], "score": float(score), "reason": REASONS[reason]}
+                for k, score, reason in zip(keep, candidates["score"], candidates["reason"])
+            ])
+        with self._lock:
+            self.hits += 1
+        return sources
+
+    def _is_stale(self, user: _User) -> bool:
+        return len(user.pools) < len(self.recommendation_types) or user.built <= user.changed
+
+    def _take(self, heap: List[tuple], limit: int, valid, stop=None, skip=()) -> List[str]:
+        """Up to ``limit`` users from the top of ``heap`` whose entries are ``valid``.
+
+        Superseded entries are dropped; the returned ones stay queued until
+        a rebuild supersedes them.
+        """
+        taken, kept, seen = [], [], set(skip)
+        while heap and len(taken) < limit:
+            if stop is not None and stop(heap[0][0]):
+                break
+            key, user_id = entry = heapq.heappop(heap)
+            user = self._users.get(user_id)
+            if user is None or user_id in seen or not valid(user, key):
+                continue
+            seen.add(user_id)
+            taken.append(user_id)
+            kept.append(entry)
+        for entry in kept:
+            heapq.heappush(heap, entry)
+        return taken
+
+    def _push(self, heap: List[tuple], entry: tuple):
+        heapq.heappush(heap, entry)
+        if len(heap) > 4 * max(len(self._users), 1024):
+            self._rebuild_heaps()
+
+    def _rebuild_heaps(self):
+        self._stale = [(-u.active, i) for i, u in self._users.items() if self._is_stale(u)]
+        self._expiry = [(u.built + self.max_age, i) for i, u in self._users.items() if not self._is_stale(u)]
+        heapq.heapify(self._stale)
+        heapq.heapify(self._expiry)
+
+    def _intern(self, product_id: str) -> int:
+        idx = self.product_index.get(product_id)
+        if idx is None:
+            idx = self.product_index[product_id] = len(self.product_ids)
+            self.product_ids.append(product_id)
+        return idx
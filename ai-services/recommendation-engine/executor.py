@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the scoring queue is full; the caller should retry later"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Scoring queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer, with waiting writers served first"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class ScoringExecutor:
+    """Thread pool for CPU-heavy engine work with a bounded queue.
+
+    Keeps scoring off the event loop so cheap endpoints stay responsive.
+    At most ``max_pending`` jobs may be queued or running; beyond that
+    ``run`` raises ``ExecutorSaturated`` instead of queueing. A job that
+    exceeds ``timeout`` seconds raises ``asyncio.TimeoutError`` to its caller;
+    the job is cancelled if it has not started yet. ``on_start``, if given,
+    is called on the worker with the seconds each job spent queued.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, timeout: float, retry_after: int = 1,
+                 on_start: Optional[Callable[[float], None]] = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.on_start = on_start
+        self.pending = 0
+        self.running = 0
+        self._running_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scoring")
+
+    @property
+    def queued(self) -> int:
+        """Accepted jobs still waiting for a worker"""
+        return max(self.pending - self.running, 0)
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        if self.pending >= self.max_pending:
+            raise ExecutorSaturated(self.retry_after)
+
+        loop = asyncio.get_running_loop()
+        self.pending += 1
+        future = self._pool.submit(self._job, time.perf_counter(), fn, args)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(future)), timeout or self.timeout
+            )
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _job(self, submitted: float, fn: Callable, args: tuple):
+        with self._running_lock:
+            self.running += 1
+        try:
+            if self.on_start is not None:
+                self.on_start(time.perf_counter() - submitted)
+            return fn(*args)
+        finally:
+            with self._running_lock:
+                self.running -= 1
+
+    def _release(self):
+        self.pending -= 1
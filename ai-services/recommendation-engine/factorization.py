@@ -0,0 +1,137 @@
+import numpy as np
+from scipy import sparse
+from typing import Dict, Optional
+
+from topk import top_k_indices
+
+
+class FactorModel:
+    """Dense user and item factors from a trained factorization.
+
+    Factor rows are the user and item positions of the user-item matrix the
+    model was trained on; positions are stable, so the model stays valid as
+    the matrix grows. Users that joined after training are folded in from
+    their purchases with one ``factors x factors`` solve.
+    """
+
+    def __init__(self, user_factors: np.ndarray, item_factors: np.ndarray,
+                 regularization: float, alpha: float):
+        self.user_factors = user_factors
+        self.item_factors = item_factors
+        self.regularization = regularization
+        self.alpha = alpha
+        factors = item_factors.shape[1]
+        self._gram = (item_factors.T @ item_factors).astype(np.float64) + regularization * np.eye(factors)
+
+    @property
+    def num_users(self) -> int:
+        return len(self.user_factors)
+
+    @property
+    def num_items(self) -> int:
+        return len(self.item_factors)
+
+    def user_vector(self, position: Optional[int], items: np.ndarray) -> np.ndarray:
+        """Trained factors for a known user, otherwise folded in from ``items``"""
+        if position is not None and position < self.num_users:
+            return self.user_factors[position]
+        return self.fold_in(items)
+
+    def fold_in(self, items: np.ndarray) -> np.ndarray:
+        """Least-squares user factors for a purchase set, holding items fixed"""
+        items = items[items < self.num_items]
+        bought = self.item_factors[items].astype(np.float64)
+        gram = self._gram + self.alpha * (bought.T @ bought)
+        target = (1.0 + self.alpha) * bought.sum(axis=0)
+        return np.linalg.solve(gram, target).astype(np.float32)
+
+    def recommend(self, vector: np.ndarray, k: int, exclude: np.ndarray = None):
+        """Top ``k`` ``(item positions, scores)`` for a user vector, best first"""
+        scores = self.item_factors @ vector
+        if exclude is not None and len(exclude):
+            scores[exclude[exclude < self.num_items]] = -np.inf
+        top = top_k_indices(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return top, scores[top]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        return {"user_factors": self.user_factors, "item_factors": self.item_factors}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], regularization: float,
+                    alpha: float) -> "FactorModel":
+        return cls(arrays["user_factors"], arrays["item_factors"], regularization, alpha)
+
+
+class ImplicitALS:
+    """Alternating least squares for implicit feedback.
+
+    Follows Hu, Koren and Volinsky: every purchase is a positive preference
+    with confidence ``1 + alpha``, every other cell a zero preference with
+    confidence 1. Each half-step solves the per-row least-squares systems
+    approximately with a few conjugate-gradient steps warm-started from the
+    previous factors, vectorized over blocks of rows so that no dense
+    ``users x items`` array is ever built.
+    """
+
+    def __init__(self, factors: int = 64, regularization: float = 0.05, alpha: float = 20.0,
+                 iterations: int = 10, cg_steps: int = 3, block_nnz: int = 1 << 20, seed: int = 0):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.block_nnz = block_nnz
+        self.seed = seed
+
+    def fit(self, matrix: sparse.csr_matrix) -> FactorModel:
+        """Train on a binary users x items CSR matrix"""
+        rng = np.random.default_rng(self.seed)
+        num_users, num_items = matrix.shape
+        users = (rng.standard_normal((num_users, self.factors)) * 0.01).astype(np.float32)
+        items = (rng.standard_normal((num_items, self.factors)) * 0.01).astype(np.float32)
+        by_item = matrix.T.tocsr()
+
+        for _ in range(self.iterations):
+            self._solve(matrix, users, items)
+            self._solve(by_item, items, users)
+        return FactorModel(users, items, self.regularization, self.alpha)
+
+    def _solve(self, matrix: sparse.csr_matrix, solved: np.ndarray, fixed: np.ndarray):
+        """One half-step: update ``solved`` rows in place with ``fixed`` held constant"""
+        gram = fixed.T @ fixed + self.regularization * np.eye(self.factors, dtype=np.float32)
+        indptr = matrix.indptr
+        start = 0
+        while start < matrix.shape[0]:
+            # Rows are taken in blocks of roughly ``block_nnz`` purchases
+            end = int(np.searchsorted(indptr, indptr[start] + self.block_nnz, side="right"))
+            end = min(max(end - 1, start + 1), matrix.shape[0])
+            solved[start:end] = self._conjugate_gradient(matrix[start:end], solved[start:end], fixed, gram)
+            start = end
+
+    def _conjugate_gradient(self, block: sparse.csr_matrix, x: np.ndarray, fixed: np.ndarray,
+                            gram: np.ndarray) -> np.ndarray:
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        bought = fixed[block.indices]
+
+        def apply(p: np.ndarray) -> np.ndarray:
+            # (gram + alpha * Y_u^T Y_u) p for every row at once
+            dots = np.einsum("nf,nf->n", bought, p[rows])
+            weighted = sparse.csr_matrix((dots, block.indices, block.indptr), shape=block.shape)
+            return p @ gram + self.alpha * (weighted @ fixed)
+
+        residual = (1.0 + self.alpha) * (block @ fixed) - apply(x)
+        direction = residual.copy()
+        norm = np.einsum("bf,bf->b", residual, residual)
+        for _ in range(self.cg_steps):
+            product = apply(direction)
+            curvature = np.einsum("bf,bf->b", direction, product)
+            step = np.divide(norm, curvature, out=np.zeros_like(norm), where=curvature > 0)
+            x = x + step[:, None] * direction
+            residual -= step[:, None] * product
+            new_norm = np.einsum("bf,bf->b", residual, residual)
+            ratio = np.divide(new_norm, norm, out=np.zeros_like(norm), where=norm > 0)
+            direction = residual + ratio[:, None] * direction
+            norm = new_norm
+        return x
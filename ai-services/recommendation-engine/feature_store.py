@@ -0,0 +1,170 @@
+import numpy as np
+from scipy import sparse
+from typing import Dict, Iterable, List, Optional
+
+from snapshot import pack_rows, pack_strings, unpack_rows, unpack_strings
+
+
+class ProductFeatureStore:
+    """Columnar product catalogue used for batched content scoring.
+
+    Prices, ratings and category codes live in parallel NumPy arrays indexed
+    by an integer product position, and tags in a sparse product x tag
+    incidence matrix. The incidence matrix is rebuilt lazily from per-product
+    tag rows the first time it is read after an update.
+    """
+
+    def __init__(self):
+        self.product_index: Dict[str, int] = {}
+        self.product_ids: List[str] = []
+        self.category_index: Dict[str, int] = {}
+        self.categories: List[str] = []
+        self.tag_index: Dict[str, int] = {}
+        self.tags: List[str] = []
+        self.price = np.zeros(16, dtype=np.float64)
+        self.rating = np.zeros(16, dtype=np.float64)
+        self.category = np.zeros(16, dtype=np.int32)
+        self.tag_count = np.zeros(16, dtype=np.int32)
+        self._tag_rows: List[np.ndarray] = []
+        self._tag_matrix: Optional[sparse.csr_matrix] = None
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.product_index
+
+    @property
+    def tag_matrix(self) -> sparse.csr_matrix:
+        """Product x tag incidence matrix"""
+        if self._tag_matrix is None or self._tag_matrix.shape != (len(self), len(self.tags)):
+            lengths = self.tag_count[:len(self)]
+            indptr = np.zeros(len(self) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            indices = np.concatenate(self._tag_rows) if self._tag_rows else np.zeros(0)
+            self._tag_matrix = sparse.csr_matrix(
+                (np.ones(len(indices), dtype=np.float32), indices.astype(np.int32), indptr),
+                shape=(len(self), len(self.tags)),
+            )
+        return self._tag_matrix
+
+    def add(self, product_id: str, category: str, price: float, rating: float, tags: Iterable[str]) -> int:
+        """Insert or update a product and return its position"""
+        idx = self.product_index.get(product_id)
+        if idx is None:
+            idx = len(self.product_ids)
+            self.product_index[product_id] = idx
+            self.product_ids.append(product_id)
+            self._tag_rows.append(None)
+            if idx >= len(self.price):
+                self._grow(max(16, 2 * len(self.price)))
+
+        self.price[idx] = price
+        self.rating[idx] = rating
+        self.category[idx] = self._code(self.category_index, self.categories, category)
+        row = np.unique(np.asarray(
+            [self._code(self.tag_index, self.tags, tag) for tag in tags], dtype=np.int32
+        ))
+        self._tag_rows[idx] = row
+        self.tag_count[idx] = len(row)
+        self._tag_matrix = None
+        return idx
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        n = len(self)
+        tag_indptr, tag_indices = pack_rows(self._tag_rows)
+        return {
+            "product_ids": pack_strings(self.product_ids),
+            "categories": pack_strings(self.categories),
+            "tags": pack_strings(self.tags),
+            "price": self.price[:n],
+            "rating": self.rating[:n],
+            "category": self.category[:n],
+            "tag_count": self.tag_count[:n],
+            "tag_indptr": tag_indptr,
+            "tag_indices": tag_indices,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], counts: Dict[str, int]) -> "ProductFeatureStore":
+        """Rebuild from snapshot arrays; columns stay backed by the (mapped) arrays"""
+        store = cls()
+        store.product_ids = unpack_strings(arrays["product_ids"], counts["products"])
+        store.categories = unpack_strings(arrays["categories"], counts["categories"])
+        store.tags = unpack_strings(arrays["tags"], counts["tags"])
+        store.product_index = {p: i for i, p in enumerate(store.product_ids)}
+        store.category_index = {c: i for i, c in enumerate(store.categories)}
+        store.tag_index = {t: i for i, t in enumerate(store.tags)}
+        for name in ("price", "rating", "category", "tag_count"):
+            setattr(store, name, arrays[name])
+        store._tag_rows = unpack_rows(arrays["tag_indptr"], arrays["tag_indices"])
+        return store
+
+    def counts(self) -> Dict[str, int]:
+        return {"products": len(self), "categories": len(self.categories), "tags": len(self.tags)}
+
+    def positions(self, product_ids: Iterable[str]) -> np.ndarray:
+        """Positions of the known products among ``product_ids``"""
+        index = self.product_index
+        return np.asarray([index[p] for p in product_ids if p in index], dtype=np.int64)
+
+    def content_scores(self, preferences: Dict[str, float]) -> np.ndarray:
+        """Score every product against one user's preference weights.
+
+        Vectorized form of the per-product content score: category weight,
+        rating, affordability and the share of a product's tags the user has
+        a preference for, capped at 1.0.
+        """
+        return self.content_score_matrix([preferences])[0]
+
+    def content_score_matrix(self, preferences: List[Dict[str, float]]) -> np.ndarray:
+        """Content scores for several users at once, one row per user"""
+        n = len(self)
+        category_weights = np.zeros((len(preferences), len(self.categories)))
+        tag_rows, tag_cols = [], []
+        for row, user_preferences in enumerate(preferences):
+            for key, weight in user_preferences.items():
+                code = self.category_index.get(key)
+                if code is not None:
+                    category_weights[row, code] = weight
+                code = self.tag_index.get(key)
+                if code is not None:
+                    tag_rows.append(row)
+                    tag_cols.append(code)
+
+        price = self.price[:n]
+        tag_count = self.tag_count[:n]
+
+        # Rating and price terms are the same for every user
+        shared = (self.rating[:n] / 5.0) * 0.3
+        shared += np.divide(1000.0, price, out=np.zeros(n), where=price > 0) * 0.2
+
+        scores = category_weights[:, self.category[:n]] * 0.4
+        scores += shared
+        if tag_rows:
+            preferred_tags = sparse.csr_matrix(
+                (np.ones(len(tag_rows), dtype=np.float32), (tag_rows, tag_cols)),
+                shape=(len(preferences), len(self.tags)),
+            )
+            overlap = (preferred_tags @ self.tag_matrix.T).toarray()
+            scores += np.divide(
+                overlap, tag_count, out=np.zeros(overlap.shape), where=tag_count > 0
+            ) * 0.1
+
+        return np.minimum(scores, 1.0)
+
+    def _code(self, index: Dict[str, int], values: List[str], value: str) -> int:
+        code = index.get(value)
+        if code is None:
+            code = len(values)
+            index[value] = code
+            values.append(value)
+        return code
+
+    def _grow(self, capacity: int):
+        for name in ("price", "rating", "category", "tag_count"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
@@ -1,13 +1,38 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterable, Iterator, Optional, Tuple, Type, Union
 import numpy as np
 import pandas as pd
 from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-import redis
+import asyncio
+import heapq
 import json
 import logging
+import multiprocessing
+import os
+import time
+from functools import partial
+from itertools import chain
+from operator import itemgetter
+
+from ann_index import INDEX_TYPES, RandomProjector, create_index
+from bulk_ingest import BulkFormatError, IngestReport, batched, iter_records, upload_format
+from cache import RecommendationCache, RedisCache
+from candidate_pools import CandidatePools
+from executor import ExecutorSaturated, ReadWriteLock, ScoringExecutor
+from factorization import FactorModel, ImplicitALS
+from feature_store import ProductFeatureStore
+from micro_batch import MicroBatcher
+from metrics import MetricsRegistry, SamplingProfiler, StageTimer
+from profile_store import UserProfileStore
+from sharding import ShardClient, shard_of, spawn_shards
+from social_graph import HOP_DECAY, MUTUAL_WEIGHT, ONE_WAY_WEIGHT, SocialGraph, weighted_counts
+from snapshot import has_snapshot, pack_rows, read_snapshot, write_snapshot
+from text_index import TextIndex
+from topk import merge_recommendations, top_k_indices, top_k_recommendations
+from trending import EVENT_WEIGHTS, TrendingCounter
+from user_item_matrix import UserItemMatrix
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,8 +40,143 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Social Commerce Recommendation Engine", version="1.0.0")
 
-# Redis connection for caching
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+# Similar-user/similar-product lookup: "ivf" (approximate) or "exact"
+SIMILARITY_INDEX = os.getenv("SIMILARITY_INDEX", "ivf")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+ANN_DIM = 64
+ANN_CANDIDATES = 50  # neighbours fetched from the index before Jaccard re-ranking
+# IVF centroids are retrained in the background once an index has outgrown them
+ANN_TRAIN_INTERVAL = float(os.getenv("ANN_TRAIN_INTERVAL", "60"))
+
+# Collaborative scoring: "neighbours" (Jaccard at request time) or "als"
+# (matrix factorization, retrained in the background; neighbours until the
+# first model is ready)
+COLLABORATIVE_MODEL = os.getenv("COLLABORATIVE_MODEL", "neighbours")
+FACTOR_RETRAIN_INTERVAL = float(os.getenv("FACTOR_RETRAIN_INTERVAL", "3600"))
+ALS_OPTIONS = {
+    "factors": int(os.getenv("ALS_FACTORS", "64")),
+    "regularization": float(os.getenv("ALS_REGULARIZATION", "0.05")),
+    "alpha": float(os.getenv("ALS_ALPHA", "20")),
+    "iterations": int(os.getenv("ALS_ITERATIONS", "10")),
+}
+
+# Social scoring: hops followed, friends expanded for the second hop, cap on
+# users considered, and the time scale (seconds) over which purchases fade
+SOCIAL_HOPS = int(os.getenv("SOCIAL_HOPS", "2"))
+SOCIAL_EXPANSION_LIMIT = int(os.getenv("SOCIAL_EXPANSION_LIMIT", "200"))
+SOCIAL_MAX_NODES = int(os.getenv("SOCIAL_MAX_NODES", "5000"))
+SOCIAL_RECENCY_SCALE = float(os.getenv("SOCIAL_RECENCY_SCALE", str(30 * 86400)))
+
+# Batch scoring: users per block, and cap on users x products cells scored at once
+BATCH_BLOCK_SIZE = 256
+BATCH_MAX_CELLS = 4_000_000
+
+# Bulk ingest applies this many records per write-locked batch
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "5000"))
+
+# Engine state is restored from here at startup and written by /admin/snapshot
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+
+# Sharded mode: with ENGINE_SHARDS > 1, users and products are hash-partitioned
+# over that many worker processes and this process scatters queries to them.
+# Run a single uvicorn worker in this mode; the shards use the cores and
+# hold the only copy of the state.
+ENGINE_SHARDS = int(os.getenv("ENGINE_SHARDS", "1"))
+SHARD_THREADS = int(os.getenv("SHARD_THREADS", "4"))
+SHARD_WRITE_METHODS = {"add_user_profiles", "add_products", "add_purchases"}
+SHARD_UNLOCKED_METHODS = {"refit_text_index", "train_vector_indexes"}  # take the lock themselves
+SHARD_LAYOUT_FILE = "shards.json"
+
+RECOMMENDATION_TYPES = ("general", "collaborative", "content", "social")
+
+# Trending is the same for every user, so it is served from precomputed
+# lists instead of the per-user cache
+TRENDING = "trending"
+TRENDING_WINDOWS = {"1h": 3600.0, "24h": 86400.0, "7d": 604800.0}
+TRENDING_DEFAULT_WINDOW = "24h"
+TRENDING_DEPTH = int(os.getenv("TRENDING_DEPTH", "100"))
+TRENDING_REFRESH_INTERVAL = float(os.getenv("TRENDING_REFRESH_INTERVAL", "30"))
+
+# Events posted by concurrent requests are applied together, once per
+# EVENT_BATCH_SIZE events or EVENT_BATCH_DELAY seconds
+EVENT_BATCH_SIZE = int(os.getenv("EVENT_BATCH_SIZE", "1000"))
+EVENT_BATCH_DELAY = float(os.getenv("EVENT_BATCH_DELAY", "0.01"))
+
+# The description/tag vocabulary is refitted in the background once this
+# share of the corpus has changed since the last fit
+TEXT_INDEX_REFIT_INTERVAL = float(os.getenv("TEXT_INDEX_REFIT_INTERVAL", "60"))
+TEXT_INDEX_REFIT_FRACTION = float(os.getenv("TEXT_INDEX_REFIT_FRACTION", "0.1"))
+
+# Cached results are computed this deep and sliced per request
+RECOMMENDATION_CACHE_DEPTH = int(os.getenv("RECOMMENDATION_CACHE_DEPTH", "50"))
+LOCAL_CACHE_ENTRIES = int(os.getenv("LOCAL_CACHE_ENTRIES", "10000"))
+LOCAL_CACHE_TTL = float(os.getenv("LOCAL_CACHE_TTL", "60"))
+
+# Recently active users get their source lists precomputed in the background,
+# so a cache miss only filters and composes them. Users with missing or
+# outdated pools are rebuilt first, then pools older than the max age.
+CANDIDATE_POOL_TYPES = [t for t in os.getenv("CANDIDATE_POOL_TYPES", "general").split(",") if t]
+CANDIDATE_POOL_DEPTH = int(os.getenv("CANDIDATE_POOL_DEPTH", "100"))
+CANDIDATE_POOL_USERS = int(os.getenv("CANDIDATE_POOL_USERS", "100000"))
+CANDIDATE_POOL_MAX_AGE = float(os.getenv("CANDIDATE_POOL_MAX_AGE", "600"))
+CANDIDATE_POOL_REFRESH_INTERVAL = float(os.getenv("CANDIDATE_POOL_REFRESH_INTERVAL", "1"))
+CANDIDATE_POOL_REFRESH_BATCH = int(os.getenv("CANDIDATE_POOL_REFRESH_BATCH", "256"))
+
+# Scoring runs on a bounded thread pool so the event loop stays free
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", str(os.cpu_count() or 4)))
+SCORING_QUEUE_SIZE = int(os.getenv("SCORING_QUEUE_SIZE", str(8 * SCORING_WORKERS)))
+SCORING_TIMEOUT = float(os.getenv("SCORING_TIMEOUT", "2.0"))
+
+# Engine size gauges read a copy refreshed this often (seconds), so a scrape
+# never waits on the engine or its shards
+ENGINE_SIZES_INTERVAL = float(os.getenv("ENGINE_SIZES_INTERVAL", "15"))
+
+# Opt-in sampling profiler: /recommendations requests slower than
+# PROFILE_SLOW_REQUESTS seconds dump collapsed stacks (flame-graph input)
+# to PROFILE_DIR. Unset disables it.
+PROFILE_SLOW_REQUESTS = os.getenv("PROFILE_SLOW_REQUESTS")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+# Redis connection for caching; a slow or unavailable Redis is bypassed
+redis_client = RedisCache(
+    os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+    max_connections=int(os.getenv("REDIS_POOL_SIZE", "32")),
+    timeout=float(os.getenv("REDIS_TIMEOUT", "0.05")),
+)
+recommendation_cache = RecommendationCache(
+    redis_client,
+    RECOMMENDATION_TYPES,
+    ttl=1800,  # 30 minutes TTL
+    local_entries=LOCAL_CACHE_ENTRIES,
+    local_ttl=LOCAL_CACHE_TTL,
+)
+candidate_pools = CandidatePools(
+    CANDIDATE_POOL_TYPES,
+    depth=max(CANDIDATE_POOL_DEPTH, RECOMMENDATION_CACHE_DEPTH),
+    max_users=CANDIDATE_POOL_USERS,
+    max_age=CANDIDATE_POOL_MAX_AGE,
+)
+
+# Served at /metrics. Stages of a recommendation request: cache lookup,
+# read-lock wait, candidate pool lookup, scoring (which contains the
+# similarity lookup), cache store and serialization. Time queued for a worker has its own histogram.
+metrics = MetricsRegistry()
+request_seconds = metrics.histogram(
+    "recommendation_request_seconds", "End-to-end /recommendations latency", ("type",)
+)
+stage_timer = StageTimer(metrics.histogram(
+    "recommendation_stage_seconds", "Latency of one stage of a recommendation request", ("type", "stage")
+))
+queue_wait_seconds = metrics.histogram(
+    "scoring_queue_wait_seconds", "Time scoring jobs spent waiting for a worker"
+)
+engine_updates = metrics.counter(
+    "recommendation_engine_updates_total", "Profiles and products added or updated", ("kind",)
+)
+profiler = SamplingProfiler(
+    float(PROFILE_SLOW_REQUESTS) if PROFILE_SLOW_REQUESTS else None, PROFILE_DIR, PROFILE_INTERVAL
+)
 
 class UserProfile(BaseModel):
     user_id: str
@@ -37,246 +197,1761 @@ class RecommendationRequest(BaseModel):
     user_id: str
     num_recommendations: int = 10
     recommendation_type: str = "general"  # general, social, trending
+    # Trending only: optional category slice and decay window
+    category: Optional[str] = None
+    window: str = TRENDING_DEFAULT_WINDOW
+
+class BatchRecommendationRequest(BaseModel):
+    user_ids: List[str]
+    num_recommendations: int = 10
+    recommendation_type: str = "general"
+    category: Optional[str] = None
+    window: str = TRENDING_DEFAULT_WINDOW
+
+class ProductEvent(BaseModel):
+    product_id: str
+    event_type: str = "purchase"  # purchase, add_to_cart, like, share, click, view
+    user_id: Optional[str] = None
+    timestamp: Optional[float] = None  # Unix seconds; defaults to arrival time
 
 class RecommendationResponse(BaseModel):
     user_id: str
-    recommendations: List[Dict[str, float]]
+    recommendations: List[Dict[str, Union[float, str]]]
     confidence_scores: List[float]
     recommendation_type: str
 
+def scaled_trending(candidates: List[Tuple[str, float]]) -> List[Dict[str, float]]:
+    """Trending recommendations from ranked ``(product_id, score)``, scaled so the top scores 1.0"""
+    return [
+        {"product_id": product_id, "score": score / candidates[0][1], "reason": "trending"}
+        for product_id, score in candidates
+    ]
+
+def source_depths(recommendation_type: str, depth: int) -> List[int]:
+    """How deep each list from ``get_recommendation_sources`` is scored for ``depth`` results"""
+    if recommendation_type in RECOMMENDATION_TYPES + (TRENDING,) and recommendation_type != "general":
+        return [depth]
+    return [depth // 2, depth]
+
 class RecommendationEngine:
-    def __init__(self):
-        self.user_profiles = {}
-        self.product_features = {}
-        self.user_item_matrix = None
-        self.tfidf_vectorizer = TfidfVectorizer(stop_words='english')
+    def __init__(self, similarity_index: str = SIMILARITY_INDEX, nprobe: int = ANN_NPROBE,
+                 collaborative_model: str = COLLABORATIVE_MODEL):
+        # Profiles and products are held in compact array-backed stores keyed
+        # by integer positions; Pydantic models only exist at the API boundary
+        self.user_profiles = UserProfileStore()
+        self.product_features = ProductFeatureStore()
+        self.user_item_matrix = UserItemMatrix()
+        self.social_graph = SocialGraph(self.user_profiles, self.user_item_matrix)
+        self.text_index = TextIndex(refit_fraction=TEXT_INDEX_REFIT_FRACTION)
+        self.similarity_index = similarity_index
+        self.collaborative_model = collaborative_model
+        # Replaced wholesale by train_factor_model; readers take a local reference
+        self.factor_model: Optional[FactorModel] = None
+        # Users updated since the current model's training copy are folded in
+        # rather than looked up; a running training collects its own set
+        self._refit_users = set()
+        self._refit_pending: Optional[set] = None
+        self.nprobe = nprobe
+        # Scoring holds the read side, profile/product updates the write side
+        self.lock = ReadWriteLock()
+        self.purchase_projector = RandomProjector(ANN_DIM, seed=1)
+        self.feature_projector = RandomProjector(ANN_DIM, seed=2)
+        self.user_vectors = create_index(similarity_index, ANN_DIM, nprobe=nprobe, auto_train=False)
+        self.product_vectors = create_index(similarity_index, ANN_DIM + 2, nprobe=nprobe, auto_train=False)
+        self.trending = TrendingCounter(TRENDING_WINDOWS, depth=TRENDING_DEPTH)
         
     def add_user_profile(self, profile: UserProfile):
         """Add or update user profile"""
-        self.user_profiles[profile.user_id] = profile
-        logger.info(f"Added profile for user: {profile.user_id}")
+        idx = self.user_item_matrix.set_user_items(profile.user_id, profile.purchase_history)
+        self.user_profiles.set(idx, profile.preferences, profile.social_connections, profile.demographics)
+        self._mark_refit([idx])
+        self.social_graph.sync()
+        items = self.user_item_matrix.user_items(profile.user_id)
+        if len(items):
+            self.user_vectors.add(profile.user_id, self.purchase_projector.embed_indices(items))
+        else:
+            self.user_vectors.remove(profile.user_id)
+        engine_updates.inc(1, "profile")
+        logger.debug(f"Added profile for user: {profile.user_id}")
         
     def add_product_features(self, product: ProductFeatures):
         """Add or update product features"""
-        self.product_features[product.product_id] = product
-        logger.info(f"Added product: {product.product_id}")
+        idx = self.product_features.add(
+            product.product_id, product.category, product.price, product.rating, product.tags
+        )
+        self.product_vectors.add(product.product_id, self._product_vector(product))
+        self.text_index.set(idx, self._product_text(product))
+        engine_updates.inc(1, "product")
+        logger.debug(f"Added product: {product.product_id}")
+        
+    def add_user_profiles(self, profiles: List[UserProfile]) -> int:
+        """Add or update many user profiles with one pass over each index"""
+        # A user listed twice keeps the later profile, as with repeated single updates
+        latest = list({profile.user_id: profile for profile in profiles}.values())
+        matrix = self.user_item_matrix
+        positions = matrix.set_many_user_items((p.user_id, p.purchase_history) for p in latest)
+        for idx, profile in zip(positions, latest):
+            self.user_profiles.set(
+                int(idx), profile.preferences, profile.social_connections, profile.demographics
+            )
+        self._mark_refit(positions.tolist())
+        self.social_graph.sync()
+        
+        indptr, indices = pack_rows([matrix.user_items(p.user_id) for p in latest])
+        has_items = np.diff(indptr) > 0
+        vectors = self.purchase_projector.embed_rows(indptr, indices)
+        self.user_vectors.add_many(
+            [p.user_id for p, keep in zip(latest, has_items) if keep], vectors[has_items]
+        )
+        for profile, keep in zip(latest, has_items):
+            if not keep:
+                self.user_vectors.remove(profile.user_id)
+        engine_updates.inc(len(latest), "profile")
+        return len(latest)
+        
+    def add_products(self, products: List[ProductFeatures]) -> int:
+        """Add or update many products with one pass over each index"""
+        latest = list({product.product_id: product for product in products}.values())
+        if not latest:
+            return 0
+        positions = [
+            self.product_features.add(
+                product.product_id, product.category, product.price, product.rating, product.tags
+            )
+            for product in latest
+        ]
+        self.product_vectors.add_many(
+            [p.product_id for p in latest], np.stack([self._product_vector(p) for p in latest])
+        )
+        self.text_index.set_many(positions, [self._product_text(p) for p in latest])
+        engine_updates.inc(len(latest), "product")
+        return len(latest)
+        
+    def bulk_load(self, profiles: Iterable[UserProfile] = (), products: Iterable[ProductFeatures] = (),
+                  batch_size: int = BULK_BATCH_SIZE) -> Dict[str, int]:
+        """Load many products and profiles, taking the write lock once per batch.
+        
+        Readers are served between batches. Must not be called while already
+        holding ``self.lock``.
+        """
+        counts = {"products": 0, "profiles": 0}
+        for batch in batched(products, batch_size):
+            with self.lock.writing():
+                counts["products"] += self.add_products(batch)
+        for batch in batched(profiles, batch_size):
+            with self.lock.writing():
+                counts["profiles"] += self.add_user_profiles(batch)
+        self.train_vector_indexes()
+        logger.info(f"Bulk loaded {counts['products']} products and {counts['profiles']} profiles")
+        return counts
+        
+    def record_events(self, events: List[ProductEvent]) -> np.ndarray:
+        """Feed purchase and engagement events into the trending counters.
+        
+        Returns which events were counted.
+        """
+        # Only catalogue products can be recommended, so other events are dropped
+        store = self.product_features
+        counted = np.asarray(
+            [e.product_id in store and e.event_type in EVENT_WEIGHTS for e in events], dtype=bool
+        )
+        known = [e for e, keep in zip(events, counted) if keep]
+        now = time.time()
+        self.trending.record(
+            store.positions(e.product_id for e in known),
+            np.asarray([EVENT_WEIGHTS[e.event_type] for e in known]),
+            np.asarray([now if e.timestamp is None else e.timestamp for e in known]),
+        )
+        return counted
+        
+    def add_purchases(self, events: List[ProductEvent]) -> List[str]:
+        """Append purchase events to their users' histories.
+        
+        Only the purchasing users' rows and vectors are touched; a user not
+        seen before starts with an empty profile. Returns the users whose
+        history changed, in first-seen order.
+        """
+        bought: Dict[str, List[str]] = {}
+        for event in events:
+            if event.event_type == "purchase" and event.user_id:
+                bought.setdefault(event.user_id, []).append(event.product_id)
+        
+        matrix = self.user_item_matrix
+        num_users = matrix.num_users
+        changed = []
+        for user_id, product_ids in bought.items():
+            idx, added = matrix.add_user_items(user_id, product_ids)
+            if idx >= num_users:
+                self.user_profiles.set(idx, {}, [], {})
+            if len(added) or idx >= num_users:
+                changed.append(user_id)
+        if not changed:
+            return changed
+        
+        if matrix.num_users > num_users:
+            self.social_graph.sync()
+        self._mark_refit([matrix.user_index[u] for u in changed])
+        indptr, indices = pack_rows([matrix.user_items(u) for u in changed])
+        self.user_vectors.add_many(changed, self.purchase_projector.embed_rows(indptr, indices))
+        engine_updates.inc(len(changed), "purchase")
+        return changed
+        
+    def refresh_trending(self):
+        """Recompute the precomputed trending lists"""
+        store = self.product_features
+        self.trending.refresh(np.asarray(store.category[:len(store)]))
+        
+    def train_factor_model(self, **options) -> FactorModel:
+        """Fit a factorization on the current purchases and swap it in.
+        
+        Only copying the purchase matrix takes the write lock; training runs
+        unlocked while requests keep being served by the previous model.
+        Must not be called while holding ``self.lock``.
+        """
+        with self.lock.writing():
+            matrix = self.user_item_matrix.matrix.copy()
+            self._refit_pending = set()
+        try:
+            model = ImplicitALS(**options).fit(matrix)
+        except Exception:
+            with self.lock.writing():
+                self._refit_pending = None
+            raise
+        with self.lock.writing():
+            self.factor_model = model
+            self._refit_users, self._refit_pending = self._refit_pending, None
+        logger.info(f"Trained factor model on {model.num_users} users and {model.num_items} items")
+        return model
+        
+    def refit_text_index(self):
+        """Refit the description vocabulary; only the bookkeeping takes the write lock.
+        
+        Must not be called while holding ``self.lock``.
+        """
+        with self.lock.writing():
+            documents = self.text_index.prepare_refit()
+        fitted = self.text_index.fit(documents)
+        with self.lock.writing():
+            self.text_index.install(*fitted)
+        logger.info(f"Refitted text index: {len(documents)} products, {self.text_index.num_terms} terms")
+        
+    def train_vector_indexes(self):
+        """Retrain the similar-user/product indexes that have outgrown their centroids.
+        
+        Like ``refit_text_index``, only the bookkeeping takes the write lock;
+        k-means runs unlocked while searches use the previous centroids.
+        Must not be called while holding ``self.lock``.
+        """
+        for name, index in (("user", self.user_vectors), ("product", self.product_vectors)):
+            with self.lock.writing():
+                if not index.needs_training:
+                    continue
+                prepared = index.prepare_training()
+            fitted = index.fit(*prepared)
+            with self.lock.writing():
+                index.install(*fitted)
+            logger.info(f"Trained {name} vector index on {len(prepared[1])} vectors")
+        
+    @property
+    def needs_compaction(self) -> bool:
+        return self.user_item_matrix.needs_compaction
+        
+    def compact(self):
+        """Fold purchase rows changed since the last compaction into the CSR arrays.
+        
+        Batch scoring reads those arrays under the read lock and otherwise
+        rebuilds a private copy per block. Must hold the write lock.
+        """
+        self.user_item_matrix.compact()
+        
+    def _mark_refit(self, positions: List[int]):
+        # Only users scored by a factor model, current or in training, need tracking
+        if self.factor_model is not None:
+            self._refit_users.update(positions)
+        if self._refit_pending is not None:
+            self._refit_pending.update(positions)
+        
+    def has_user(self, user_id: str) -> bool:
+        return user_id in self.user_item_matrix.user_index
+        
+    def has_product(self, product_id: str) -> bool:
+        return product_id in self.product_features
+        
+    def purchased_mask(self, user_id: str, product_ids: List[str]) -> np.ndarray:
+        """Which of ``product_ids`` the user has bought"""
+        matrix = self.user_item_matrix
+        row = matrix.user_items(user_id)
+        if not len(row):
+            return np.zeros(len(product_ids), dtype=bool)
+        columns = np.fromiter(
+            (matrix.item_index.get(p, -1) for p in product_ids), dtype=np.int64, count=len(product_ids)
+        )
+        at = np.searchsorted(row, columns).clip(max=len(row) - 1)
+        return row[at] == columns
+        
+    def sizes(self) -> Dict[str, int]:
+        matrix = self.user_item_matrix
+        return {"users": matrix.num_users, "products": len(self.product_features), "purchases": matrix.nnz}
+        
+    @property
+    def needs_text_refit(self) -> bool:
+        return self.text_index.needs_refit
+        
+    @property
+    def needs_vector_training(self) -> bool:
+        return self.user_vectors.needs_training or self.product_vectors.needs_training
+        
+    @property
+    def trending_refreshed_at(self) -> Optional[float]:
+        return self.trending.refreshed_at
+        
+    def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
+        """Rebuild the API model for a stored profile"""
+        idx = self.user_item_matrix.user_position(user_id)
+        if idx is None:
+            return None
+        matrix = self.user_item_matrix
+        return UserProfile(
+            user_id=user_id,
+            preferences=self.user_profiles.preferences(idx),
+            purchase_history=[matrix.item_ids[i] for i in matrix.user_items(user_id)],
+            social_connections=self.user_profiles.connections(idx),
+            demographics=self.user_profiles.demographics(idx),
+        )
+        
+    def save_snapshot(self, root: str) -> str:
+        """Write engine state as a memory-mappable snapshot under ``root``; only needs the read lock"""
+        components = {
+            "matrix": self.user_item_matrix.to_arrays(),
+            "products": self.product_features.to_arrays(),
+            "user_vectors": self.user_vectors.to_arrays(),
+            "product_vectors": self.product_vectors.to_arrays(),
+            "profiles": self.user_profiles.to_arrays(),
+            "trending": self.trending.to_arrays(),
+            "text": self.text_index.to_arrays(),
+        }
+        if self.factor_model is not None:
+            components["factors"] = self.factor_model.to_arrays()
+        arrays = {
+            f"{component}.{name}": array
+            for component, component_arrays in components.items()
+            for name, array in component_arrays.items()
+        }
+        meta = {
+            "version": 3,
+            "similarity_index": self.similarity_index,
+            "users": self.user_item_matrix.num_users,
+            "items": self.user_item_matrix.num_items,
+            "products": self.product_features.counts(),
+            "profiles": self.user_profiles.counts(),
+            "trending": {"windows": self.trending.names, "reference_time": self.trending.reference_time},
+            "text": self.text_index.counts(),
+        }
+        if self.factor_model is not None:
+            meta["factors"] = {
+                "regularization": self.factor_model.regularization,
+                "alpha": self.factor_model.alpha,
+            }
+        return write_snapshot(root, arrays, meta)
+        
+    @classmethod
+    def load_snapshot(cls, root: str, mmap: bool = True, **kwargs) -> "RecommendationEngine":
+        """Build an engine from the current snapshot under ``root``"""
+        arrays, meta = read_snapshot(root, mmap=mmap)
+        components = {}
+        for key, array in arrays.items():
+            component, name = key.split(".", 1)
+            components.setdefault(component, {})[name] = array
+        
+        engine = cls(similarity_index=meta["similarity_index"], **kwargs)
+        engine.user_item_matrix = UserItemMatrix.from_arrays(
+            components["matrix"], meta["users"], meta["items"]
+        )
+        engine.product_features = ProductFeatureStore.from_arrays(
+            components["products"], meta["products"]
+        )
+        index_type = INDEX_TYPES[meta["similarity_index"]]
+        index_options = {}
+        if meta["similarity_index"] != "exact":
+            index_options = {"nprobe": engine.nprobe, "auto_train": False}
+        engine.user_vectors = index_type.from_arrays(components["user_vectors"], **index_options)
+        engine.product_vectors = index_type.from_arrays(components["product_vectors"], **index_options)
+        engine.user_profiles = UserProfileStore.from_arrays(components["profiles"], meta["profiles"])
+        engine.social_graph = SocialGraph(engine.user_profiles, engine.user_item_matrix)
+        engine.social_graph.sync()
+        # Counters are only restored if the configured windows are unchanged
+        trending = meta.get("trending")
+        if trending and trending["windows"] == engine.trending.names:
+            engine.trending = TrendingCounter.from_arrays(
+                components["trending"], TRENDING_WINDOWS, trending["reference_time"], depth=TRENDING_DEPTH
+            )
+            engine.refresh_trending()
+        if "text" in meta:
+            engine.text_index = TextIndex.from_arrays(
+                components["text"], meta["text"], refit_fraction=TEXT_INDEX_REFIT_FRACTION
+            )
+        if "factors" in meta:
+            engine.factor_model = FactorModel.from_arrays(components["factors"], **meta["factors"])
+        return engine
         
     def get_collaborative_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
         """Get recommendations based on collaborative filtering"""
         # Simple collaborative filtering implementation
-        if user_id not in self.user_profiles:
+        if not self.has_user(user_id):
             return []
+        model = self.factor_model
+        if self.collaborative_model == "als" and model is not None:
+            return self._factor_recommendations(model, [user_id], num_recommendations)[0]
             
-        user_profile = self.user_profiles[user_id]
-        similar_users = self._find_similar_users(user_id)
-        
-        recommendations = []
-        for similar_user_id, similarity_score in similar_users[:num_recommendations]:
-            if similar_user_id in self.user_profiles:
-                similar_user = self.user_profiles[similar_user_id]
-                for product_id in similar_user.purchase_history:
-                    if product_id not in user_profile.purchase_history:
-                        recommendations.append({
-                            "product_id": product_id,
-                            "score": similarity_score,
-                            "reason": "users_like_you"
-                        })
-                        
-        return recommendations[:num_recommendations]
+        user_index = self.user_item_matrix.user_index
+        with stage_timer.time("similarity"):
+            similar_users = self._find_similar_users(user_id, limit=num_recommendations)
+        users = np.asarray([user_index[u] for u, _ in similar_users], dtype=np.int64)
+        scores = np.asarray([score for _, score in similar_users])
+        return self._neighbour_recommendations(user_id, users, scores, num_recommendations)
         
     def get_content_based_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
         """Get recommendations based on content similarity"""
-        if user_id not in self.user_profiles:
+        idx = self.user_item_matrix.user_position(user_id)
+        if idx is None:
             return []
             
-        user_profile = self.user_profiles[user_id]
-        user_preferences = user_profile.preferences
-        
-        recommendations = []
-        for product_id, product in self.product_features.items():
-            if product_id not in user_profile.purchase_history:
-                # Calculate content similarity score
-                score = self._calculate_content_similarity(user_preferences, product)
-                recommendations.append({
-                    "product_id": product_id,
-                    "score": score,
-                    "reason": "based_on_interests"
-                })
-                
-        # Sort by score and return top N
-        recommendations.sort(key=lambda x: x["score"], reverse=True)
-        return recommendations[:num_recommendations]
+        # Score the whole catalogue in one pass, then drop purchased products
+        scores = self.product_features.content_scores(self.user_profiles.preferences(idx))
+        return self._content_recommendations(self._purchased_ids(user_id), scores, num_recommendations)
         
     def get_social_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
         """Get recommendations based on social connections"""
-        if user_id not in self.user_profiles:
+        matrix = self.user_item_matrix
+        idx = matrix.user_position(user_id)
+        if idx is None:
             return []
             
-        user_profile = self.user_profiles[user_id]
-        social_connections = user_profile.social_connections
-        
-        recommendations = []
-        for friend_id in social_connections:
-            if friend_id in self.user_profiles:
-                friend_profile = self.user_profiles[friend_id]
-                for product_id in friend_profile.purchase_history:
-                    if product_id not in user_profile.purchase_history:
-                        recommendations.append({
-                            "product_id": product_id,
-                            "score": 0.8,  # Base social score
-                            "reason": "friends_purchased"
-                        })
-                        
-        return recommendations[:num_recommendations]
-        
-    def _find_similar_users(self, user_id: str) -> List[tuple]:
-        """Find users similar to the given user"""
-        if user_id not in self.user_profiles:
+        with stage_timer.time("similarity"):
+            users, weights, direct = self.social_graph.neighbourhood(
+                idx, SOCIAL_HOPS, SOCIAL_EXPANSION_LIMIT, SOCIAL_MAX_NODES
+            )
+        if not len(users):
             return []
-            
-        target_user = self.user_profiles[user_id]
-        similarities = []
-        
-        for other_user_id, other_user in self.user_profiles.items():
-            if other_user_id != user_id:
-                similarity = self._calculate_user_similarity(target_user, other_user)
-                similarities.append((other_user_id, similarity))
-                
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        return similarities
-        
-    def _calculate_user_similarity(self, user1: UserProfile, user2: UserProfile) -> float:
-        """Calculate similarity between two users"""
-        # Simple Jaccard similarity on purchase history
-        set1 = set(user1.purchase_history)
-        set2 = set(user2.purchase_history)
-        
-        if not set1 or not set2:
-            return 0.0
-            
-        intersection = len(set1.intersection(set2))
-        union = len(set1.union(set2))
         
-        return intersection / union if union > 0 else 0.0
+        # Each purchase counts with its buyer's tie strength, faded by age
+        items, counts = matrix.rows_for(users)
+        times = matrix.times_for(users)
+        age = np.maximum(time.time() - times, 0.0)
+        contributions = np.repeat(weights, counts) * np.exp(-age / SOCIAL_RECENCY_SCALE)
+        from_friends = np.repeat(direct.astype(np.float64), counts)
+        
+        items, (scores, friend_weight) = weighted_counts(
+            items, [contributions, from_friends], matrix.num_items
+        )
+        # Share of the weighted social circle that bought each product
+        scores /= weights.sum()
+        scores[np.isin(items, matrix.user_items(user_id))] = 0.0
+        
+        return [
+            {
+                "product_id": matrix.item_ids[items[i]],
+                "score": float(scores[i]),
+                "reason": "friends_purchased" if friend_weight[i] > 0 else "friends_of_friends_purchased"
+            }
+            for i in top_k_indices(scores, num_recommendations) if scores[i] > 0
+        ]
+        
+    def get_trending_recommendations(self, num_recommendations: int, category: Optional[str] = None,
+                                     window: str = TRENDING_DEFAULT_WINDOW) -> List[Dict[str, float]]:
+        """Most popular products over ``window``, optionally within one category"""
+        return scaled_trending(self.trending_candidates(num_recommendations, category, window))
+        
+    def get_hybrid_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
+        """Blend collaborative and content-based recommendations"""
+        # Half from similar users; content fills the rest, including any
+        # slots lost to products both sources recommend
+        collab_recs = self.get_collaborative_recommendations(user_id, num_recommendations // 2)
+        content_recs = self.get_content_based_recommendations(user_id, num_recommendations)
+        return merge_recommendations([collab_recs, content_recs], num_recommendations)
+        
+    def get_recommendations(self, user_id: str, num_recommendations: int,
+                            recommendation_type: str = "general") -> List[Dict[str, float]]:
+        """Dispatch to the recommendation path for ``recommendation_type``"""
+        sources = self.get_recommendation_sources(user_id, num_recommendations, recommendation_type)
+        return self.compose_recommendations(sources, num_recommendations, recommendation_type)
+        
+    def get_recommendation_sources(self, user_id: str, depth: int,
+                                   recommendation_type: str = "general") -> List[List[Dict[str, float]]]:
+        """Ranked source lists that any request of up to ``depth`` items is sliced from"""
+        if recommendation_type == "collaborative":
+            return [self.get_collaborative_recommendations(user_id, depth)]
+        elif recommendation_type == "content":
+            return [self.get_content_based_recommendations(user_id, depth)]
+        elif recommendation_type == "social":
+            return [self.get_social_recommendations(user_id, depth)]
+        elif recommendation_type == TRENDING:
+            return [self.get_trending_recommendations(depth)]
+        else:  # "general" - hybrid approach
+            collab_depth, content_depth = source_depths(recommendation_type, depth)
+            return [
+                self.get_collaborative_recommendations(user_id, collab_depth),
+                self.get_content_based_recommendations(user_id, content_depth),
+            ]
         
-    def _calculate_content_similarity(self, user_preferences: Dict[str, float], product: ProductFeatures) -> float:
-        """Calculate content similarity between user preferences and product"""
-        score = 0.0
+    def compose_recommendations(self, sources: List[List[Dict[str, float]]], num_recommendations: int,
+                                recommendation_type: str = "general") -> List[Dict[str, float]]:
+        """Cut ``num_recommendations`` results out of the ranked source lists"""
+        if recommendation_type in RECOMMENDATION_TYPES + (TRENDING,) and recommendation_type != "general":
+            return sources[0][:num_recommendations]
+        # Same blend as get_hybrid_recommendations, taken from deeper lists
+        collab_recs, content_recs = sources
+        return merge_recommendations(
+            [collab_recs[:num_recommendations // 2], content_recs[:num_recommendations]],
+            num_recommendations
+        )
         
-        # Category preference
-        if product.category in user_preferences:
-            score += user_preferences[product.category] * 0.4
+    def get_batch_recommendations(self, user_ids: List[str], num_recommendations: int,
+                                  recommendation_type: str = "general", category: Optional[str] = None,
+                                  window: str = TRENDING_DEFAULT_WINDOW) -> Iterator[Tuple[str, List[Dict[str, float]]]]:
+        """Yield (user_id, recommendations) for many users, a block at a time"""
+        if recommendation_type == TRENDING:
+            trending = self.get_trending_recommendations(num_recommendations, category, window)
+            for user_id in user_ids:
+                yield user_id, trending
+            return
+        # Collaborative and content scoring run in matrix form per block so
+        # similarity and catalogue scans are shared across the block's users
+        for start in range(0, len(user_ids), BATCH_BLOCK_SIZE):
+            block = user_ids[start:start + BATCH_BLOCK_SIZE]
+            if recommendation_type == "collaborative":
+                results = self._batch_collaborative(block, num_recommendations)
+            elif recommendation_type == "content":
+                results = self._batch_content(block, num_recommendations)
+            elif recommendation_type == "social":
+                results = [self.get_social_recommendations(u, num_recommendations) for u in block]
+            else:
+                collab = self._batch_collaborative(block, num_recommendations // 2)
+                content = self._batch_content(block, num_recommendations)
+                results = [
+                    merge_recommendations(sources, num_recommendations)
+                    for sources in zip(collab, content)
+                ]
+            yield from zip(block, results)
             
-        # Rating influence
-        score += (product.rating / 5.0) * 0.3
+    def _batch_collaborative(self, user_ids: List[str], num_recommendations: int) -> List[List[Dict[str, float]]]:
+        """Collaborative recommendations for a block of users"""
+        model = self.factor_model
+        if self.collaborative_model == "als" and model is not None:
+            return self._factor_recommendations(model, user_ids, num_recommendations)
+        item_ids = self.user_item_matrix.item_ids
+        return [
+            [
+                {"product_id": item_ids[i], "score": float(score), "reason": "users_like_you"}
+                for i, score in zip(items, scores)
+            ]
+            for items, scores in self.user_item_matrix.neighbour_items_batch(user_ids, num_recommendations)
+        ]
+        
+    def _batch_content(self, user_ids: List[str], num_recommendations: int) -> List[List[Dict[str, float]]]:
+        """Content-based recommendations for a block of users"""
+        matrix = self.user_item_matrix
+        known = [u for u in user_ids if u in matrix.user_index]
+        step = max(1, BATCH_MAX_CELLS // max(len(self.product_features), 1))
+        
+        by_user = {}
+        for start in range(0, len(known), step):
+            chunk = known[start:start + step]
+            scores = self.product_features.content_score_matrix(
+                [self.user_profiles.preferences(matrix.user_index[u]) for u in chunk]
+            )
+            for user_id, row in zip(chunk, scores):
+                by_user[user_id] = self._content_recommendations(
+                    self._purchased_ids(user_id), row, num_recommendations
+                )
+        return [by_user.get(u, []) for u in user_ids]
+        
+    def _factor_recommendations(self, model: FactorModel, user_ids: List[str],
+                                num_recommendations: int) -> List[List[Dict[str, float]]]:
+        """Factorization scores for a block of users: one product per chunk plus top-k"""
+        matrix = self.user_item_matrix
+        # Without purchases a user vector is near zero and ranks nothing,
+        # so such users get no results, as with neighbours
+        known = [u for u in user_ids if u in matrix.user_index and len(matrix.user_items(u))]
+        step = max(1, BATCH_MAX_CELLS // max(model.num_items, 1))
+        
+        by_user = {}
+        for start in range(0, len(known), step):
+            chunk = known[start:start + step]
+            vectors = []
+            for user_id in chunk:
+                idx = matrix.user_index[user_id]
+                position = None if idx in self._refit_users else idx
+                vectors.append(model.user_vector(position, matrix.user_items(user_id)))
+            scores = np.stack(vectors) @ model.item_factors.T
+            for user_id, row in zip(chunk, scores):
+                items = matrix.user_items(user_id)
+                row[items[items < model.num_items]] = -np.inf
+                row[row <= 0.0] = -np.inf
+                by_user[user_id] = [
+                    {
+                        "product_id": matrix.item_ids[i],
+                        "score": float(min(row[i], 1.0)),
+                        "reason": "users_like_you"
+                    }
+                    for i in top_k_indices(row, num_recommendations) if np.isfinite(row[i])
+                ]
+        return [by_user.get(u, []) for u in user_ids]
         
-        # Price preference (inverse relationship for affordability)
-        if product.price > 0:
-            score += (1000 / product.price) * 0.2  # Simplified price scoring
+    def _neighbour_recommendations(self, user_id: str, users: np.ndarray, scores: np.ndarray,
+                                   num_recommendations: int) -> List[Dict[str, float]]:
+        """Products bought by ranked neighbours, scored by their most similar buyer"""
+        matrix = self.user_item_matrix
+        if not len(users):
+            return []
+        items, counts = matrix.rows_for(users)
+        item_scores = np.repeat(scores, counts)
+        fresh = ~np.isin(items, matrix.user_items(user_id))
+        items, item_scores = items[fresh], item_scores[fresh]
+        # Neighbours arrive best first, so the first occurrence is the maximum
+        items, first = np.unique(items, return_index=True)
+        item_scores = item_scores[first]
+        return [
+            {
+                "product_id": matrix.item_ids[items[i]],
+                "score": float(item_scores[i]),
+                "reason": "users_like_you"
+            }
+            for i in top_k_indices(item_scores, num_recommendations)
+        ]
+        
+    def _content_recommendations(self, purchased: List[str], scores: np.ndarray,
+                                 num_recommendations: int) -> List[Dict[str, float]]:
+        """Top content scores, excluding products already bought"""
+        store = self.product_features
+        scores[store.positions(purchased)] = -np.inf
+        return [
+            {
+                "product_id": store.product_ids[i],
+                "score": float(scores[i]),
+                "reason": "based_on_interests"
+            }
+            for i in top_k_indices(scores, num_recommendations) if np.isfinite(scores[i])
+        ]
+        
+    def find_similar_products(self, product_id: str, num_results: int) -> List[tuple]:
+        """Find products with similar category, tags, rating and price"""
+        vector = self.product_vectors.vector(product_id)
+        if vector is None:
+            return []
+        return self.product_vectors.search(
+            vector, num_results, exclude=product_id, nprobe=self.nprobe
+        )
+        
+    def find_similar_text_products(self, product_id: str, num_results: int) -> List[tuple]:
+        """Products with the most similar description and tags (TF-IDF cosine)"""
+        idx = self.product_features.product_index.get(product_id)
+        if idx is None:
+            return []
+        product_ids = self.product_features.product_ids
+        return [(product_ids[p], score) for p, score in self.text_index.similar(idx, num_results)]
+        
+    def search_products(self, query: str, num_results: int) -> List[tuple]:
+        """Products best matching a free-text query (TF-IDF cosine)"""
+        product_ids = self.product_features.product_ids
+        return [(product_ids[p], score) for p, score in self.text_index.search(query, num_results)]
+        
+    def _find_similar_users(self, user_id: str, limit: Optional[int] = None) -> List[tuple]:
+        """Find users similar to the given user"""
+        # Jaccard similarity on purchase history. The exact path scores every
+        # user sharing a purchase; otherwise the vector index proposes
+        # candidates and only those are scored.
+        if limit is None or self.similarity_index == "exact":
+            return self.user_item_matrix.similar_users(user_id, limit)
             
-        # Tag matching
-        product_tags = set(product.tags)
-        user_tag_prefs = set(user_preferences.keys())
-        tag_overlap = len(product_tags.intersection(user_tag_prefs))
-        score += (tag_overlap / len(product_tags) if product_tags else 0) * 0.1
+        vector = self.user_vectors.vector(user_id)
+        if vector is None:
+            return []
+        candidates = self.user_vectors.search(
+            vector, max(limit, ANN_CANDIDATES), exclude=user_id, nprobe=self.nprobe
+        )
+        return self.user_item_matrix.similarities(user_id, [c for c, _ in candidates], limit)
+        
+    # Partition-local queries: a shard of ShardedRecommendationEngine answers
+    # these for the users and products it owns, and the coordinator merges
+    
+    def user_state(self, user_id: str) -> Optional[Tuple[Dict[str, float], List[str], List[str]]]:
+        """A stored user's preferences, purchased product IDs and connections"""
+        idx = self.user_item_matrix.user_position(user_id)
+        if idx is None:
+            return None
+        return (
+            self.user_profiles.preferences(idx),
+            self._purchased_ids(user_id),
+            self.user_profiles.connections(idx),
+        )
+        
+    def content_candidates(self, preferences: Dict[str, float], purchased: List[str],
+                           num_recommendations: int) -> List[Dict[str, float]]:
+        """Content-based recommendations among the products stored here"""
+        scores = self.product_features.content_scores(preferences)
+        return self._content_recommendations(purchased, scores, num_recommendations)
+        
+    def similar_buyers(self, purchased: List[str], size: int, limit: int,
+                       exclude: Optional[str] = None) -> List[Tuple[str, float, List[str]]]:
+        """Users stored here most similar to a purchase set, with their purchases"""
+        matrix = self.user_item_matrix
+        return [
+            (user_id, score, self._purchased_ids(user_id))
+            for user_id, score in matrix.similar_to_items(purchased, size, limit, exclude)
+        ]
+        
+    def social_rows(self, user_ids: List[str]) -> Dict[str, Tuple[List[str], List[str], np.ndarray]]:
+        """Connections, purchased product IDs and purchase times of the users stored here"""
+        matrix = self.user_item_matrix
+        rows = {}
+        for user_id in user_ids:
+            idx = matrix.user_position(user_id)
+            if idx is not None:
+                rows[user_id] = (
+                    self.user_profiles.connections(idx),
+                    self._purchased_ids(user_id),
+                    matrix.user_item_times(idx),
+                )
+        return rows
+        
+    def trending_candidates(self, num_recommendations: int, category: Optional[str],
+                            window: str) -> List[Tuple[str, float]]:
+        """Unscaled ``(product_id, score)`` trending here, best first"""
+        code = None
+        if category is not None:
+            code = self.product_features.category_index.get(category)
+            if code is None:
+                return []
+        positions, scores = self.trending.top(window, code, num_recommendations)
+        product_ids = self.product_features.product_ids
+        return [(product_ids[p], float(score)) for p, score in zip(positions, scores)]
+        
+    def product_vector(self, product_id: str) -> Optional[np.ndarray]:
+        return self.product_vectors.vector(product_id)
+        
+    def nearest_products(self, vector: np.ndarray, num_results: int,
+                         exclude: Optional[str] = None) -> List[tuple]:
+        """Products stored here closest to a feature vector"""
+        return self.product_vectors.search(vector, num_results, exclude=exclude, nprobe=self.nprobe)
         
-        return min(score, 1.0)  # Cap at 1.0
+    def product_text(self, product_id: str) -> Optional[str]:
+        idx = self.product_features.product_index.get(product_id)
+        return None if idx is None else self.text_index.documents[idx]
+        
+    def _purchased_ids(self, user_id: str) -> List[str]:
+        matrix = self.user_item_matrix
+        return [matrix.item_ids[i] for i in matrix.user_items(user_id)]
+        
+    def _product_text(self, product: ProductFeatures) -> str:
+        return " ".join([product.description, *product.tags])
+        
+    def _product_vector(self, product: ProductFeatures) -> np.ndarray:
+        """Dense feature vector for similar-product lookup"""
+        tokens = [f"category:{product.category}"] + [f"tag:{tag}" for tag in product.tags]
+        vector = self.feature_projector.embed_tokens(tokens)
+        vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        numeric = [product.rating / 5.0, 1.0 / (1.0 + np.log1p(max(product.price, 0.0)))]
+        return np.concatenate([vector, 0.5 * np.asarray(numeric, dtype=np.float32)])
+        
+def build_shard(shard: int, snapshot_root: Optional[str] = None) -> RecommendationEngine:
+    """Engine for one shard process, restored from its part of a sharded snapshot"""
+    path = os.path.join(snapshot_root, f"shard-{shard}") if snapshot_root else None
+    if path and has_snapshot(path):
+        return RecommendationEngine.load_snapshot(path, collaborative_model="neighbours")
+    return RecommendationEngine(collaborative_model="neighbours")
+
+class ShardedRecommendationEngine:
+    """Coordinator for an engine hash-partitioned over worker processes.
+    
+    A user's profile, purchases and connections live on shard
+    ``shard_of(user_id)``, and a product's features, text and trending
+    counts on ``shard_of(product_id)``. Each shard is a full
+    ``RecommendationEngine`` over its partition. Writes are routed to the
+    owning shard. Queries fetch the user's state from its shard, scatter to
+    every shard, and merge the partial top-k lists here.
+    
+    Differences from a single engine:
+    - Similar users are found by exact co-purchase counts on each shard.
+    - Each shard fits its own text vocabulary, so text scores use per-shard IDF.
+    - The factor model is not available.
+    """
+    
+    def __init__(self, shards: List[ShardClient]):
+        self.shards = shards
+        # Held like RecommendationEngine.lock so multi-step queries see a
+        # consistent state; each shard also locks its own engine
+        self.lock = ReadWriteLock()
+        if COLLABORATIVE_MODEL == "als":
+            logger.warning("COLLABORATIVE_MODEL=als is not supported with ENGINE_SHARDS; using neighbours")
+    
+    @classmethod
+    def spawn(cls, num_shards: int, snapshot_root: Optional[str] = None,
+              threads: int = SHARD_THREADS) -> "ShardedRecommendationEngine":
+        """Start ``num_shards`` shard processes, restoring a sharded snapshot if present"""
+        if snapshot_root:
+            layout = os.path.join(snapshot_root, SHARD_LAYOUT_FILE)
+            if os.path.exists(layout):
+                with open(layout) as f:
+                    saved = json.load(f)["shards"]
+                if saved != num_shards:
+                    raise ValueError(f"Snapshot at {snapshot_root} has {saved} shards, not {num_shards}")
+            elif has_snapshot(snapshot_root):
+                raise ValueError(f"Snapshot at {snapshot_root} is not sharded")
+        clients = spawn_shards(
+            num_shards, partial(build_shard, snapshot_root=snapshot_root),
+            write_methods=SHARD_WRITE_METHODS, unlocked_methods=SHARD_UNLOCKED_METHODS, workers=threads,
+        )
+        return cls(clients)
+    
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+    
+    # Writes go to the owning shard
+    
+    def add_user_profile(self, profile: UserProfile):
+        self.add_user_profiles([profile])
+    
+    def add_product_features(self, product: ProductFeatures):
+        self.add_products([product])
+    
+    def add_user_profiles(self, profiles: List[UserProfile]) -> int:
+        added = sum(self._partitioned("add_user_profiles", profiles, lambda p: p.user_id))
+        engine_updates.inc(added, "profile")
+        return added
+    
+    def add_products(self, products: List[ProductFeatures]) -> int:
+        added = sum(self._partitioned("add_products", products, lambda p: p.product_id))
+        engine_updates.inc(added, "product")
+        return added
+    
+    def bulk_load(self, profiles: Iterable[UserProfile] = (), products: Iterable[ProductFeatures] = (),
+                  batch_size: int = BULK_BATCH_SIZE) -> Dict[str, int]:
+        """Load many products and profiles, taking the write lock once per batch"""
+        counts = {"products": 0, "profiles": 0}
+        for batch in batched(products, batch_size):
+            with self.lock.writing():
+                counts["products"] += self.add_products(batch)
+        for batch in batched(profiles, batch_size):
+            with self.lock.writing():
+                counts["profiles"] += self.add_user_profiles(batch)
+        self.train_vector_indexes()
+        return counts
+    
+    def record_events(self, events: List[ProductEvent]) -> np.ndarray:
+        return np.asarray(self._partitioned_each("record_events", events, lambda e: e.product_id), dtype=bool)
+    
+    def add_purchases(self, events: List[ProductEvent]) -> List[str]:
+        purchases = [e for e in events if e.event_type == "purchase" and e.user_id]
+        changed = list(chain.from_iterable(self._partitioned("add_purchases", purchases, lambda e: e.user_id)))
+        engine_updates.inc(len(changed), "purchase")
+        return changed
+    
+    def refresh_trending(self):
+        self._scatter("refresh_trending")
+    
+    def refit_text_index(self):
+        """Refit the vocabulary on every shard where enough text has changed"""
+        due = [shard for shard, stale in zip(self.shards, self._scatter("needs_text_refit")) if stale]
+        for future in [shard.call("refit_text_index") for shard in due]:
+            future.result()
+    
+    @property
+    def needs_text_refit(self) -> bool:
+        return any(self._scatter("needs_text_refit"))
+    
+    def train_vector_indexes(self):
+        """Retrain the vector indexes on every shard where one has outgrown its centroids"""
+        due = [shard for shard, stale in zip(self.shards, self._scatter("needs_vector_training")) if stale]
+        for future in [shard.call("train_vector_indexes") for shard in due]:
+            future.result()
+    
+    @property
+    def needs_vector_training(self) -> bool:
+        return any(self._scatter("needs_vector_training"))
+    
+    @property
+    def needs_compaction(self) -> bool:
+        # Batches are scattered per user, so nothing here reads compacted arrays
+        return False
+    
+    @property
+    def trending_refreshed_at(self) -> Optional[float]:
+        refreshed = self._scatter("trending_refreshed_at")
+        return None if None in refreshed else min(refreshed)
+    
+    def save_snapshot(self, root: str) -> str:
+        """Write each shard's snapshot under ``root/shard-<n>``"""
+        futures = [
+            shard.call("save_snapshot", os.path.join(root, f"shard-{i}"))
+            for i, shard in enumerate(self.shards)
+        ]
+        for future in futures:
+            future.result()
+        with open(os.path.join(root, SHARD_LAYOUT_FILE), "w") as f:
+            json.dump({"shards": len(self.shards)}, f)
+        return root
+    
+    # Lookups go to the owning shard
+    
+    def has_user(self, user_id: str) -> bool:
+        return self._owner(user_id).call("has_user", user_id).result()
+    
+    def has_product(self, product_id: str) -> bool:
+        return self._owner(product_id).call("has_product", product_id).result()
+    
+    def purchased_mask(self, user_id: str, product_ids: List[str]) -> np.ndarray:
+        return self._owner(user_id).call("purchased_mask", user_id, product_ids).result()
+    
+    def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
+        return self._owner(user_id).call("get_user_profile", user_id).result()
+    
+    def sizes(self) -> Dict[str, int]:
+        totals = {}
+        for sizes in self._scatter("sizes"):
+            for name, size in sizes.items():
+                totals[name] = totals.get(name, 0) + size
+        return totals
+    
+    # Queries scatter to every shard and merge here
+    
+    def get_collaborative_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
+        state = self._user_state(user_id)
+        if state is None or not state[1]:
+            return []
+        purchased = state[1]
+        with stage_timer.time("similarity"):
+            parts = self._scatter("similar_buyers", purchased, len(purchased), num_recommendations, user_id)
+        neighbours = heapq.nlargest(num_recommendations, chain.from_iterable(parts), key=itemgetter(1))
+        
+        # Products bought by ranked neighbours, scored by their most similar buyer
+        owned, best = set(purchased), {}
+        for _, score, products in neighbours:
+            for product_id in products:
+                if product_id not in owned:
+                    best.setdefault(product_id, score)
+        return [
+            {"product_id": product_id, "score": score, "reason": "users_like_you"}
+            for product_id, score in heapq.nlargest(num_recommendations, best.items(), key=itemgetter(1))
+        ]
+    
+    def get_content_based_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
+        state = self._user_state(user_id)
+        if state is None:
+            return []
+        preferences, purchased, _ = state
+        parts = self._scatter("content_candidates", preferences, purchased, num_recommendations)
+        return top_k_recommendations(chain.from_iterable(parts), num_recommendations)
+    
+    def get_social_recommendations(self, user_id: str, num_recommendations: int) -> List[Dict[str, float]]:
+        state = self._user_state(user_id)
+        if state is None:
+            return []
+        _, purchased, connections = state
+        with stage_timer.time("similarity"):
+            users, weights, direct, rows = self._social_neighbourhood(user_id, connections)
+        if not users:
+            return []
+        
+        # Same scoring as RecommendationEngine.get_social_recommendations, over product IDs
+        counts = [len(rows[u][1]) for u in users]
+        products = [product_id for u in users for product_id in rows[u][1]]
+        if not products:
+            return []
+        times = np.concatenate([rows[u][2] for u in users])
+        age = np.maximum(time.time() - times, 0.0)
+        contributions = np.repeat(weights, counts) * np.exp(-age / SOCIAL_RECENCY_SCALE)
+        products, inverse = np.unique(np.asarray(products), return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions, minlength=len(products)) / weights.sum()
+        friend_weight = np.bincount(
+            inverse, weights=np.repeat(direct.astype(np.float64), counts), minlength=len(products)
+        )
+        scores[np.isin(products, purchased)] = 0.0
+        return [
+            {
+                "product_id": str(products[i]),
+                "score": float(scores[i]),
+                "reason": "friends_purchased" if friend_weight[i] > 0 else "friends_of_friends_purchased"
+            }
+            for i in top_k_indices(scores, num_recommendations) if scores[i] > 0
+        ]
+    
+    def get_trending_recommendations(self, num_recommendations: int, category: Optional[str] = None,
+                                     window: str = TRENDING_DEFAULT_WINDOW) -> List[Dict[str, float]]:
+        parts = self._scatter("trending_candidates", num_recommendations, category, window)
+        return scaled_trending(heapq.nlargest(num_recommendations, chain.from_iterable(parts), key=itemgetter(1)))
+    
+    get_hybrid_recommendations = RecommendationEngine.get_hybrid_recommendations
+    get_recommendations = RecommendationEngine.get_recommendations
+    get_recommendation_sources = RecommendationEngine.get_recommendation_sources
+    compose_recommendations = RecommendationEngine.compose_recommendations
+    
+    def get_batch_recommendations(self, user_ids: List[str], num_recommendations: int,
+                                  recommendation_type: str = "general", category: Optional[str] = None,
+                                  window: str = TRENDING_DEFAULT_WINDOW) -> Iterator[Tuple[str, List[Dict[str, float]]]]:
+        """Yield (user_id, recommendations) for many users, one scatter per user"""
+        if recommendation_type == TRENDING:
+            trending = self.get_trending_recommendations(num_recommendations, category, window)
+            for user_id in user_ids:
+                yield user_id, trending
+            return
+        for user_id in user_ids:
+            yield user_id, self.get_recommendations(user_id, num_recommendations, recommendation_type)
+    
+    def find_similar_products(self, product_id: str, num_results: int) -> List[tuple]:
+        vector = self._owner(product_id).call("product_vector", product_id).result()
+        if vector is None:
+            return []
+        parts = self._scatter("nearest_products", vector, num_results, product_id)
+        return heapq.nlargest(num_results, chain.from_iterable(parts), key=itemgetter(1))
+    
+    def find_similar_text_products(self, product_id: str, num_results: int) -> List[tuple]:
+        text = self._owner(product_id).call("product_text", product_id).result()
+        if not text:
+            return []
+        parts = self._scatter("search_products", text, num_results + 1)
+        others = (result for result in chain.from_iterable(parts) if result[0] != product_id)
+        return heapq.nlargest(num_results, others, key=itemgetter(1))
+    
+    def search_products(self, query: str, num_results: int) -> List[tuple]:
+        parts = self._scatter("search_products", query, num_results)
+        return heapq.nlargest(num_results, chain.from_iterable(parts), key=itemgetter(1))
+    
+    def _social_neighbourhood(self, user_id: str, connections: List[str]):
+        """``SocialGraph.neighbourhood`` over user IDs, plus each returned user's social row.
+        
+        Second-hop users are ranked before their shards are asked for their
+        rows, so any that have no profile leave their slot unused.
+        """
+        friends = sorted(set(connections) - {user_id})
+        rows = self._social_rows(friends)
+        friends = [f for f in friends if f in rows]
+        if not friends:
+            return [], np.zeros(0), np.zeros(0, dtype=bool), {}
+        
+        weights = np.asarray([MUTUAL_WEIGHT if user_id in rows[f][0] else ONE_WAY_WEIGHT for f in friends])
+        keep = top_k_indices(weights, SOCIAL_MAX_NODES)
+        users, user_weights = [friends[i] for i in keep], [weights[keep]]
+        
+        budget = SOCIAL_MAX_NODES - len(keep)
+        if SOCIAL_HOPS >= 2 and budget > 0:
+            known, reach = set(friends) | {user_id}, {}
+            for i in top_k_indices(weights, SOCIAL_EXPANSION_LIMIT):
+                path = weights[i] * ONE_WAY_WEIGHT * HOP_DECAY
+                for other in rows[friends[i]][0]:
+                    if other not in known:
+                        reach[other] = reach.get(other, 0.0) + path
+            if reach:
+                candidates = sorted(reach)
+                summed = np.minimum([reach[c] for c in candidates], ONE_WAY_WEIGHT)
+                top = top_k_indices(summed, budget)
+                second = self._social_rows([candidates[i] for i in top])
+                found = [i for i in top if candidates[i] in second]
+                rows.update(second)
+                users.extend(candidates[i] for i in found)
+                user_weights.append(summed[found])
+        
+        direct = np.zeros(len(users), dtype=bool)
+        direct[:len(keep)] = True
+        return users, np.concatenate(user_weights), direct, rows
+    
+    def _social_rows(self, user_ids: List[str]) -> Dict[str, tuple]:
+        rows = {}
+        for part in self._partitioned("social_rows", user_ids, lambda u: u):
+            rows.update(part)
+        return rows
+    
+    def _user_state(self, user_id: str):
+        return self._owner(user_id).call("user_state", user_id).result()
+    
+    def _owner(self, key: str) -> ShardClient:
+        return self.shards[shard_of(key, len(self.shards))]
+    
+    def _scatter(self, method: str, *args) -> list:
+        """Call ``method`` on every shard in parallel; results in shard order"""
+        futures = [shard.call(method, *args) for shard in self.shards]
+        return [future.result() for future in futures]
+    
+    def _partitioned(self, method: str, items: list, key) -> list:
+        """Call ``method`` on each shard with the items it owns"""
+        groups: Dict[int, list] = {}
+        for item in items:
+            groups.setdefault(shard_of(key(item), len(self.shards)), []).append(item)
+        futures = [self.shards[shard].call(method, group) for shard, group in groups.items()]
+        return [future.result() for future in futures]
+    
+    def _partitioned_each(self, method: str, items: list, key) -> list:
+        """``_partitioned`` for methods returning one result per item; results in item order"""
+        groups: Dict[int, List[int]] = {}
+        for i, item in enumerate(items):
+            groups.setdefault(shard_of(key(item), len(self.shards)), []).append(i)
+        futures = [
+            (positions, self.shards[shard].call(method, [items[i] for i in positions]))
+            for shard, positions in groups.items()
+        ]
+        results = [None] * len(items)
+        for positions, future in futures:
+            for i, result in zip(positions, future.result()):
+                results[i] = result
+        return results
+        
+# Global recommendation engine instance, warm-started from the latest snapshot.
+# Shard processes must not spawn shards of their own.
+if ENGINE_SHARDS > 1 and multiprocessing.parent_process() is None:
+    recommendation_engine = ShardedRecommendationEngine.spawn(ENGINE_SHARDS, SNAPSHOT_PATH)
+    logger.info(f"Started {ENGINE_SHARDS} engine shards")
+elif SNAPSHOT_PATH and has_snapshot(SNAPSHOT_PATH):
+    recommendation_engine = RecommendationEngine.load_snapshot(SNAPSHOT_PATH)
+    logger.info(f"Loaded snapshot from {SNAPSHOT_PATH}: {recommendation_engine.user_item_matrix.num_users} users")
+else:
+    recommendation_engine = RecommendationEngine()
+scoring_executor = ScoringExecutor(
+    SCORING_WORKERS, SCORING_QUEUE_SIZE, SCORING_TIMEOUT, on_start=queue_wait_seconds.observe
+)
+
+engine_sizes = {"users": 0, "products": 0, "purchases": 0}
+metrics.gauge("recommendation_engine_users", "Users in the engine",
+              lambda: engine_sizes["users"])
+metrics.gauge("recommendation_engine_products", "Products in the catalogue",
+              lambda: engine_sizes["products"])
+metrics.gauge("recommendation_engine_purchases", "Stored user-product purchases (matrix nnz)",
+              lambda: engine_sizes["purchases"])
+metrics.gauge("scoring_queue_depth", "Scoring jobs accepted but not yet running",
+              lambda: scoring_executor.queued)
+metrics.gauge("scoring_jobs_running", "Scoring jobs running on a worker",
+              lambda: scoring_executor.running)
+metrics.gauge("scoring_queue_capacity", "Jobs the scoring pool accepts before shedding load",
+              lambda: scoring_executor.max_pending)
+metrics.gauge("recommendation_cache_lookups_total", "Recommendation cache lookups by outcome",
+              lambda: {("local_hit",): recommendation_cache.local_hits,
+                       ("redis_hit",): recommendation_cache.redis_hits,
+                       ("miss",): recommendation_cache.misses},
+              labels=("outcome",), kind="counter")
 
-# Global recommendation engine instance
-recommendation_engine = RecommendationEngine()
+def cache_hit_ratios() -> Dict[tuple, float]:
+    stats = recommendation_cache.stats()
+    return {
+        ("local",): stats["local_hit_ratio"],
+        ("redis",): stats["redis_hit_ratio"],
+        ("any",): stats["hit_ratio"],
+    }
+
+metrics.gauge("candidate_pool_users", "Recently active users tracked for candidate pools",
+              lambda: len(candidate_pools))
+metrics.gauge("candidate_pool_lookups_total", "Candidate pool lookups on cache misses by outcome",
+              lambda: {("hit",): candidate_pools.hits, ("miss",): candidate_pools.misses},
+              labels=("outcome",), kind="counter")
+metrics.gauge("recommendation_cache_hit_ratio", "Share of lookups served by each cache tier",
+              cache_hit_ratios, labels=("tier",))
+
+async def run_read(fn, *args):
+    """Run an engine read on the scoring pool"""
+    def call():
+        with recommendation_engine.lock.reading():
+            return fn(*args)
+    return await scoring_executor.run(call)
+
+async def run_write(fn, *args):
+    """Run an engine update on the scoring pool"""
+    def call():
+        with recommendation_engine.lock.writing():
+            return fn(*args)
+    return await scoring_executor.run(call)
+
+def overloaded(e: ExecutorSaturated) -> HTTPException:
+    return HTTPException(
+        status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)}
+    )
+
+def write_timed_out(what: str) -> HTTPException:
+    """503 for a write that timed out; it may still be applied, so the client should retry"""
+    return HTTPException(
+        status_code=503, detail=f"{what} timed out and may still be applied; retry it",
+        headers={"Retry-After": str(scoring_executor.retry_after)}
+    )
 
 @app.post("/users/profile")
 async def add_user_profile(profile: UserProfile):
     """Add or update user profile"""
+    applied = False
     try:
-        recommendation_engine.add_user_profile(profile)
-        
-        # Cache in Redis
-        redis_client.setex(
-            f"user_profile:{profile.user_id}",
-            3600,  # 1 hour TTL
-            json.dumps(profile.dict())
-        )
-        
+        await run_write(recommendation_engine.add_user_profile, profile)
+        applied = True
         return {"status": "success", "message": f"Profile added for user {profile.user_id}"}
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise write_timed_out("Profile update")
     except Exception as e:
         logger.error(f"Error adding user profile: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Drop the user's cached recommendations and pools even when the
+        # write timed out, since it may still land; cache the profile only
+        # once it is applied
+        recommendation_cache.invalidate_local(profile.user_id)
+        candidate_pools.invalidate([profile.user_id])
+        profile_key = f"user_profile:{profile.user_id}"
+        stale = recommendation_cache.keys(profile.user_id)
+        await redis_client.setex_many(
+            {profile_key: json.dumps(profile.dict())} if applied else {},
+            3600,  # 1 hour TTL
+            delete=stale if applied else stale + [profile_key]
+        )
+
+async def ingest_upload(request: Request, model: Type[BaseModel], apply_batch, cache_batch):
+    """Stream an NDJSON, JSON array, Arrow or Parquet upload into the engine in batches.
+    
+    Each batch is validated and applied on a worker thread under one write
+    lock, then its cache writes go out as a single Redis pipeline. Invalid
+    records are skipped and reported rather than failing the upload.
+    """
+    try:
+        upload = upload_format(request.headers.get("content-type"))
+    except BulkFormatError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    
+    report = IngestReport(model)
+    
+    def apply(rows):
+        batch = [item for item in (report.validate(row, record) for row, record in rows) if item is not None]
+        with recommendation_engine.lock.writing():
+            apply_batch(batch)
+        return batch
+    
+    async def flush(rows):
+        batch = await asyncio.to_thread(apply, rows)
+        report.loaded += len(batch)
+        await cache_batch(batch)
+    
+    try:
+        rows = []
+        async for row, record in iter_records(request.stream(), upload):
+            rows.append((row, record))
+            if len(rows) == BULK_BATCH_SIZE:
+                await flush(rows)
+                rows = []
+        if rows:
+            await flush(rows)
+    except BulkFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error during bulk ingest: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    logger.info(f"Bulk ingested {report.loaded} {model.__name__} records, rejected {report.rejected}")
+    return {"status": "success", **report.summary()}
+
+async def cache_profiles(profiles: List[UserProfile]):
+    """Cache profiles and drop their users' cached recommendations in one pipeline"""
+    for profile in profiles:
+        recommendation_cache.invalidate_local(profile.user_id)
+    candidate_pools.invalidate(p.user_id for p in profiles)
+    await redis_client.setex_many(
+        {f"user_profile:{p.user_id}": json.dumps(p.dict()) for p in profiles},
+        3600,  # 1 hour TTL
+        delete=[key for p in profiles for key in recommendation_cache.keys(p.user_id)]
+    )
+
+async def cache_products(products: List[ProductFeatures]):
+    await redis_client.setex_many(
+        {f"product:{p.product_id}": json.dumps(p.dict()) for p in products},
+        3600  # 1 hour TTL
+    )
+
+@app.post("/users/profile/bulk")
+async def bulk_add_user_profiles(request: Request):
+    """Add or update many user profiles from an NDJSON, JSON array, Arrow or Parquet upload"""
+    return await ingest_upload(request, UserProfile, recommendation_engine.add_user_profiles, cache_profiles)
+
+@app.post("/products/bulk")
+async def bulk_add_products(request: Request):
+    """Add or update many products from an NDJSON, JSON array, Arrow or Parquet upload"""
+    return await ingest_upload(request, ProductFeatures, recommendation_engine.add_products, cache_products)
+
+@app.get("/users/{user_id}/profile", response_model=UserProfile)
+async def get_user_profile(user_id: str):
+    """Get a stored user profile"""
+    profile = await run_read(recommendation_engine.get_user_profile, user_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Unknown user {user_id}")
+    return profile
 
 @app.post("/products")
 async def add_product(product: ProductFeatures):
     """Add or update product features"""
     try:
-        recommendation_engine.add_product_features(product)
-        
-        # Cache in Redis
-        redis_client.setex(
-            f"product:{product.product_id}",
-            3600,  # 1 hour TTL
-            json.dumps(product.dict())
-        )
-        
-        return {"status": "success", "message": f"Product {product.product_id} added"}
+        await run_write(recommendation_engine.add_product_features, product)
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        # The cached copy may be stale whether or not the write lands
+        await redis_client.delete([f"product:{product.product_id}"])
+        raise write_timed_out("Product update")
     except Exception as e:
         logger.error(f"Error adding product: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    # Cache in Redis
+    await redis_client.setex(
+        f"product:{product.product_id}",
+        3600,  # 1 hour TTL
+        json.dumps(product.dict())
+    )
+    return {"status": "success", "message": f"Product {product.product_id} added"}
+
+@app.get("/products/search")
+async def search_products(q: str, num_results: int = 10):
+    """Products matching a free-text query over descriptions and tags"""
+    try:
+        results = await run_read(recommendation_engine.search_products, q, num_results)
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Product search timed out")
+    return {"query": q, "products": [{"product_id": p, "score": score} for p, score in results]}
+
+@app.get("/products/{product_id}/similar")
+async def get_similar_products(product_id: str, num_results: int = 10, by: str = "text"):
+    """Products similar to one product, by description text or by features"""
+    finders = {
+        "text": recommendation_engine.find_similar_text_products,
+        "features": recommendation_engine.find_similar_products,
+    }
+    if by not in finders:
+        raise HTTPException(status_code=400, detail=f"Unknown similarity {by}")
+    try:
+        if not await run_read(recommendation_engine.has_product, product_id):
+            raise HTTPException(status_code=404, detail=f"Unknown product {product_id}")
+        results = await run_read(finders[by], product_id, num_results)
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Similar product lookup timed out")
+    return {
+        "product_id": product_id,
+        "by": by,
+        "similar": [{"product_id": p, "score": score} for p, score in results],
+    }
 
 @app.post("/recommendations", response_model=RecommendationResponse)
 async def get_recommendations(request: RecommendationRequest):
     """Get personalized recommendations for a user"""
+    if request.recommendation_type == TRENDING:
+        return await trending_response(request)
+    # Unknown types are served by the hybrid path
+    recommendation_type = request.recommendation_type
+    if recommendation_type not in RECOMMENDATION_TYPES:
+        recommendation_type = "general"
+    profile = profiler.start()
+    try:
+        with request_seconds.time(recommendation_type):
+            return await recommend(request, recommendation_type, profile)
+    finally:
+        path = profiler.finish(profile, recommendation_type)
+        if path:
+            logger.warning(f"Slow {recommendation_type} recommendation request profiled to {path}")
+
+async def recommend(request: RecommendationRequest, recommendation_type: str, profile) -> Response:
+    candidate_pools.touch(request.user_id)
     try:
         # Check cache first
-        cache_key = f"recommendations:{request.user_id}:{request.recommendation_type}:{request.num_recommendations}"
-        cached_result = redis_client.get(cache_key)
+        with stage_timer.time("cache", recommendation_type):
+            sources = await recommendation_cache.get(
+                request.user_id, recommendation_type, request.num_recommendations
+            )
         
-        if cached_result:
-            return RecommendationResponse(**json.loads(cached_result))
+        if sources is None:
+            # Generate recommendations based on type, off the event loop, deep
+            # enough that smaller requests can be sliced from the same entry
+            depth = max(request.num_recommendations, RECOMMENDATION_CACHE_DEPTH)
+            epoch = recommendation_cache.epoch(request.user_id)
+            
+            def score():
+                with profiler.attach(profile), stage_timer.bind(recommendation_type):
+                    waiting = time.perf_counter()
+                    with recommendation_engine.lock.reading():
+                        stage_timer.observe("lock", time.perf_counter() - waiting)
+                        if recommendation_type in candidate_pools.recommendation_types:
+                            with stage_timer.time("pool"):
+                                sources = candidate_pools.lookup(
+                                    request.user_id, recommendation_type, source_depths(recommendation_type, depth),
+                                    partial(recommendation_engine.purchased_mask, request.user_id)
+                                )
+                            if sources is not None:
+                                return sources
+                        with stage_timer.time("scoring"):
+                            return recommendation_engine.get_recommendation_sources(
+                                request.user_id, depth, recommendation_type
+                            )
+            
+            sources = await scoring_executor.run(score)
+            with stage_timer.time("cache_store", recommendation_type):
+                await recommendation_cache.set(
+                    request.user_id, recommendation_type, depth, sources, epoch
+                )
         
-        # Generate recommendations based on type
-        if request.recommendation_type == "collaborative":
-            recommendations = recommendation_engine.get_collaborative_recommendations(
-                request.user_id, request.num_recommendations
+        # Encoded here rather than by FastAPI so serialization is timed and profiled
+        with profiler.attach(profile), stage_timer.time("serialization", recommendation_type):
+            recommendations = recommendation_engine.compose_recommendations(
+                sources, request.num_recommendations, recommendation_type
             )
-        elif request.recommendation_type == "content":
-            recommendations = recommendation_engine.get_content_based_recommendations(
-                request.user_id, request.num_recommendations
+            response = RecommendationResponse(
+                user_id=request.user_id,
+                recommendations=recommendations,
+                confidence_scores=[rec["score"] for rec in recommendations],
+                recommendation_type=request.recommendation_type
             )
-        elif request.recommendation_type == "social":
-            recommendations = recommendation_engine.get_social_recommendations(
-                request.user_id, request.num_recommendations
-            )
-        else:  # "general" - hybrid approach
-            collab_recs = recommendation_engine.get_collaborative_recommendations(
-                request.user_id, request.num_recommendations // 2
-            )
-            content_recs = recommendation_engine.get_content_based_recommendations(
-                request.user_id, request.num_recommendations // 2
-            )
-            recommendations = collab_recs + content_recs
-        
-        # Calculate confidence scores
-        confidence_scores = [rec["score"] for rec in recommendations]
-        
-        response = RecommendationResponse(
-            user_id=request.user_id,
-            recommendations=recommendations,
-            confidence_scores=confidence_scores,
-            recommendation_type=request.recommendation_type
-        )
-        
-        # Cache the result
-        redis_client.setex(cache_key, 1800, json.dumps(response.dict()))  # 30 minutes TTL
-        
-        return response
+            body = json.dumps(response.dict())
+        return Response(body, media_type="application/json")
         
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Recommendation scoring timed out")
     except Exception as e:
         logger.error(f"Error generating recommendations: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def trending_response(request: RecommendationRequest) -> RecommendationResponse:
+    """Slice the precomputed trending list; no per-user scoring or caching"""
+    if request.window not in TRENDING_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Unknown trending window {request.window}")
+    try:
+        recommendations = await run_read(
+            recommendation_engine.get_trending_recommendations,
+            request.num_recommendations, request.category, request.window
+        )
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Trending lookup timed out")
+    return RecommendationResponse(
+        user_id=request.user_id,
+        recommendations=recommendations,
+        confidence_scores=[rec["score"] for rec in recommendations],
+        recommendation_type=TRENDING
+    )
+
+@app.post("/recommendations/batch")
+async def get_batch_recommendations(request: BatchRecommendationRequest):
+    """Stream recommendations for many users as NDJSON, one user per line"""
+    if request.recommendation_type == TRENDING and request.window not in TRENDING_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Unknown trending window {request.window}")
+    # Readers must not compact the purchase matrix themselves, so do it once
+    # here under the write lock rather than rebuild it for every block
+    if request.recommendation_type != TRENDING and recommendation_engine.needs_compaction:
+        try:
+            await run_write(recommendation_engine.compact)
+        except ExecutorSaturated as e:
+            raise overloaded(e)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=504, detail="Batch preparation timed out")
+    # Each block is scored and serialized as its own job on the scoring pool,
+    # so batches share its queue limit and updates interleave between blocks
+    def score(block: List[str]) -> str:
+        results = recommendation_engine.get_batch_recommendations(
+            block, request.num_recommendations, request.recommendation_type, request.category, request.window
+        )
+        lines = []
+        for user_id, recommendations in results:
+            response = RecommendationResponse(
+                user_id=user_id,
+                recommendations=recommendations,
+                confidence_scores=[rec["score"] for rec in recommendations],
+                recommendation_type=request.recommendation_type
+            )
+            lines.append(json.dumps(response.dict()) + "\n")
+        return "".join(lines)
+    
+    blocks = [request.user_ids[i:i + BATCH_BLOCK_SIZE] for i in range(0, len(request.user_ids), BATCH_BLOCK_SIZE)]
+    # The first block decides the status code; later ones wait out a full queue
+    try:
+        first = await run_read(score, blocks[0]) if blocks else ""
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Batch recommendation scoring timed out")
+    
+    async def generate():
+        yield first
+        for sent, block in enumerate(blocks[1:], 1):
+            while True:
+                try:
+                    yield await run_read(score, block)
+                    break
+                except ExecutorSaturated as e:
+                    await asyncio.sleep(e.retry_after)
+                except asyncio.TimeoutError:
+                    # Too late for an error status; the response ends short
+                    logger.error(f"Batch recommendation scoring timed out after {sent * BATCH_BLOCK_SIZE} users")
+                    return
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def apply_events(events: List[ProductEvent]) -> Tuple[np.ndarray, List[str]]:
+    """Append purchases to user histories and count every event toward trending"""
+    changed = recommendation_engine.add_purchases(events)
+    return recommendation_engine.record_events(events), changed
+
+async def apply_event_batch(events: List[ProductEvent]) -> List[bool]:
+    """Apply one micro-batch under a single write lock, then drop the cache entries it made stale.
+    
+    Only users whose purchase history changed lose their cached profile and
+    recommendations, all in one Redis round trip. If the write times out it
+    may still land, so every buyer in the batch is treated as changed.
+    """
+    changed = []
+    try:
+        counted, changed = await run_write(apply_events, events)
+    except asyncio.TimeoutError:
+        changed = list(dict.fromkeys(e.user_id for e in events if e.event_type == "purchase" and e.user_id))
+        raise
+    finally:
+        for user_id in changed:
+            recommendation_cache.invalidate_local(user_id)
+        # Pools stay servable: requests filter out purchases made since they were built
+        candidate_pools.changed(changed)
+        if changed:
+            await redis_client.delete(
+                chain.from_iterable([f"user_profile:{u}", *recommendation_cache.keys(u)] for u in changed)
+            )
+    # A purchase by a known user is kept in their history even if the
+    # product is not in the catalogue and so not counted for trending
+    return [bool(c) or (e.event_type == "purchase" and bool(e.user_id)) for c, e in zip(counted, events)]
+
+event_batcher = MicroBatcher(apply_event_batch, EVENT_BATCH_SIZE, EVENT_BATCH_DELAY)
+
+@app.post("/events")
+async def record_events(events: List[ProductEvent]):
+    """Record purchase and engagement events.
+    
+    Every event counts toward trending; a purchase with a user_id is also
+    appended to that user's purchase history, with no need to re-post the
+    profile. Events from concurrent requests are applied in micro-batches,
+    and the response is sent once this request's events are applied.
+    """
+    unknown = {e.event_type for e in events} - set(EVENT_WEIGHTS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown event types: {sorted(unknown)}")
+    for event in events:
+        if event.user_id:
+            candidate_pools.touch(event.user_id)
+    try:
+        recorded = sum(await event_batcher.submit(events))
+        return {"status": "success", "recorded": recorded, "ignored": len(events) - recorded}
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise write_timed_out("Event batch")
+    except Exception as e:
+        logger.error(f"Error recording events: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/trending")
+async def get_trending(num_results: int = 10, category: Optional[str] = None,
+                       window: str = TRENDING_DEFAULT_WINDOW):
+    """Trending products, the same for every user"""
+    if window not in TRENDING_WINDOWS:
+        raise HTTPException(status_code=400, detail=f"Unknown trending window {window}")
+    
+    def lookup():
+        return (
+            recommendation_engine.trending_refreshed_at,
+            recommendation_engine.get_trending_recommendations(num_results, category, window),
+        )
+    
+    try:
+        refreshed_at, products = await run_read(lookup)
+    except ExecutorSaturated as e:
+        raise overloaded(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Trending lookup timed out")
+    return {"window": window, "category": category, "refreshed_at": refreshed_at, "products": products}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "recommendation-engine"}
+    return {
+        "status": "healthy",
+        "service": "recommendation-engine",
+        "cache": "up" if redis_client.available else "bypassed"
+    }
+
+@app.post("/admin/snapshot")
+async def save_snapshot():
+    """Write the engine state to SNAPSHOT_PATH"""
+    if not SNAPSHOT_PATH:
+        raise HTTPException(status_code=400, detail="SNAPSHOT_PATH is not configured")
+    
+    def save():
+        # Compacting needs the write lock; serializing only needs the read lock
+        if recommendation_engine.needs_compaction:
+            with recommendation_engine.lock.writing():
+                recommendation_engine.compact()
+        with recommendation_engine.lock.reading():
+            return recommendation_engine.save_snapshot(SNAPSHOT_PATH)
+    
+    try:
+        path = await asyncio.to_thread(save)
+        return {"status": "success", "path": path}
+    except Exception as e:
+        logger.error(f"Error writing snapshot: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit-rate counters for the local and Redis cache tiers"""
+    return recommendation_cache.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Latency histograms, cache, engine and executor gauges in the Prometheus text format"""
+    return Response(metrics.render(), media_type=MetricsRegistry.CONTENT_TYPE)
+
+async def refresh_trending_periodically():
+    """Rebuild the trending lists every TRENDING_REFRESH_INTERVAL seconds"""
+    def refresh():
+        with recommendation_engine.lock.reading():
+            recommendation_engine.refresh_trending()
+    
+    while True:
+        try:
+            await asyncio.to_thread(refresh)
+        except Exception as e:
+            logger.error(f"Error refreshing trending: {str(e)}")
+        await asyncio.sleep(TRENDING_REFRESH_INTERVAL)
+
+async def refit_text_index_periodically():
+    """Refit the text vocabulary when enough products have changed"""
+    while True:
+        try:
+            # A sharded engine asks every shard, so check off the event loop too
+            if await asyncio.to_thread(lambda: recommendation_engine.needs_text_refit):
+                await asyncio.to_thread(recommendation_engine.refit_text_index)
+        except Exception as e:
+            logger.error(f"Error refitting text index: {str(e)}")
+        await asyncio.sleep(TEXT_INDEX_REFIT_INTERVAL)
+
+async def train_vector_indexes_periodically():
+    """Retrain the IVF centroids once an index has outgrown them"""
+    while True:
+        try:
+            if await asyncio.to_thread(lambda: recommendation_engine.needs_vector_training):
+                await asyncio.to_thread(recommendation_engine.train_vector_indexes)
+        except Exception as e:
+            logger.error(f"Error training vector indexes: {str(e)}")
+        await asyncio.sleep(ANN_TRAIN_INTERVAL)
+
+async def refresh_engine_sizes_periodically():
+    """Update the sizes behind the engine gauges every ENGINE_SIZES_INTERVAL seconds"""
+    while True:
+        try:
+            engine_sizes.update(await run_read(recommendation_engine.sizes))
+        except Exception as e:
+            logger.error(f"Error reading engine sizes: {str(e)}")
+        await asyncio.sleep(ENGINE_SIZES_INTERVAL)
+
+def refresh_candidate_pools() -> int:
+    """Rebuild the most urgent candidate pools.
+    
+    Pools are scored by the same path as live requests, so serving from a
+    pool returns the products a cache miss would have, in the same order,
+    with scores rounded to float32. The read lock is taken per user to let
+    updates in between.
+    """
+    user_ids = candidate_pools.due(CANDIDATE_POOL_REFRESH_BATCH)
+    depth = candidate_pools.depth
+    for user_id in user_ids:
+        for recommendation_type in candidate_pools.recommendation_types:
+            # Taken before the lock so changes that race the rebuild count as newer
+            built_at = time.time()
+            with recommendation_engine.lock.reading():
+                sources = recommendation_engine.get_recommendation_sources(user_id, depth, recommendation_type)
+            candidate_pools.store(
+                user_id, recommendation_type, source_depths(recommendation_type, depth), sources, built_at
+            )
+    return len(user_ids)
+
+async def refresh_candidate_pools_periodically():
+    """Rebuild candidate pools continuously while a backlog remains, else every CANDIDATE_POOL_REFRESH_INTERVAL"""
+    while True:
+        refreshed = 0
+        try:
+            refreshed = await asyncio.to_thread(refresh_candidate_pools)
+        except Exception as e:
+            logger.error(f"Error refreshing candidate pools: {str(e)}")
+        if refreshed < CANDIDATE_POOL_REFRESH_BATCH:
+            await asyncio.sleep(CANDIDATE_POOL_REFRESH_INTERVAL)
+
+factor_training = asyncio.Lock()
+
+async def train_factor_model() -> Optional[FactorModel]:
+    """Retrain the factor model on a worker thread; None if a run is already going or the engine is sharded"""
+    if factor_training.locked() or isinstance(recommendation_engine, ShardedRecommendationEngine):
+        return None
+    async with factor_training:
+        return await asyncio.to_thread(recommendation_engine.train_factor_model, **ALS_OPTIONS)
+
+async def retrain_factor_model_periodically():
+    """Retrain every FACTOR_RETRAIN_INTERVAL seconds, starting at startup"""
+    while True:
+        try:
+            await train_factor_model()
+        except Exception as e:
+            logger.error(f"Error training factor model: {str(e)}")
+        await asyncio.sleep(FACTOR_RETRAIN_INTERVAL)
+
+@app.post("/admin/train-model", status_code=202)
+async def start_factor_training():
+    """Start retraining the collaborative factor model in the background"""
+    if isinstance(recommendation_engine, ShardedRecommendationEngine):
+        raise HTTPException(status_code=400, detail="Factor models are not available with a sharded engine")
+    if factor_training.locked():
+        raise HTTPException(status_code=409, detail="Factor model training already running")
+    await factor_training.acquire()
+    
+    async def train():
+        try:
+            await asyncio.to_thread(recommendation_engine.train_factor_model, **ALS_OPTIONS)
+        except Exception as e:
+            logger.error(f"Error training factor model: {str(e)}")
+        finally:
+            factor_training.release()
+    
+    app.state.training_task = asyncio.create_task(train())
+    return {"status": "training"}
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.trending_task = asyncio.create_task(refresh_trending_periodically())
+    app.state.text_index_task = asyncio.create_task(refit_text_index_periodically())
+    app.state.vector_index_task = asyncio.create_task(train_vector_indexes_periodically())
+    app.state.sizes_task = asyncio.create_task(refresh_engine_sizes_periodically())
+    app.state.pool_task = None
+    if candidate_pools.recommendation_types:
+        app.state.pool_task = asyncio.create_task(refresh_candidate_pools_periodically())
+    app.state.factor_task = None
+    sharded = isinstance(recommendation_engine, ShardedRecommendationEngine)
+    if COLLABORATIVE_MODEL == "als" and FACTOR_RETRAIN_INTERVAL > 0 and not sharded:
+        app.state.factor_task = asyncio.create_task(retrain_factor_model_periodically())
+
+@app.on_event("shutdown")
+async def release_resources():
+    app.state.trending_task.cancel()
+    app.state.text_index_task.cancel()
+    app.state.vector_index_task.cancel()
+    app.state.sizes_task.cancel()
+    if app.state.pool_task is not None:
+        app.state.pool_task.cancel()
+    if app.state.factor_task is not None:
+        app.state.factor_task.cancel()
+    await event_batcher.drain()
+    scoring_executor.shutdown()
+    if isinstance(recommendation_engine, ShardedRecommendationEngine):
+        recommendation_engine.close()
+    await redis_client.close()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,295 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as FrameCounter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Upper bounds (seconds) of the latency buckets; +Inf is implicit
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Latency histogram per label combination, Prometheus bucket semantics.
+
+    Observations only bump one bucket counter under a lock; cumulative
+    counts are summed at scrape time.
+    """
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self._series.items()]
+        for key, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per label combination"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in values)
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time.
+
+    The callback returns a number, or a dict from label-value tuples to
+    numbers when the gauge has labels.
+    """
+
+    def __init__(self, name: str, help: str, read: Callable, labels: Tuple[str, ...] = (),
+                 kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labels = labels
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines.extend(f"{self.name}{_format_labels(self.labels, key)} {value}" for key, value in sorted(values.items()))
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics rendered together in the Prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self._register(Histogram(name, help, labels, **kwargs))
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, read: Callable, labels: Tuple[str, ...] = (),
+              kind: str = "gauge") -> Gauge:
+        return self._register(Gauge(name, help, read, labels, kind))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+class StageTimer:
+    """Per-stage latency histogram labelled with the request's recommendation type.
+
+    ``bind`` sets the type for the calling thread, so engine code deep in
+    the call stack can time a stage without the label being threaded
+    through every signature. Timing is skipped on threads with no bound
+    type, such as batch scoring and background tasks.
+    """
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+        self._local = threading.local()
+
+    @contextmanager
+    def bind(self, recommendation_type: str):
+        previous = getattr(self._local, "type", None)
+        self._local.type = recommendation_type
+        try:
+            yield
+        finally:
+            self._local.type = previous
+
+    def observe(self, stage: str, seconds: float, recommendation_type: Optional[str] = None):
+        recommendation_type = recommendation_type or getattr(self._local, "type", None)
+        if recommendation_type is not None:
+            self.histogram.observe(seconds, recommendation_type, stage)
+
+    @contextmanager
+    def time(self, stage: str, recommendation_type: Optional[str] = None):
+        recommendation_type = recommendation_type or getattr(self._local, "type", None)
+        if recommendation_type is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram.observe(time.perf_counter() - start, recommendation_type, stage)
+
+
+class Profile:
+    """Stack samples collected for one request"""
+
+    def __init__(self):
+        self.stacks = FrameCounter()
+        self.started = time.perf_counter()
+
+
+class SamplingProfiler:
+    """Opt-in wall-clock sampler that dumps flame-graph data for slow requests.
+
+    Each request gets a ``Profile``, and the threads working on it attach
+    to it for the duration of that work. While any profile is open, a
+    daemon thread samples the attached threads' stacks every ``interval``
+    seconds. A finished request at least ``threshold`` seconds long is
+    written to ``output_dir`` in the collapsed-stack format read by
+    flamegraph.pl and speedscope. Only the newest ``keep`` files are kept.
+    Faster requests are discarded. Nothing runs when the profiler is
+    disabled.
+    """
+
+    def __init__(self, threshold: Optional[float], output_dir: str, interval: float = 0.005,
+                 keep: int = 100):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.interval = interval
+        self.keep = keep
+        self.dumped = 0
+        self._attached: Dict[int, Profile] = {}
+        self._open = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold is not None
+
+    def start(self) -> Optional[Profile]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._open += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._wake.set()
+        return Profile()
+
+    @contextmanager
+    def attach(self, profile: Optional[Profile]) -> Iterator[None]:
+        """Sample the calling thread into ``profile`` until the block exits"""
+        if profile is None:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            self._attached[ident] = profile
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._attached.pop(ident, None)
+
+    def finish(self, profile: Optional[Profile], label: str) -> Optional[str]:
+        """Close ``profile``; returns the dump path when the request was slow"""
+        if profile is None:
+            return None
+        with self._lock:
+            self._open -= 1
+            if not self._open:
+                self._wake.clear()
+        elapsed = time.perf_counter() - profile.started
+        if elapsed < self.threshold or not profile.stacks:
+            return None
+        return self._dump(profile, label, elapsed)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                attached = dict(self._attached)
+            if not attached:
+                continue
+            frames = sys._current_frames()
+            for ident, profile in attached.items():
+                frame = frames.get(ident)
+                if frame is not None and ident != own:
+                    profile.stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _dump(self, profile: Profile, label: str, elapsed: float) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{label}-{elapsed * 1000:.0f}ms-{self.dumped}.folded"
+        path = os.path.join(self.output_dir, name)
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in profile.stacks.most_common())
+        self.dumped += 1
+
+        dumps = sorted(
+            (os.path.join(self.output_dir, n) for n in os.listdir(self.output_dir) if n.endswith(".folded")),
+            key=os.path.getmtime,
+        )
+        for old in dumps[:-self.keep]:
+            os.remove(old)
+        return path
@@ -0,0 +1,84 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """Coalesces small submissions from concurrent requests into batches.
+
+    ``submit`` queues a list of items and waits until the batch holding them
+    has been applied. A batch is applied once it holds ``max_items`` items,
+    or ``max_delay`` seconds after its first item arrived, whichever comes
+    first. ``apply`` receives the batch's items and returns one result per
+    item; each caller gets back the results for its own items, or the
+    exception if the batch failed. Batches are applied one at a time in
+    arrival order, and items arriving meanwhile collect into the next one.
+    A submission is never split, so a batch can exceed ``max_items`` by
+    the size of its last submission.
+    """
+
+    def __init__(self, apply: Callable[[list], Awaitable[list]], max_items: int = 1000,
+                 max_delay: float = 0.01):
+        self.apply = apply
+        self.max_items = max_items
+        self.max_delay = max_delay
+        self.batches = 0
+        self._items: list = []
+        self._waiters: List[Tuple[asyncio.Future, int, int]] = []
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        return len(self._items)
+
+    async def submit(self, items: list) -> list:
+        if not items:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        start = len(self._items)
+        self._items.extend(items)
+        self._waiters.append((future, start, len(self._items)))
+        if len(self._items) >= self.max_items:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await future
+
+    async def drain(self):
+        """Wait until every item submitted so far has been applied"""
+        while self._task is not None and not self._task.done():
+            await asyncio.shield(self._task)
+
+    async def _run(self):
+        while self._items:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            items, waiters = self._take()
+            try:
+                results = await self.apply(items)
+            except Exception as e:
+                for future, _, _ in waiters:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            for future, start, end in waiters:
+                # The caller may have gone away; its items are applied regardless
+                if not future.done():
+                    future.set_result(results[start:end])
+
+    def _take(self) -> Tuple[list, List[Tuple[asyncio.Future, int, int]]]:
+        """Detach the oldest submissions up to ``max_items``; the rest wait for the next batch"""
+        count = next(
+            (i + 1 for i, (_, _, end) in enumerate(self._waiters) if end >= self.max_items),
+            len(self._waiters),
+        )
+        waiters, self._waiters = self._waiters[:count], self._waiters[count:]
+        cut = waiters[-1][2]
+        items, self._items = self._items[:cut], self._items[cut:]
+        self._waiters = [(future, start - cut, end - cut) for future, start, end in self._waiters]
+        if len(self._items) < self.max_items:
+            self._full.clear()
+        return items, waiters
@@ -0,0 +1,196 @@
+import sys
+import numpy as np
+from typing import Dict, Iterable, List, Tuple
+
+from snapshot import pack_rows, pack_strings, unpack_strings
+
+
+class RaggedColumn:
+    """Variable-length per-row arrays packed into one growable buffer.
+
+    A row update appends the new values at the end of the buffer and
+    repoints the row; the old values become garbage that is reclaimed by
+    ``compact`` once it outweighs the live data. Reads return views.
+    """
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.values = np.zeros(64, dtype=self.dtype)
+        self.offsets = np.zeros(16, dtype=np.int64)
+        self.lengths = np.zeros(16, dtype=np.int32)
+        self.used = 0
+        self.garbage = 0
+
+    def get(self, row: int) -> np.ndarray:
+        if row >= len(self.offsets):
+            return self.values[:0]
+        start = self.offsets[row]
+        return self.values[start:start + self.lengths[row]]
+
+    def gather(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Concatenated values of several rows, plus the index into ``rows`` each came from"""
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = np.where(rows < len(self.offsets), rows, -1)
+        lengths = np.where(rows >= 0, self.lengths[rows], 0).astype(np.int64)
+        ends = np.cumsum(lengths)
+        flat = np.repeat(self.offsets[rows] - (ends - lengths), lengths) + np.arange(ends[-1] if len(ends) else 0)
+        return self.values[flat], np.repeat(np.arange(len(rows)), lengths)
+
+    def set(self, row: int, values: np.ndarray):
+        values = np.asarray(values, dtype=self.dtype)
+        if row >= len(self.offsets):
+            self._grow_rows(max(row + 1, 2 * len(self.offsets)))
+        self.garbage += int(self.lengths[row])
+
+        end = self.used + len(values)
+        if end > len(self.values):
+            if self.garbage > self.used // 2:
+                self.compact()
+                end = self.used + len(values)
+            if end > len(self.values):
+                grown = np.zeros(max(end, 2 * len(self.values)), dtype=self.dtype)
+                grown[:self.used] = self.values[:self.used]
+                self.values = grown
+
+        self.values[self.used:end] = values
+        self.offsets[row] = self.used
+        self.lengths[row] = len(values)
+        self.used = end
+
+    def compact(self):
+        """Rewrite live rows contiguously, dropping superseded values"""
+        rows = len(self.offsets)
+        live = int(self.lengths.sum())
+        values = np.zeros(max(64, 2 * live), dtype=self.dtype)
+        offsets = np.zeros(rows, dtype=np.int64)
+        np.cumsum(self.lengths[:-1], out=offsets[1:])
+        for row in np.flatnonzero(self.lengths):
+            values[offsets[row]:offsets[row] + self.lengths[row]] = self.get(row)
+        self.values, self.offsets = values, offsets
+        self.used, self.garbage = live, 0
+
+    def to_arrays(self, rows: int) -> Tuple[np.ndarray, np.ndarray]:
+        """CSR-style (indptr, values) for the first ``rows`` rows"""
+        return pack_rows([self.get(row) for row in range(rows)], dtype=self.dtype)
+
+    @classmethod
+    def from_arrays(cls, indptr: np.ndarray, values: np.ndarray) -> "RaggedColumn":
+        column = cls(values.dtype)
+        rows = len(indptr) - 1
+        column.values = values
+        column.offsets = np.array(indptr[:-1], dtype=np.int64)
+        column.lengths = np.diff(indptr).astype(np.int32)
+        column.used = int(indptr[-1])
+        if rows == 0:
+            column.offsets = np.zeros(16, dtype=np.int64)
+            column.lengths = np.zeros(16, dtype=np.int32)
+        return column
+
+    def _grow_rows(self, capacity: int):
+        offsets = np.zeros(capacity, dtype=np.int64)
+        offsets[:len(self.offsets)] = self.offsets
+        lengths = np.zeros(capacity, dtype=np.int32)
+        lengths[:len(self.lengths)] = self.lengths
+        self.offsets, self.lengths = offsets, lengths
+
+
+class Vocabulary:
+    """Interns strings to dense integer codes"""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values: List[str] = []
+        self.index: Dict[str, int] = {}
+        for value in values:
+            self.code(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: str) -> int:
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            value = sys.intern(value)
+            self.index[value] = code
+            self.values.append(value)
+        return code
+
+    def codes(self, values: Iterable[str]) -> np.ndarray:
+        return np.asarray([self.code(v) for v in values], dtype=np.int32)
+
+
+class UserProfileStore:
+    """Struct-of-arrays storage for user profile fields.
+
+    Rows are the user positions of the engine's user-item matrix, which
+    also holds each user's purchases. Preference keys, connection IDs and
+    demographic keys/values are interned into shared vocabularies and
+    stored per user as integer codes, with preference weights as float32.
+    """
+
+    FIELDS = ("preference_keys", "preference_values", "connections",
+              "demographic_keys", "demographic_values")
+    VOCABULARIES = ("preference_keys", "connections", "demographic_keys", "demographic_values")
+
+    def __init__(self):
+        self.vocab = {name: Vocabulary() for name in self.VOCABULARIES}
+        self.columns = {
+            "preference_keys": RaggedColumn(np.int32),
+            "preference_values": RaggedColumn(np.float32),
+            "connections": RaggedColumn(np.int32),
+            "demographic_keys": RaggedColumn(np.int32),
+            "demographic_values": RaggedColumn(np.int32),
+        }
+        self.rows = 0
+
+    def set(self, row: int, preferences: Dict[str, float], social_connections: List[str],
+            demographics: Dict[str, str]):
+        columns, vocab = self.columns, self.vocab
+        columns["preference_keys"].set(row, vocab["preference_keys"].codes(preferences))
+        columns["preference_values"].set(row, list(preferences.values()))
+        columns["connections"].set(row, vocab["connections"].codes(social_connections))
+        columns["demographic_keys"].set(row, vocab["demographic_keys"].codes(demographics))
+        columns["demographic_values"].set(row, vocab["demographic_values"].codes(demographics.values()))
+        self.rows = max(self.rows, row + 1)
+
+    def preferences(self, row: int) -> Dict[str, float]:
+        keys = self.vocab["preference_keys"].values
+        return dict(zip(
+            [keys[k] for k in self.columns["preference_keys"].get(row)],
+            self.columns["preference_values"].get(row).tolist(),
+        ))
+
+    def connections(self, row: int) -> List[str]:
+        ids = self.vocab["connections"].values
+        return [ids[c] for c in self.columns["connections"].get(row)]
+
+    def demographics(self, row: int) -> Dict[str, str]:
+        keys = self.vocab["demographic_keys"].values
+        values = self.vocab["demographic_values"].values
+        return {
+            keys[k]: values[v]
+            for k, v in zip(self.columns["demographic_keys"].get(row),
+                            self.columns["demographic_values"].get(row))
+        }
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        arrays = {}
+        for name, column in self.columns.items():
+            arrays[f"{name}_indptr"], arrays[name] = column.to_arrays(self.rows)
+        for name, vocab in self.vocab.items():
+            arrays[f"vocab_{name}"] = pack_strings(vocab.values)
+        return arrays
+
+    def counts(self) -> Dict[str, int]:
+        return {"rows": self.rows, **{name: len(vocab) for name, vocab in self.vocab.items()}}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], counts: Dict[str, int]) -> "UserProfileStore":
+        store = cls()
+        store.rows = counts["rows"]
+        for name in cls.VOCABULARIES:
+            store.vocab[name] = Vocabulary(unpack_strings(arrays[f"vocab_{name}"], counts[name]))
+        for name in cls.FIELDS:
+            store.columns[name] = RaggedColumn.from_arrays(arrays[f"{name}_indptr"], arrays[name])
+        return store
@@ -0,0 +1,159 @@
+import itertools
+import logging
+import multiprocessing
+import signal
+import threading
+import traceback
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Collection, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    """Shard owning a user or product ID; stable across processes, unlike ``hash``"""
+    return zlib.crc32(key.encode()) % num_shards
+
+
+class ShardError(RuntimeError):
+    """A request failed inside a shard process, or the shard went away"""
+
+
+class ShardClient:
+    """Calling side of one shard process, connected by a pipe.
+
+    Requests are tagged with an ID and any number may be in flight at once:
+    ``call`` sends and returns a future, and a receiver thread resolves
+    futures as replies arrive, in whatever order the shard finishes them.
+    If the shard exits, every pending and later call fails with
+    ``ShardError``.
+    """
+
+    def __init__(self, connection, process: Optional[multiprocessing.Process] = None):
+        self.connection = connection
+        self.process = process
+        self._ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._receiver = threading.Thread(target=self._receive, name="shard-client", daemon=True)
+        self._receiver.start()
+
+    def call(self, method: str, *args) -> Future:
+        future = Future()
+        with self._send_lock:
+            if self._closed:
+                raise ShardError("Shard connection is closed")
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            try:
+                self.connection.send((request_id, method, args))
+            except (OSError, ValueError) as e:
+                del self._pending[request_id]
+                raise ShardError(f"Shard unreachable: {e}") from e
+        return future
+
+    def close(self, timeout: float = 5.0):
+        with self._send_lock:
+            self._closed = True
+            self.connection.close()
+        if self.process is not None:
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+
+    def _receive(self):
+        while True:
+            try:
+                request_id, ok, result = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(ShardError(result))
+
+        with self._send_lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ShardError("Shard exited"))
+
+
+def serve(connection, target, write_methods: Collection[str] = (),
+          unlocked_methods: Collection[str] = (), workers: int = 4):
+    """Run requests from ``connection`` against ``target`` until the pipe closes.
+
+    Requests run on a thread pool under ``target.lock``: methods in
+    ``write_methods`` hold the write side, those in ``unlocked_methods``
+    manage the lock themselves, and the rest hold the read side. A
+    non-callable attribute is returned as is.
+    """
+    send_lock = threading.Lock()
+
+    def handle(request_id: int, method: str, args: tuple):
+        try:
+            attribute = getattr(target, method)
+            if not callable(attribute):
+                result = attribute
+            elif method in unlocked_methods:
+                result = attribute(*args)
+            elif method in write_methods:
+                with target.lock.writing():
+                    result = attribute(*args)
+            else:
+                with target.lock.reading():
+                    result = attribute(*args)
+            reply = (request_id, True, result)
+        except Exception as e:
+            reply = (request_id, False, f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+        with send_lock:
+            connection.send(reply)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard") as pool:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                break
+            pool.submit(handle, *request)
+
+
+def _run_shard(connection, inherited, build: Callable, shard: int, serve_options: dict):
+    # The coordinator shuts shards down by closing the pipe, not by signal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Forked children inherit the coordinator's ends of earlier shards'
+    # pipes; holding them would keep those shards alive after it exits
+    for other in inherited:
+        other.close()
+    target = build(shard)
+    logger.info(f"Shard {shard} ready")
+    serve(connection, target, **serve_options)
+
+
+def spawn_shards(num_shards: int, build: Callable, **serve_options) -> List[ShardClient]:
+    """Start ``num_shards`` processes serving ``build(shard)`` and connect to them.
+
+    Uses fork where available, so ``build`` need not be importable by a
+    fresh interpreter.
+    """
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    context = multiprocessing.get_context(method)
+    connections, processes = [], []
+    for shard in range(num_shards):
+        parent, child = context.Pipe()
+        inherited = list(connections) if method == "fork" else []
+        process = context.Process(
+            target=_run_shard, args=(child, inherited, build, shard, serve_options),
+            name=f"engine-shard-{shard}", daemon=True,
+        )
+        process.start()
+        child.close()
+        connections.append(parent)
+        processes.append(process)
+    # Receiver threads start only after every fork
+    return [ShardClient(c, p) for c, p in zip(connections, processes)]
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import time
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+CURRENT = "CURRENT"
+META = "meta.json"
+
+
+def write_snapshot(root: str, arrays: Dict[str, np.ndarray], meta: Dict, keep: int = 2) -> str:
+    """Write a snapshot directory under ``root`` and atomically make it current.
+
+    Each array is saved as its own ``.npy`` file so readers can memory-map
+    it. The new directory is fully written and fsynced before the
+    ``CURRENT`` pointer is swapped with ``os.replace``; a crash mid-write
+    leaves the previous snapshot in place. Only the newest ``keep``
+    snapshots are retained.
+    """
+    os.makedirs(root, exist_ok=True)
+    name = f"snapshot-{time.time_ns()}"
+    staging = os.path.join(root, f".{name}.tmp")
+    os.makedirs(staging)
+
+    for key, array in arrays.items():
+        with open(os.path.join(staging, f"{key}.npy"), "wb") as f:
+            np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+    with open(os.path.join(staging, META), "w") as f:
+        json.dump({**meta, "arrays": sorted(arrays)}, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(staging, os.path.join(root, name))
+    pointer = os.path.join(root, f".{CURRENT}.tmp")
+    with open(pointer, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, CURRENT))
+
+    snapshots = sorted(d for d in os.listdir(root) if d.startswith("snapshot-"))
+    for old in snapshots[:-keep]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return os.path.join(root, name)
+
+
+def read_snapshot(root: str, mmap: bool = True) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Load the current snapshot under ``root``.
+
+    With ``mmap`` the arrays are copy-on-write memory maps: worker processes
+    loading the same snapshot share its pages through the OS page cache,
+    and a page is only copied into a process once that process modifies it.
+    """
+    with open(os.path.join(root, CURRENT)) as f:
+        directory = os.path.join(root, f.read().strip())
+    with open(os.path.join(directory, META)) as f:
+        meta = json.load(f)
+
+    arrays = {
+        key: np.load(os.path.join(directory, f"{key}.npy"), mmap_mode="c" if mmap else None)
+        for key in meta.pop("arrays")
+    }
+    return arrays, meta
+
+
+def has_snapshot(root: str) -> bool:
+    return os.path.exists(os.path.join(root, CURRENT))
+
+
+def pack_strings(values: Iterable[str]) -> np.ndarray:
+    """Encode a list of strings as one NUL-separated UTF-8 byte array"""
+    return np.frombuffer("\0".join(values).encode("utf-8"), dtype=np.uint8)
+
+
+def unpack_strings(packed: np.ndarray, count: int) -> List[str]:
+    if count == 0:
+        return []
+    return packed.tobytes().decode("utf-8").split("\0")
+
+
+def pack_rows(rows: List[np.ndarray], dtype=np.int32) -> Tuple[np.ndarray, np.ndarray]:
+    """Concatenate variable-length rows into CSR-style (indptr, values)"""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in rows], out=indptr[1:])
+    values = np.concatenate(rows).astype(dtype) if rows else np.zeros(0, dtype=dtype)
+    return indptr, values
+
+
+def unpack_rows(indptr: np.ndarray, values: np.ndarray) -> List[np.ndarray]:
+    """Split CSR-style arrays back into per-row views (no copy)"""
+    if len(indptr) <= 1:
+        return []
+    return np.split(values[:indptr[-1]], indptr[1:-1])
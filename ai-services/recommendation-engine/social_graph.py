@@ -0,0 +1,113 @@
+import numpy as np
+from typing import List, Tuple
+
+from profile_store import UserProfileStore
+from topk import top_k_indices
+from user_item_matrix import UserItemMatrix
+
+# Tie strengths: reciprocated and one-way connections, and the factor a
+# second-hop path is decayed by
+MUTUAL_WEIGHT = 1.0
+ONE_WAY_WEIGHT = 0.5
+HOP_DECAY = 0.5
+
+
+class SocialGraph:
+    """Directed social graph over user positions.
+
+    Out-edges are the profile store's ``connections`` column: CSR-style
+    ragged arrays of interned connection IDs, one row per user position.
+    ``resolved`` maps each interned ID to that user's matrix position, or -1
+    while the user has no profile, so edges to users who join later resolve
+    without rewriting any row. ``sync`` must run after profile updates.
+    """
+
+    def __init__(self, profiles: UserProfileStore, matrix: UserItemMatrix,
+                 mutual_weight: float = MUTUAL_WEIGHT, one_way_weight: float = ONE_WAY_WEIGHT,
+                 hop_decay: float = HOP_DECAY):
+        self.profiles = profiles
+        self.matrix = matrix
+        self.mutual_weight = mutual_weight
+        self.one_way_weight = one_way_weight
+        self.hop_decay = hop_decay
+        self.resolved = np.full(16, -1, dtype=np.int64)
+        self._codes = 0
+        self._users = 0
+
+    def sync(self):
+        """Resolve connection IDs interned or users added since the last call"""
+        vocab = self.profiles.vocab["connections"]
+        user_index = self.matrix.user_index
+        if len(vocab) > len(self.resolved):
+            grown = np.full(max(len(vocab), 2 * len(self.resolved)), -1, dtype=np.int64)
+            grown[:len(self.resolved)] = self.resolved
+            self.resolved = grown
+        for code in range(self._codes, len(vocab)):
+            self.resolved[code] = user_index.get(vocab.values[code], -1)
+        for position in range(self._users, self.matrix.num_users):
+            code = vocab.index.get(self.matrix.user_ids[position])
+            if code is not None:
+                self.resolved[code] = position
+        self._codes, self._users = len(vocab), self.matrix.num_users
+
+    def out_edges(self, sources: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Resolved targets of the sources' edges, and the index of each edge's source"""
+        codes, owners = self.profiles.columns["connections"].gather(sources)
+        targets = self.resolved[codes]
+        known = targets >= 0
+        return targets[known], owners[known]
+
+    def neighbourhood(self, position: int, hops: int = 2, expansion_limit: int = 200,
+                      max_nodes: int = 5000) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Users within ``hops`` of ``position`` with tie-strength weights.
+
+        Returns ``(nodes, weights, direct)``. Direct connections weigh
+        ``mutual_weight`` when the tie is reciprocated and ``one_way_weight``
+        otherwise. The second hop expands only the ``expansion_limit``
+        strongest ties. A second-hop user's weight sums the paths reaching
+        it, decayed by ``hop_decay`` and capped at ``one_way_weight``. At most
+        ``max_nodes`` users are returned, strongest first within each hop.
+        """
+        targets, _ = self.out_edges(np.asarray([position]))
+        friends = np.unique(targets[targets != position])
+        if not len(friends):
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=bool)
+
+        # Friends' own edges give reciprocity, and are the second hop
+        second, owners = self.out_edges(friends)
+        weights = np.full(len(friends), self.one_way_weight)
+        weights[owners[second == position]] = self.mutual_weight
+        keep = top_k_indices(weights, max_nodes)
+        nodes, node_weights = [friends[keep]], [weights[keep]]
+
+        budget = max_nodes - len(keep)
+        if hops >= 2 and budget > 0:
+            expanded = np.zeros(len(friends), dtype=bool)
+            expanded[top_k_indices(weights, expansion_limit)] = True
+            reach = expanded[owners] & (second != position) & ~np.isin(second, friends)
+            if reach.any():
+                users, inverse = np.unique(second[reach], return_inverse=True)
+                path_weights = weights[owners[reach]] * self.one_way_weight * self.hop_decay
+                summed = np.minimum(np.bincount(inverse, weights=path_weights), self.one_way_weight)
+                top = top_k_indices(summed, budget)
+                nodes.append(users[top])
+                node_weights.append(summed[top])
+
+        direct = np.zeros(sum(len(n) for n in nodes), dtype=bool)
+        direct[:len(keep)] = True
+        return np.concatenate(nodes), np.concatenate(node_weights), direct
+
+
+def weighted_counts(keys: np.ndarray, weights: List[np.ndarray],
+                    size: int) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """Distinct ``keys`` (all below ``size``) and the sum of each weight array per key.
+
+    Counts into a dense array when ``size`` is small next to the number of
+    keys, and sorts the keys otherwise.
+    """
+    if size <= 4 * len(keys):
+        sums = [np.bincount(keys, weights=w, minlength=size) for w in weights]
+        present = np.flatnonzero(np.bincount(keys, minlength=size))
+        return present, [total[present] for total in sums]
+    distinct, inverse = np.unique(keys, return_inverse=True)
+    return distinct, [np.bincount(inverse, weights=w, minlength=len(distinct)) for w in weights]
@@ -0,0 +1,57 @@
+import logging
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVICE_DIR, os.path.join(SERVICE_DIR, "benchmarks")]
+
+import main as service  # noqa: E402
+from candidate_pools import CandidatePools  # noqa: E402
+from cache import RecommendationCache  # noqa: E402
+from executor import ScoringExecutor  # noqa: E402
+from fake_redis import install  # noqa: E402
+from micro_batch import MicroBatcher  # noqa: E402
+from synthetic import make_products, make_profiles  # noqa: E402
+
+logging.getLogger("main").setLevel(logging.CRITICAL)
+
+NUM_USERS = 400
+NUM_PRODUCTS = 300
+
+
+@pytest.fixture(scope="session")
+def catalogue():
+    return list(make_profiles(NUM_USERS, NUM_PRODUCTS, 1)), list(make_products(NUM_PRODUCTS, 1))
+
+
+@pytest.fixture
+def engine(catalogue):
+    profiles, products = catalogue
+    engine = service.RecommendationEngine("exact", collaborative_model="neighbours")
+    engine.bulk_load(profiles, products)
+    return engine
+
+
+@pytest.fixture
+def client(engine, monkeypatch):
+    """A TestClient over a fresh engine, executor, batcher and caches backed by fake Redis.
+
+    The app's shutdown closes the executor, and the batcher must stay on the
+    client's event loop, so each test gets its own instances.
+    """
+    from fastapi.testclient import TestClient
+
+    install(service.redis_client)
+    monkeypatch.setattr(service, "recommendation_engine", engine)
+    monkeypatch.setattr(service, "scoring_executor", ScoringExecutor(2, 8, 2.0))
+    monkeypatch.setattr(service, "recommendation_cache", RecommendationCache(
+        service.redis_client, service.RECOMMENDATION_TYPES, local_entries=1000, local_ttl=60.0
+    ))
+    monkeypatch.setattr(service, "candidate_pools", CandidatePools(
+        service.CANDIDATE_POOL_TYPES, depth=service.RECOMMENDATION_CACHE_DEPTH, max_users=1000, max_age=60.0
+    ))
+    monkeypatch.setattr(service, "event_batcher", MicroBatcher(service.apply_event_batch, 1000, 0.01))
+    with TestClient(service.app) as c:
+        yield c
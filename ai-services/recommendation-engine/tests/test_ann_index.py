@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from ann_index import ExactIndex, IVFIndex, RandomProjector
+
+DIM = 16
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).standard_normal((2000, DIM)).astype(np.float32)
+
+
+def keys(prefix, n):
+    return [f"{prefix}{i}" for i in range(n)]
+
+
+def assert_consistent(index):
+    """Every live slot sits in the list of its nearest centroid, and dead ones in none"""
+    n = len(index.keys)
+    live = np.flatnonzero(index._alive[:n])
+    nearest = np.argmax(index._vectors[live] @ index.centroids.T, axis=1)
+    assert (index._assignment[live] == nearest).all()
+    assert (index._assignment[:n][~index._alive[:n]] == -1).all()
+    assert index._list_sizes.sum() == len(index)
+
+
+def test_auto_train_once_large_enough(vectors):
+    index = IVFIndex(DIM, min_train_size=1024)
+    index.add_many(keys("k", 1000), vectors[:1000])
+    assert not index.is_trained
+    index.add_many(keys("m", 1000), vectors[1000:])
+    assert index.is_trained
+    assert_consistent(index)
+
+
+def test_install_relabels_slots_changed_during_fit(vectors):
+    rng = np.random.default_rng(1)
+    index = IVFIndex(DIM, auto_train=False)
+    index.add_many(keys("k", 2000), vectors)
+    assert not index.is_trained and index.needs_training
+
+    fitted = index.fit(*index.prepare_training())
+    # Updates that land between prepare_training and install
+    for key in keys("k", 50):
+        index.remove(key)
+    index.add_many(keys("n", 200), rng.standard_normal((200, DIM)).astype(np.float32))
+    index.add("k100", -vectors[100])
+    index.install(*fitted)
+
+    assert index.is_trained and not index.needs_training
+    assert_consistent(index)
+    assert "k0" not in index.slots and "n199" in index.slots
+
+
+def test_full_probe_matches_exact_search(vectors):
+    ivf, exact = IVFIndex(DIM, auto_train=False), ExactIndex(DIM)
+    ivf.add_many(keys("k", 2000), vectors)
+    exact.add_many(keys("k", 2000), vectors)
+    ivf.install(*ivf.fit(*ivf.prepare_training()))
+    for query in np.random.default_rng(2).standard_normal((5, DIM)):
+        assert [k for k, _ in ivf.search(query, 10, nprobe=len(ivf._lists))] == \
+            [k for k, _ in exact.search(query, 10)]
+
+
+def test_untrained_index_answers_exactly(vectors):
+    ivf, exact = IVFIndex(DIM, auto_train=False), ExactIndex(DIM)
+    ivf.add_many(keys("k", 500), vectors[:500])
+    exact.add_many(keys("k", 500), vectors[:500])
+    query = vectors[600]
+    assert [k for k, _ in ivf.search(query, 10)] == [k for k, _ in exact.search(query, 10)]
+
+
+def test_projector_cache_is_bounded_and_stable():
+    projector = RandomProjector(DIM, seed=3, token_cache_size=8)
+    first = projector.embed_tokens(["a", "b"])
+    projector.embed_tokens([f"t{i}" for i in range(20)])
+    assert len(projector._token_vectors) <= 8
+    # Evicted directions are regenerated identically
+    assert np.array_equal(projector.embed_tokens(["a", "b"]), first)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import main as service
+
+
+def slow(monkeypatch, obj, name, seconds=0.3):
+    """Make ``obj.name`` sleep first, so it outlasts a short executor timeout"""
+    original = getattr(obj, name)
+
+    def call(*args, **kwargs):
+        time.sleep(seconds)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(obj, name, call)
+
+
+def cached(user_id):
+    """Whether the user has recommendations in either cache tier"""
+    cache = service.recommendation_cache
+    keys = cache.keys(user_id)
+    return any(cache.local.get(key) is not None for key in keys) or any(
+        key in service.redis_client.client._data for key in keys
+    )
+
+
+def profile_body(profile, **changes):
+    return {**profile.dict(), **changes}
+
+
+def test_recommendations_are_cached_and_served(client, catalogue):
+    user_id = catalogue[0][0].user_id
+    first = client.post("/recommendations", json={"user_id": user_id, "num_recommendations": 5})
+    assert first.status_code == 200
+    assert cached(user_id)
+    second = client.post("/recommendations", json={"user_id": user_id, "num_recommendations": 5})
+    assert second.json() == first.json()
+    assert len(first.json()["recommendations"]) == 5
+
+
+def test_saturated_executor_returns_503(client, catalogue):
+    service.scoring_executor.max_pending = 0
+    service.scoring_executor.retry_after = 4
+    response = client.post("/recommendations", json={"user_id": catalogue[0][0].user_id})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "4"
+    response = client.post("/recommendations/batch", json={"user_ids": ["u1", "u2"]})
+    assert response.status_code == 503
+
+
+def test_recommendation_timeout_returns_504(client, engine, catalogue, monkeypatch):
+    slow(monkeypatch, engine, "get_recommendation_sources")
+    service.scoring_executor.timeout = 0.05
+    response = client.post("/recommendations", json={"user_id": catalogue[0][0].user_id})
+    assert response.status_code == 504
+
+
+def test_profile_timeout_returns_503_and_drops_cached_entries(client, engine, catalogue, monkeypatch):
+    profile = catalogue[0][3]
+    client.post("/recommendations", json={"user_id": profile.user_id})
+    assert cached(profile.user_id)
+    epoch = service.recommendation_cache.epoch(profile.user_id)
+
+    slow(monkeypatch, engine, "add_user_profile")
+    service.scoring_executor.timeout = 0.05
+    response = client.post("/users/profile", json=profile_body(profile, purchase_history=["p1"]))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(service.scoring_executor.retry_after)
+    assert not cached(profile.user_id)
+    assert service.recommendation_cache.epoch(profile.user_id) != epoch
+    # The write still lands
+    time.sleep(0.4)
+    assert engine.get_user_profile(profile.user_id).purchase_history == ["p1"]
+
+
+def test_event_timeout_returns_503_and_drops_buyers_entries(client, engine, catalogue, monkeypatch):
+    profiles, products = catalogue
+    buyer, viewer = profiles[5].user_id, profiles[6].user_id
+    for user_id in (buyer, viewer):
+        client.post("/recommendations", json={"user_id": user_id})
+
+    slow(monkeypatch, engine, "add_purchases")
+    service.scoring_executor.timeout = 0.05
+    response = client.post("/events", json=[
+        {"product_id": products[7].product_id, "user_id": buyer},
+        {"product_id": products[8].product_id, "user_id": viewer, "event_type": "view"},
+    ])
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+    assert not cached(buyer)
+    # A view does not change the viewer's history, so their entries stay
+    assert cached(viewer)
+    time.sleep(0.4)
+
+
+def test_events_append_purchases_and_count_results(client, engine, catalogue):
+    profiles, products = catalogue
+    user_id = profiles[9].user_id
+    before = engine.get_user_profile(user_id).purchase_history
+    response = client.post("/events", json=[
+        {"product_id": products[11].product_id, "user_id": user_id},
+        {"product_id": products[12].product_id, "event_type": "click"},
+        {"product_id": "no-such-product", "event_type": "view"},
+    ])
+    assert response.status_code == 200
+    assert response.json() == {"status": "success", "recorded": 2, "ignored": 1}
+    history = engine.get_user_profile(user_id).purchase_history
+    assert history[:len(before)] == before and history[-1] == products[11].product_id
+
+
+def test_concurrent_event_submissions_share_a_batch(client, engine, catalogue):
+    profiles, products = catalogue
+    first = [service.ProductEvent(product_id=products[1].product_id, user_id=profiles[1].user_id)]
+    second = [
+        service.ProductEvent(product_id="no-such-product", event_type="click"),
+        service.ProductEvent(product_id=products[2].product_id, event_type="like"),
+    ]
+
+    async def submit_both():
+        return await asyncio.gather(service.event_batcher.submit(first), service.event_batcher.submit(second))
+
+    batches = service.event_batcher.batches
+    assert client.portal.call(submit_both) == [[True], [False, True]]
+    assert service.event_batcher.batches == batches + 1
+    assert engine.get_user_profile(profiles[1].user_id).purchase_history[-1] == products[1].product_id
+
+
+def test_unknown_event_type_is_rejected(client):
+    response = client.post("/events", json=[{"product_id": "p1", "event_type": "teleport"}])
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("recommendation_type", ["collaborative", "content"])
+def test_batch_streams_one_line_per_user(client, engine, catalogue, monkeypatch, recommendation_type):
+    monkeypatch.setattr(service, "BATCH_BLOCK_SIZE", 3)
+    user_ids = [p.user_id for p in catalogue[0][:7]] + ["nobody"]
+    response = client.post("/recommendations/batch", json={
+        "user_ids": user_ids, "num_recommendations": 4, "recommendation_type": recommendation_type,
+    })
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["user_id"] for line in lines] == user_ids
+    for line in lines:
+        single = engine.get_recommendations(line["user_id"], 4, recommendation_type)
+        assert [r["product_id"] for r in line["recommendations"]] == [r["product_id"] for r in single]
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from executor import ExecutorSaturated, ReadWriteLock, ScoringExecutor
+
+
+def test_writer_excludes_readers():
+    lock = ReadWriteLock()
+    order = []
+    entered, leave = threading.Event(), threading.Event()
+
+    def write():
+        with lock.writing():
+            order.append("write")
+            entered.set()
+            leave.wait(1)
+
+    def read():
+        with lock.reading():
+            order.append("read")
+
+    writer = threading.Thread(target=write)
+    with lock.reading():
+        writer.start()
+        time.sleep(0.05)
+        # The writer waits for the reader to leave
+        assert order == []
+    assert entered.wait(1)
+    # ...and once in, holds off new readers
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.05)
+    assert order == ["write"]
+    leave.set()
+    writer.join(1)
+    reader.join(1)
+    assert order == ["write", "read"]
+
+
+def test_waiting_writer_is_served_before_new_readers():
+    lock = ReadWriteLock()
+    order = []
+
+    def write():
+        with lock.writing():
+            order.append("write")
+
+    def read():
+        with lock.reading():
+            order.append("read")
+
+    with lock.reading():
+        writer = threading.Thread(target=write)
+        writer.start()
+        time.sleep(0.05)
+        reader = threading.Thread(target=read)
+        reader.start()
+        time.sleep(0.05)
+        assert order == []
+    writer.join(1)
+    reader.join(1)
+    assert order == ["write", "read"]
+
+
+def test_run_returns_result_and_releases_slot():
+    async def scenario():
+        executor = ScoringExecutor(2, 4, 1.0)
+        try:
+            assert await executor.run(sum, [1, 2, 3]) == 6
+            await asyncio.sleep(0)
+            return executor.pending
+        finally:
+            executor.shutdown()
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_run_raises_saturated_when_queue_is_full():
+    async def scenario():
+        executor = ScoringExecutor(1, 2, 1.0, retry_after=3)
+        release = threading.Event()
+        try:
+            jobs = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with pytest.raises(ExecutorSaturated) as saturated:
+                await executor.run(sum, [1])
+            release.set()
+            await asyncio.gather(*jobs)
+            await asyncio.sleep(0)
+            # Room again once the queued jobs finish
+            assert await executor.run(sum, [1]) == 1
+            return saturated.value.retry_after
+        finally:
+            release.set()
+            executor.shutdown()
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_timeout_cancels_job_that_has_not_started():
+    started = []
+    release = threading.Event()
+
+    async def scenario():
+        executor = ScoringExecutor(1, 4, 0.05)
+        try:
+            blocker = asyncio.ensure_future(executor.run(release.wait, timeout=5.0))
+            await asyncio.sleep(0)
+            with pytest.raises(asyncio.TimeoutError):
+                await executor.run(started.append, "queued")
+            release.set()
+            await blocker
+            await asyncio.sleep(0.05)
+            return executor.pending
+        finally:
+            release.set()
+            executor.shutdown()
+
+    assert asyncio.run(scenario()) == 0
+    assert started == []
+
+
+def test_timeout_leaves_running_job_to_finish():
+    finished = threading.Event()
+
+    def slow():
+        time.sleep(0.2)
+        finished.set()
+
+    async def scenario():
+        executor = ScoringExecutor(1, 4, 0.05)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await executor.run(slow)
+            # The slot is held until the job really ends
+            assert executor.pending == 1
+            await asyncio.sleep(0.3)
+            return executor.pending
+        finally:
+            executor.shutdown()
+
+    assert asyncio.run(scenario()) == 0
+    assert finished.is_set()
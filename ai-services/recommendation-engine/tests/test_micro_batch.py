@@ -0,0 +1,103 @@
+import asyncio
+
+from micro_batch import MicroBatcher
+
+
+class Recorder:
+    """Batch apply function that records each batch and tags every item with it"""
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        await asyncio.sleep(0)
+        if self.fail_on is not None and self.fail_on in items:
+            raise ValueError(f"bad item {self.fail_on}")
+        return [(len(self.batches), item * 10) for item in items]
+
+
+def test_results_are_routed_to_each_submitter():
+    apply = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(apply, max_items=100, max_delay=0.01)
+        return await asyncio.gather(
+            batcher.submit([1, 2]), batcher.submit([3]), batcher.submit([]), batcher.submit([4, 5, 6])
+        ), batcher.batches
+
+    results, batches = asyncio.run(scenario())
+    assert results == [[(1, 10), (1, 20)], [(1, 30)], [], [(1, 40), (1, 50), (1, 60)]]
+    assert apply.batches == [[1, 2, 3, 4, 5, 6]]
+    assert batches == 1
+
+
+def test_full_batch_is_applied_without_waiting_for_the_delay():
+    apply = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(apply, max_items=3, max_delay=10.0)
+        return await asyncio.wait_for(asyncio.gather(batcher.submit([1, 2]), batcher.submit([3])), 1.0)
+
+    assert asyncio.run(scenario()) == [[(1, 10), (1, 20)], [(1, 30)]]
+
+
+def test_batches_split_between_submissions_at_max_items():
+    apply = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(apply, max_items=3, max_delay=0.01)
+        return await asyncio.gather(
+            batcher.submit([1, 2]), batcher.submit([3, 4]), batcher.submit([5]), batcher.submit([6])
+        )
+
+    results = asyncio.run(scenario())
+    # A submission is never split, so the first batch runs over by one
+    assert apply.batches == [[1, 2, 3, 4], [5, 6]]
+    assert results == [[(1, 10), (1, 20)], [(1, 30), (1, 40)], [(2, 50)], [(2, 60)]]
+
+
+def test_failure_reaches_every_waiter_in_the_batch_only():
+    apply = Recorder(fail_on=2)
+
+    async def scenario():
+        batcher = MicroBatcher(apply, max_items=2, max_delay=0.01)
+        return await asyncio.gather(
+            batcher.submit([1]), batcher.submit([2]), batcher.submit([3]), return_exceptions=True
+        ), batcher.batches
+
+    (first, second, third), batches = asyncio.run(scenario())
+    assert isinstance(first, ValueError) and first is second
+    # The next batch still runs
+    assert third == [(2, 30)]
+    assert batches == 1
+
+
+def test_drain_waits_for_pending_items():
+    apply = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(apply, max_items=100, max_delay=0.05)
+        submitted = asyncio.ensure_future(batcher.submit([1, 2]))
+        await asyncio.sleep(0)
+        await batcher.drain()
+        assert submitted.done() and batcher.pending == 0
+        return await submitted
+
+    assert asyncio.run(scenario()) == [(1, 10), (1, 20)]
+
+
+def test_cancelled_caller_items_are_still_applied():
+    apply = Recorder()
+
+    async def scenario():
+        batcher = MicroBatcher(apply, max_items=100, max_delay=0.02)
+        gone = asyncio.ensure_future(batcher.submit([1]))
+        stays = asyncio.ensure_future(batcher.submit([2]))
+        await asyncio.sleep(0)
+        gone.cancel()
+        return await stays
+
+    assert asyncio.run(scenario()) == [(1, 20)]
+    assert apply.batches == [[1, 2]]
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import main as service
+from snapshot import has_snapshot
+
+
+def same_results(a, b, user_ids, product_ids):
+    for user_id in user_ids:
+        for recommendation_type in ("collaborative", "content"):
+            assert a.get_recommendations(user_id, 10, recommendation_type) == \
+                b.get_recommendations(user_id, 10, recommendation_type)
+        assert a.get_user_profile(user_id) == b.get_user_profile(user_id)
+    for product_id in product_ids:
+        assert a.find_similar_products(product_id, 5) == b.find_similar_products(product_id, 5)
+        assert a.find_similar_text_products(product_id, 5) == b.find_similar_text_products(product_id, 5)
+    assert a.search_products("premium", 5) == b.search_products("premium", 5)
+    assert a.get_trending_recommendations(10) == b.get_trending_recommendations(10)
+    assert a.sizes() == b.sizes()
+
+
+@pytest.mark.parametrize("similarity_index", ["exact", "ivf"])
+@pytest.mark.parametrize("mmap", [True, False])
+def test_loaded_engine_matches_saved_one(catalogue, tmp_path, similarity_index, mmap):
+    profiles, products = catalogue
+    engine = service.RecommendationEngine(similarity_index, collaborative_model="neighbours")
+    engine.bulk_load(profiles, products)
+    engine.record_events([service.ProductEvent(product_id=p.product_id, event_type="like") for p in products[:20]])
+    engine.refresh_trending()
+    if similarity_index == "ivf":
+        # Too few vectors to train on their own; the saved centroids must come back
+        for index in (engine.user_vectors, engine.product_vectors):
+            index.install(*index.fit(*index.prepare_training()))
+            assert index.is_trained
+    engine.save_snapshot(str(tmp_path))
+    assert has_snapshot(str(tmp_path))
+
+    loaded = service.RecommendationEngine.load_snapshot(str(tmp_path), mmap=mmap)
+    assert loaded.similarity_index == similarity_index
+    for name in ("user_vectors", "product_vectors"):
+        assert getattr(getattr(loaded, name), "is_trained", None) == getattr(getattr(engine, name), "is_trained", None)
+    user_ids = [p.user_id for p in profiles[:20]] + ["nobody"]
+    same_results(engine, loaded, user_ids, [p.product_id for p in products[:10]])
+
+
+def test_factor_model_round_trips(catalogue, tmp_path):
+    profiles, products = catalogue
+    engine = service.RecommendationEngine("exact", collaborative_model="als")
+    engine.bulk_load(profiles, products)
+    engine.train_factor_model(factors=8, iterations=4)
+    engine.save_snapshot(str(tmp_path))
+
+    loaded = service.RecommendationEngine.load_snapshot(str(tmp_path), collaborative_model="als")
+    assert loaded.factor_model is not None
+    assert np.array_equal(loaded.factor_model.user_factors, engine.factor_model.user_factors)
+    for profile in profiles[:20]:
+        assert loaded.get_collaborative_recommendations(profile.user_id, 10) == \
+            engine.get_collaborative_recommendations(profile.user_id, 10)
+
+
+def test_loaded_engine_accepts_updates_without_touching_the_snapshot(catalogue, tmp_path):
+    profiles, products = catalogue
+    engine = service.RecommendationEngine("exact", collaborative_model="neighbours")
+    engine.bulk_load(profiles, products)
+    engine.save_snapshot(str(tmp_path))
+
+    loaded = service.RecommendationEngine.load_snapshot(str(tmp_path), mmap=True)
+    user_id = profiles[0].user_id
+    loaded.add_purchases([service.ProductEvent(product_id=products[-1].product_id, user_id=user_id)])
+    loaded.add_user_profile(service.UserProfile(
+        user_id="newcomer", preferences={}, purchase_history=[products[0].product_id],
+        social_connections=[], demographics={},
+    ))
+    assert loaded.get_user_profile(user_id).purchase_history[-1] == products[-1].product_id
+    assert loaded.has_user("newcomer")
+
+    # A second load from the same files still sees the saved state
+    again = service.RecommendationEngine.load_snapshot(str(tmp_path), mmap=True)
+    assert again.get_user_profile(user_id) == engine.get_user_profile(user_id)
+    assert not again.has_user("newcomer")
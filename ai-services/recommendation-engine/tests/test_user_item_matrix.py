@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from user_item_matrix import UserItemMatrix
+
+
+@pytest.fixture
+def matrix(catalogue):
+    matrix = UserItemMatrix(compact_threshold=10 ** 6)
+    matrix.set_many_user_items((p.user_id, p.purchase_history) for p in catalogue[0])
+    matrix.compact()
+    return matrix
+
+
+def jaccard(a, b):
+    a, b = set(a.tolist()), set(b.tolist())
+    return len(a & b) / len(a | b)
+
+
+def test_rows_for_reads_uncompacted_updates(matrix, catalogue):
+    profiles = catalogue[0]
+    matrix.add_user_items(profiles[0].user_id, ["fresh-item"])
+    matrix.set_user_items("empty-user", [])
+    ids = [profiles[0].user_id, "empty-user", profiles[1].user_id]
+    positions = np.asarray([matrix.user_position(u) for u in ids])
+
+    items, lengths = matrix.rows_for(positions)
+    assert lengths.tolist() == [len(matrix.user_items(u)) for u in ids]
+    assert items.tolist() == np.concatenate([matrix.user_items(u) for u in ids]).tolist()
+    assert matrix.item_index["fresh-item"] in items[:lengths[0]]
+    assert len(matrix.times_for(positions)) == len(items)
+
+
+def test_similar_users_is_jaccard_over_co_buyers(matrix, catalogue):
+    user_id = catalogue[0][2].user_id
+    mine = matrix.user_items(user_id)
+    for other, score in matrix.similar_users(user_id, limit=10):
+        assert score == pytest.approx(jaccard(mine, matrix.user_items(other)))
+    assert matrix.similar_users("nobody") == []
+
+
+def test_neighbour_items_batch_matches_neighbours(matrix, catalogue):
+    user_ids = [p.user_id for p in catalogue[0][:30]] + ["nobody"]
+    limit = 5
+    neighbours = matrix.neighbours_batch(user_ids, limit)
+    for user_id, (users, scores), (items, item_scores) in zip(
+        user_ids, neighbours, matrix.neighbour_items_batch(user_ids, limit)
+    ):
+        expected = {}
+        for neighbour, score in zip(users, scores):
+            for item in matrix.user_items(matrix.user_ids[neighbour]):
+                expected.setdefault(int(item), float(score))
+        for item in (matrix.user_items(user_id) if user_id in matrix.user_index else []):
+            expected.pop(int(item), None)
+        ranked = sorted(expected.items(), key=lambda e: (-e[1], e[0]))[:limit]
+        assert items.tolist() == [item for item, _ in ranked]
+        assert item_scores.tolist() == pytest.approx([score for _, score in ranked])
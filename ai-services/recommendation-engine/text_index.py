@@ -0,0 +1,226 @@
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from snapshot import pack_strings, unpack_strings
+from topk import top_k_indices
+
+
+class TextIndex:
+    """Sparse TF-IDF index over product text for similarity and search.
+
+    Rows are product positions holding L2-normalised TF-IDF vectors, so a
+    sparse dot product is a cosine similarity. Queries walk a term x product
+    inverted CSR and only touch products sharing a term with the query.
+
+    The vocabulary and IDF weights are fitted in bulk by ``fit``/``install``,
+    normally from a background task, not on every update: products added in
+    between are vectorized with the current vocabulary, and terms it does
+    not know are ignored until the next refit. Like ``UserItemMatrix``,
+    updated rows sit in a dirty buffer that queries score directly until it
+    is folded into the CSR arrays.
+    """
+
+    def __init__(self, refit_fraction: float = 0.1, compact_threshold: int = 1024,
+                 **vectorizer_options):
+        self.refit_fraction = refit_fraction
+        self.compact_threshold = compact_threshold
+        self.vectorizer_options = {"stop_words": "english", **vectorizer_options}
+        self.vectorizer: Optional[TfidfVectorizer] = None
+        self.documents: List[str] = []
+        self.fitted_size = 0
+        self.changed = 0  # documents set since the last fit
+        self._rows: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+        self._dirty = set()
+        self._pending: Optional[set] = None
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._by_term = sparse.csr_matrix((0, 0), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    @property
+    def num_terms(self) -> int:
+        return 0 if self.vectorizer is None else len(self.vectorizer.vocabulary_)
+
+    @property
+    def needs_refit(self) -> bool:
+        if not self.documents:
+            return False
+        return self.vectorizer is None or self.changed >= max(1, self.refit_fraction * self.fitted_size)
+
+    def set_many(self, positions: Iterable[int], texts: Iterable[str]):
+        """Store and vectorize the text of several products"""
+        positions, texts = list(positions), [t.replace("\0", " ") for t in texts]
+        if not positions:
+            return
+        if max(positions) >= len(self.documents):
+            grow = max(positions) + 1 - len(self.documents)
+            self.documents.extend([""] * grow)
+            self._rows.extend([None] * grow)
+
+        rows = self._vectorize(texts) if self.vectorizer is not None else [None] * len(texts)
+        for position, text, row in zip(positions, texts, rows):
+            self.documents[position] = text
+            self._rows[position] = row
+            self._dirty.add(position)
+        self.changed += len(positions)
+        if self._pending is not None:
+            self._pending.update(positions)
+        if len(self._dirty) > self.compact_threshold:
+            self.compact()
+
+    def set(self, position: int, text: str):
+        self.set_many([position], [text])
+
+    def prepare_refit(self) -> List[str]:
+        """Start a refit: return the corpus to fit and track updates from now on"""
+        self._pending = set()
+        return list(self.documents)
+
+    def fit(self, documents: List[str]) -> Tuple[TfidfVectorizer, sparse.csr_matrix]:
+        """Fit a vocabulary and vectorize ``documents``; touches no index state"""
+        vectorizer = TfidfVectorizer(dtype=np.float32, **self.vectorizer_options)
+        try:
+            matrix = vectorizer.fit_transform(documents).tocsr()
+        except ValueError:
+            # Nothing but stop words so far
+            return None, None
+        return vectorizer, matrix
+
+    def install(self, vectorizer: Optional[TfidfVectorizer], matrix: Optional[sparse.csr_matrix]):
+        """Swap in a fitted vocabulary; products updated during the fit are re-vectorized"""
+        pending, self._pending = self._pending or set(), None
+        if vectorizer is None:
+            return
+        self.vectorizer = vectorizer
+        self.fitted_size = matrix.shape[0]
+        self._rows = [
+            (matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]],
+             matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]])
+            for i in range(matrix.shape[0])
+        ]
+        self._rows.extend([None] * (len(self.documents) - len(self._rows)))
+        pending = sorted(pending | set(range(matrix.shape[0], len(self.documents))))
+        for position, row in zip(pending, self._vectorize([self.documents[p] for p in pending])):
+            self._rows[position] = row
+        self.changed = len(pending)
+        self.compact()
+
+    def compact(self):
+        """Rebuild the CSR arrays from the per-product rows"""
+        self._matrix = self._build()
+        self._by_term = self._matrix.T.tocsr()
+        self._dirty.clear()
+
+    def similar(self, position: int, k: int) -> List[Tuple[int, float]]:
+        """Products whose text is most similar to the product at ``position``"""
+        if position >= len(self._rows) or self._rows[position] is None:
+            return []
+        indices, data = self._rows[position]
+        return self._search(indices, data, k, exclude=position)
+
+    def search(self, text: str, k: int) -> List[Tuple[int, float]]:
+        """Products most similar to a free-text query"""
+        if self.vectorizer is None:
+            return []
+        indices, data = self._vectorize([text])[0]
+        return self._search(indices, data, k)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        matrix = self._build()
+        terms = [] if self.vectorizer is None else self.vectorizer.get_feature_names_out().tolist()
+        return {
+            "documents": pack_strings(self.documents),
+            "terms": pack_strings(terms),
+            "idf": np.zeros(0) if self.vectorizer is None else self.vectorizer.idf_,
+            "indptr": matrix.indptr,
+            "indices": matrix.indices,
+            "data": matrix.data,
+        }
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "documents": len(self.documents),
+            "terms": self.num_terms,
+            "fitted_size": self.fitted_size,
+            "changed": self.changed,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], counts: Dict[str, int], **kwargs) -> "TextIndex":
+        index = cls(**kwargs)
+        index.documents = unpack_strings(arrays["documents"], counts["documents"])
+        index.fitted_size, index.changed = counts["fitted_size"], counts["changed"]
+        if counts["terms"]:
+            vectorizer = TfidfVectorizer(dtype=np.float32, **index.vectorizer_options)
+            vectorizer.vocabulary_ = {
+                term: i for i, term in enumerate(unpack_strings(arrays["terms"], counts["terms"]))
+            }
+            vectorizer.idf_ = np.asarray(arrays["idf"])
+            index.vectorizer = vectorizer
+        indptr, indices, data = arrays["indptr"], arrays["indices"], arrays["data"]
+        index._rows = [
+            (indices[indptr[i]:indptr[i + 1]], data[indptr[i]:indptr[i + 1]]) if index.vectorizer else None
+            for i in range(len(indptr) - 1)
+        ]
+        index._matrix = sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(indptr) - 1, index.num_terms), copy=False
+        )
+        index._by_term = index._matrix.T.tocsr()
+        return index
+
+    def _vectorize(self, texts: List[str]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if not texts:
+            return []
+        matrix = self.vectorizer.transform(texts).tocsr()
+        return [
+            (matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]],
+             matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]])
+            for i in range(len(texts))
+        ]
+
+    def _build(self) -> sparse.csr_matrix:
+        rows = [row if row is not None else (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32))
+                for row in self._rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(indices) for indices, _ in rows], out=indptr[1:])
+        indices = np.concatenate([r[0] for r in rows]).astype(np.int32) if rows else np.zeros(0, dtype=np.int32)
+        data = np.concatenate([r[1] for r in rows]).astype(np.float32) if rows else np.zeros(0, dtype=np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), self.num_terms))
+
+    def _search(self, indices: np.ndarray, data: np.ndarray, k: int,
+                exclude: Optional[int] = None) -> List[Tuple[int, float]]:
+        if not len(indices):
+            return []
+        # Compacted rows: accumulate over the query terms' posting lists
+        if self._by_term.shape[1]:
+            query = sparse.csr_matrix(
+                (data, indices, np.array([0, len(indices)])), shape=(1, self.num_terms)
+            )
+            hits = (query @ self._by_term).tocsr()
+            positions, scores = hits.indices.astype(np.int64), hits.data
+        else:
+            positions, scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        if self._dirty:
+            # Rows changed since the last compaction are scored directly
+            dirty = np.fromiter(self._dirty, dtype=np.int64, count=len(self._dirty))
+            keep = ~np.isin(positions, dirty)
+            positions, scores = positions[keep], scores[keep]
+            dense = np.zeros(self.num_terms, dtype=np.float32)
+            dense[indices] = data
+            dirty_scores = np.asarray([
+                float(dense[row[0]] @ row[1]) if row is not None else 0.0
+                for row in (self._rows[p] for p in dirty)
+            ], dtype=np.float32)
+            positions = np.concatenate([positions, dirty])
+            scores = np.concatenate([scores, dirty_scores])
+
+        keep = scores > 0
+        if exclude is not None:
+            keep &= positions != exclude
+        positions, scores = positions[keep], scores[keep]
+        return [(int(positions[i]), float(scores[i])) for i in top_k_indices(scores, k)]
@@ -0,0 +1,48 @@
+import heapq
+from operator import itemgetter
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, best first.
+
+    Uses a partial partition instead of a full sort. Ties are broken by
+    position, so the result matches a stable descending sort.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        selected = np.arange(n)
+    else:
+        threshold = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > threshold)
+        ties = np.flatnonzero(scores == threshold)[:k - len(above)]
+        selected = np.concatenate([above, ties])
+    return selected[np.lexsort((selected, -scores[selected]))]
+
+
+def top_k_recommendations(recommendations: Iterable[Dict], k: int) -> List[Dict]:
+    """Best ``k`` recommendations by score, keeping one entry per product"""
+    best = {}
+    for rec in recommendations:
+        current = best.get(rec["product_id"])
+        if current is None or rec["score"] > current["score"]:
+            best[rec["product_id"]] = rec
+    return heapq.nlargest(k, best.values(), key=itemgetter("score"))
+
+
+def merge_recommendations(sources: Iterable[List[Dict]], k: int) -> List[Dict]:
+    """First ``k`` distinct products across ranked sources, in source order"""
+    merged, seen = [], set()
+    for source in sources:
+        for rec in source:
+            if rec["product_id"] in seen:
+                continue
+            seen.add(rec["product_id"])
+            merged.append(rec)
+            if len(merged) == k:
+                return merged
+    return merged
@@ -0,0 +1,131 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from topk import top_k_indices
+
+# Contribution of one event to a product's trending score
+EVENT_WEIGHTS = {
+    "purchase": 1.0,
+    "add_to_cart": 0.5,
+    "like": 0.3,
+    "share": 0.3,
+    "click": 0.1,
+    "view": 0.05,
+}
+
+
+class TrendingCounter:
+    """Exponentially decayed event counts per product, one row per window.
+
+    Each window decays with its length as the time constant, so an event's
+    weight falls to 1/e after one window. Scores are stored relative to a
+    reference time: an event at ``t`` adds ``weight * exp((t - ref) / window)``,
+    which makes recording a single add no matter when the product was last
+    touched. Every product in a window shares the same decay factor, so
+    rankings can be read straight off the stored values. The reference is
+    moved forward, rescaling all scores, before those factors can overflow.
+
+    Rankings are precomputed by ``refresh`` into top-``depth`` lists, per
+    window and per category, and requests only slice those lists.
+    """
+
+    RESCALE_AFTER = 50.0  # in lengths of the shortest window
+
+    def __init__(self, windows: Dict[str, float], depth: int = 100,
+                 reference_time: Optional[float] = None):
+        self.names = list(windows)
+        self.lengths = np.asarray([windows[name] for name in self.names], dtype=np.float64)
+        self.depth = depth
+        self.reference_time = time.time() if reference_time is None else reference_time
+        self.scores = np.zeros((len(self.names), 16), dtype=np.float64)
+        self.size = 0
+        self.refreshed_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._top: Dict[Tuple[str, Optional[int]], Tuple[np.ndarray, np.ndarray]] = {}
+
+    def record(self, positions: np.ndarray, weights: np.ndarray, timestamps: np.ndarray):
+        """Add weighted events for the given product positions"""
+        if not len(positions):
+            return
+        # Clamp clock skew so a far-future timestamp cannot overflow the factors
+        timestamps = np.minimum(np.asarray(timestamps, dtype=np.float64), time.time())
+        with self._lock:
+            end = int(positions.max()) + 1
+            if end > self.scores.shape[1]:
+                self._grow(end)
+            self.size = max(self.size, end)
+
+            latest = float(timestamps.max())
+            if (latest - self.reference_time) / self.lengths.min() > self.RESCALE_AFTER:
+                self._rescale(latest)
+
+            growth = np.exp((timestamps[None, :] - self.reference_time) / self.lengths[:, None])
+            for window in range(len(self.names)):
+                np.add.at(self.scores[window], positions, weights * growth[window])
+
+    def refresh(self, categories: np.ndarray, now: Optional[float] = None):
+        """Recompute the top-``depth`` lists for every window and category.
+
+        ``categories`` holds the category code of every product position.
+        """
+        now = time.time() if now is None else now
+        n = len(categories)
+        with self._lock:
+            scores = np.zeros((len(self.names), n), dtype=np.float64)
+            live = min(n, self.size)
+            scores[:, :live] = self.scores[:, :live]
+            decay = np.exp(-(now - self.reference_time) / self.lengths)
+
+        # Group positions by category once, then rank each group per window
+        order = np.argsort(categories, kind="stable")
+        groups = np.split(order, np.flatnonzero(np.diff(categories[order])) + 1) if n else []
+
+        top = {}
+        for window, name in enumerate(self.names):
+            current = scores[window] * decay[window]
+            top[(name, None)] = self._ranked(np.arange(n), current)
+            for group in groups:
+                top[(name, int(categories[group[0]]))] = self._ranked(group, current[group])
+        self._top = top
+        self.refreshed_at = now
+
+    def top(self, window: str, category: Optional[int] = None,
+            k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Precomputed ``(positions, scores)`` as of the last refresh, best first"""
+        positions, scores = self._top.get(
+            (window, category), (np.zeros(0, dtype=np.int64), np.zeros(0))
+        )
+        return positions[:k], scores[:k]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        return {"scores": self.scores[:, :self.size]}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], windows: Dict[str, float],
+                    reference_time: float, **kwargs) -> "TrendingCounter":
+        counter = cls(windows, reference_time=reference_time, **kwargs)
+        scores = np.asarray(arrays["scores"], dtype=np.float64)
+        counter._grow(scores.shape[1])
+        counter.scores[:, :scores.shape[1]] = scores
+        counter.size = scores.shape[1]
+        return counter
+
+    def _ranked(self, positions: np.ndarray, scores: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        best = top_k_indices(scores, self.depth)
+        best = best[scores[best] > 0]
+        return positions[best], scores[best]
+
+    def _rescale(self, reference_time: float):
+        self.scores *= np.exp(-(reference_time - self.reference_time) / self.lengths)[:, None]
+        self.reference_time = reference_time
+
+    def _grow(self, size: int):
+        if size <= self.scores.shape[1]:
+            return
+        grown = np.zeros((len(self.names), max(size, 2 * self.scores.shape[1])), dtype=np.float64)
+        grown[:, :self.scores.shape[1]] = self.scores
+        self.scores = grown
@@ -0,0 +1,423 @@
+import time
+import numpy as np
+from scipy import sparse
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from snapshot import pack_strings, unpack_rows, unpack_strings
+from topk import top_k_indices
+
+
+class UserItemMatrix:
+    """Sparse user x item purchase matrix with integer ID maps.
+
+    Rows are users and columns are products. A transposed item x user CSR is
+    kept next to it so that finding co-purchasers only touches the columns a
+    user actually bought instead of every row in the table. Profile updates
+    go into a dirty-row buffer and are folded into the CSR arrays once the
+    buffer grows past ``compact_threshold`` rows. Only writers compact; read
+    paths that need current CSR arrays build private ones instead.
+
+    Each purchase also records when it first appeared in the user's row
+    (Unix seconds), which social scoring uses as a recency signal.
+    """
+
+    def __init__(self, compact_threshold: int = 1024):
+        self.user_index: Dict[str, int] = {}
+        self.item_index: Dict[str, int] = {}
+        self.user_ids: List[str] = []
+        self.item_ids: List[str] = []
+        self.compact_threshold = compact_threshold
+        self._rows: List[np.ndarray] = []
+        self._row_times: List[np.ndarray] = []
+        self._row_nnz = np.zeros(0, dtype=np.int32)
+        self._dirty = set()
+        self._matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._item_users = sparse.csr_matrix((0, 0), dtype=np.float32)
+
+    @property
+    def num_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def num_items(self) -> int:
+        return len(self.item_ids)
+
+    @property
+    def nnz(self) -> int:
+        return int(self._row_nnz[:self.num_users].sum())
+
+    @property
+    def needs_compaction(self) -> bool:
+        return bool(self._dirty) or self._matrix.shape != (self.num_users, self.num_items)
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        """Current user x item CSR matrix; built privately if rows changed since the last compaction"""
+        return self._build() if self.needs_compaction else self._matrix
+
+    def user_position(self, user_id: str) -> Optional[int]:
+        return self.user_index.get(user_id)
+
+    def item_positions(self, item_ids: Iterable[str], create: bool = False) -> np.ndarray:
+        """Map product IDs to column indices, skipping unknown ones unless ``create``"""
+        positions = []
+        for item_id in item_ids:
+            idx = self.item_index.get(item_id)
+            if idx is None:
+                if not create:
+                    continue
+                idx = len(self.item_ids)
+                self.item_index[item_id] = idx
+                self.item_ids.append(item_id)
+            positions.append(idx)
+        return np.unique(np.asarray(positions, dtype=np.int32))
+
+    def user_items(self, user_id: str) -> np.ndarray:
+        """Sorted column indices of the products a user has purchased"""
+        idx = self.user_index.get(user_id)
+        if idx is None:
+            return np.zeros(0, dtype=np.int32)
+        return self._rows[idx]
+
+    def rows_for(self, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Column indices of several users' rows, concatenated, and each row's length.
+
+        Reads the per-user rows, so rows changed since the last compaction
+        are current.
+        """
+        rows = [self._rows[p] for p in positions]
+        lengths = np.asarray([0 if row is None else len(row) for row in rows], dtype=np.int64)
+        return _concatenate(rows, np.int32), lengths
+
+    def times_for(self, positions: np.ndarray) -> np.ndarray:
+        """Purchase times of several users' rows, concatenated in ``rows_for`` order"""
+        return _concatenate([self._row_times[p] for p in positions], np.uint32)
+
+    def user_item_times(self, position: int) -> np.ndarray:
+        """First-seen times of the user's purchases, aligned with ``user_items``"""
+        return self._row_times[position]
+
+    def set_user_items(self, user_id: str, item_ids: Iterable[str]) -> int:
+        """Replace a user's purchase row and return the user's position"""
+        idx = self._set_row(user_id, item_ids)
+        if len(self._dirty) > self.compact_threshold:
+            self.compact()
+        return idx
+
+    def set_many_user_items(self, rows: Iterable[Tuple[str, Iterable[str]]]) -> np.ndarray:
+        """Replace many users' purchase rows, compacting at most once at the end"""
+        positions = np.asarray(
+            [self._set_row(user_id, item_ids) for user_id, item_ids in rows], dtype=np.int64
+        )
+        if len(self._dirty) > self.compact_threshold:
+            self.compact()
+        return positions
+
+    def add_user_items(self, user_id: str, item_ids: Iterable[str]) -> Tuple[int, np.ndarray]:
+        """Add purchases to a user's row, creating the user if new.
+
+        Only the given products are looked up and the row is extended with a
+        single sorted insert, so the cost follows the number of new purchases
+        rather than the length of the history. Returns the user's position
+        and the column indices that were not already in the row.
+        """
+        idx = self._position(user_id)
+        items = self.item_positions(item_ids, create=True)
+        row = self._rows[idx]
+        if row is None:
+            row = np.zeros(0, dtype=np.int32)
+            self._row_times[idx] = np.zeros(0, dtype=np.uint32)
+        if len(row):
+            at = np.searchsorted(row, items).clip(max=len(row) - 1)
+            items = items[row[at] != items]
+        if len(items) or self._rows[idx] is None:
+            at = np.searchsorted(row, items)
+            self._rows[idx] = np.insert(row, at, items)
+            self._row_times[idx] = np.insert(
+                self._row_times[idx], at, np.full(len(items), int(time.time()), dtype=np.uint32)
+            )
+            self._row_nnz[idx] = len(self._rows[idx])
+            self._dirty.add(idx)
+            if len(self._dirty) > self.compact_threshold:
+                self.compact()
+        return idx, items
+
+    def _position(self, user_id: str) -> int:
+        idx = self.user_index.get(user_id)
+        if idx is None:
+            idx = len(self.user_ids)
+            self.user_index[user_id] = idx
+            self.user_ids.append(user_id)
+            self._rows.append(None)
+            self._row_times.append(None)
+            if idx >= len(self._row_nnz):
+                grown = np.zeros(max(16, 2 * len(self._row_nnz)), dtype=np.int32)
+                grown[:len(self._row_nnz)] = self._row_nnz
+                self._row_nnz = grown
+        return idx
+
+    def _set_row(self, user_id: str, item_ids: Iterable[str]) -> int:
+        idx = self._position(user_id)
+        row = self.item_positions(item_ids, create=True)
+        times = np.full(len(row), int(time.time()), dtype=np.uint32)
+        previous = self._rows[idx]
+        if previous is not None and len(previous):
+            # Purchases already in the row keep their original time
+            at = np.searchsorted(previous, row).clip(max=len(previous) - 1)
+            kept = previous[at] == row
+            times[kept] = self._row_times[idx][at[kept]]
+        self._rows[idx] = row
+        self._row_times[idx] = times
+        self._row_nnz[idx] = len(row)
+        self._dirty.add(idx)
+        return idx
+
+    def compact(self):
+        """Rebuild the CSR arrays from the per-user rows; needs exclusive access"""
+        self._matrix = self._build()
+        self._item_users = self._matrix.T.tocsr()
+        self._dirty.clear()
+
+    def _build(self) -> sparse.csr_matrix:
+        num_users = self.num_users
+        lengths = self._row_nnz[:num_users]
+        indptr = np.zeros(num_users + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = (np.concatenate(self._rows) if num_users else np.zeros(0)).astype(np.int32)
+        data = np.ones(len(indices), dtype=np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(num_users, self.num_items))
+
+    def _current(self) -> Tuple[sparse.csr_matrix, sparse.csr_matrix]:
+        """The user x item and item x user CSRs including every row, without compacting"""
+        if not self.needs_compaction:
+            return self._matrix, self._item_users
+        matrix = self._build()
+        return matrix, matrix.T.tocsr()
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Snapshot arrays; see ``from_arrays``"""
+        matrix, item_users = self._current()
+        return {
+            "user_ids": pack_strings(self.user_ids),
+            "item_ids": pack_strings(self.item_ids),
+            "indptr": matrix.indptr,
+            "indices": matrix.indices,
+            "item_indptr": item_users.indptr,
+            "item_indices": item_users.indices,
+            "data": matrix.data,
+            "times": np.concatenate(self._row_times[:self.num_users]) if self.num_users
+            else np.zeros(0, dtype=np.uint32),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], num_users: int, num_items: int,
+                    **kwargs) -> "UserItemMatrix":
+        """Rebuild from snapshot arrays; rows stay views into the (mapped) arrays"""
+        matrix = cls(**kwargs)
+        matrix.user_ids = unpack_strings(arrays["user_ids"], num_users)
+        matrix.item_ids = unpack_strings(arrays["item_ids"], num_items)
+        matrix.user_index = {u: i for i, u in enumerate(matrix.user_ids)}
+        matrix.item_index = {p: i for i, p in enumerate(matrix.item_ids)}
+
+        indptr, indices, data = arrays["indptr"], arrays["indices"], arrays["data"]
+        matrix._rows = unpack_rows(indptr, indices)
+        # Snapshots written before purchase times were kept count as bought at load
+        times = arrays.get("times")
+        if times is None:
+            times = np.full(len(indices), int(time.time()), dtype=np.uint32)
+        matrix._row_times = unpack_rows(indptr, times)
+        matrix._row_nnz = np.diff(indptr).astype(np.int32)
+        matrix._matrix = sparse.csr_matrix(
+            (data, indices, indptr), shape=(num_users, num_items), copy=False
+        )
+        matrix._item_users = sparse.csr_matrix(
+            (data, arrays["item_indices"], arrays["item_indptr"]),
+            shape=(num_items, num_users), copy=False
+        )
+        return matrix
+
+    def similar_users(self, user_id: str, limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Jaccard similarity against every user sharing at least one purchase"""
+        idx = self.user_index.get(user_id)
+        if idx is None or self._row_nnz[idx] == 0:
+            return []
+
+        users, overlaps = self._co_purchase_counts(self._rows[idx])
+        keep = users != idx
+        users, overlaps = users[keep], overlaps[keep]
+        if not len(users):
+            return []
+
+        scores = overlaps / (self._row_nnz[idx] + self._row_nnz[users] - overlaps)
+        return self._ranked(users, scores, limit)
+
+    def similar_to_items(self, item_ids: Iterable[str], size: int, limit: Optional[int] = None,
+                         exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Jaccard similarity of users here against a purchase set given as product IDs.
+
+        ``size`` is the set's full size, which may include products this
+        matrix has never seen; they can't overlap with any row here.
+        """
+        items = self.item_positions(item_ids)
+        if not len(items):
+            return []
+
+        users, overlaps = self._co_purchase_counts(items)
+        if exclude in self.user_index:
+            keep = users != self.user_index[exclude]
+            users, overlaps = users[keep], overlaps[keep]
+        if not len(users):
+            return []
+
+        scores = overlaps / (size + self._row_nnz[users] - overlaps)
+        return self._ranked(users, scores, limit)
+
+    def similarities(self, user_id: str, other_ids: Iterable[str],
+                     limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """Jaccard similarity against an explicit candidate list, best first"""
+        idx = self.user_index.get(user_id)
+        if idx is None or self._row_nnz[idx] == 0:
+            return []
+
+        users = np.asarray(
+            [self.user_index[o] for o in other_ids if o in self.user_index and o != user_id],
+            dtype=np.int64,
+        )
+        overlaps = self._overlaps(self._rows[idx], users)
+        keep = overlaps > 0
+        users, overlaps = users[keep], overlaps[keep]
+        if not len(users):
+            return []
+
+        scores = overlaps / (self._row_nnz[idx] + self._row_nnz[users] - overlaps)
+        return self._ranked(users, scores, limit)
+
+    def neighbours_batch(self, user_ids: List[str],
+                         limit: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top ``limit`` Jaccard neighbours for many users via one sparse product.
+
+        Returns ``(positions, scores)`` per user, best first; unknown users
+        get empty arrays. Compact first, under exclusive access, or every
+        call rebuilds the CSR arrays.
+        """
+        matrix, item_users = self._current()
+        positions = np.asarray([self.user_index.get(u, -1) for u in user_ids], dtype=np.int64)
+        owners, users, scores = self._neighbours(matrix, item_users, positions, limit)
+        bounds = np.searchsorted(owners, np.arange(len(user_ids) + 1))
+        return [(users[start:end], scores[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def neighbour_items_batch(self, user_ids: List[str],
+                              limit: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top ``limit`` unbought items for many users, scored by their best neighbour.
+
+        Each user's top ``limit`` neighbours are found as in
+        ``neighbours_batch``; an item scores the similarity of the most
+        similar neighbour who bought it. The neighbours' rows for the whole
+        block are gathered at once and reduced with sorts instead of a pass
+        per user. Returns ``(item positions, scores)`` per user, best first
+        with ties broken by item position.
+        """
+        matrix, item_users = self._current()
+        positions = np.asarray([self.user_index.get(u, -1) for u in user_ids], dtype=np.int64)
+        owners, users, similarity = self._neighbours(matrix, item_users, positions, limit)
+
+        # One entry per (user, neighbour, item the neighbour bought)
+        rows = matrix[users]
+        lengths = np.diff(rows.indptr)
+        keys = np.repeat(owners, lengths) * self.num_items + rows.indices
+        similarity = np.repeat(similarity, lengths)
+
+        # Neighbours come best first, so an item's first entry is its best
+        # buyer; unique also sorts the keys by user, then item
+        keys, first = np.unique(keys, return_index=True)
+        similarity = similarity[first]
+
+        # Drop what each user already bought; those keys are sorted too
+        known = np.flatnonzero(positions >= 0)
+        bought = matrix[positions[known]]
+        bought = np.repeat(known, np.diff(bought.indptr)) * self.num_items + bought.indices
+        if len(bought):
+            at = np.minimum(np.searchsorted(bought, keys), len(bought) - 1)
+            fresh = bought[at] != keys
+            keys, similarity = keys[fresh], similarity[fresh]
+
+        # Best items per user; the stable sort keeps item order among ties
+        owners, items = np.divmod(keys, max(self.num_items, 1))
+        order = np.lexsort((-similarity, owners))
+        rank = np.arange(len(order)) - np.searchsorted(owners, owners[order])
+        top = order[rank < limit]
+        owners, items, similarity = owners[top], items[top], similarity[top]
+        bounds = np.searchsorted(owners, np.arange(len(user_ids) + 1))
+        return [(items[start:end], similarity[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def _neighbours(self, matrix: sparse.csr_matrix, item_users: sparse.csr_matrix, positions: np.ndarray,
+                    limit: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top ``limit`` Jaccard neighbours as flat ``(owners, users, scores)``.
+
+        ``owners`` indexes ``positions``; entries are grouped by owner, best
+        first. Unknown users get none.
+        """
+        known = np.flatnonzero(positions >= 0)
+        overlaps = (matrix[positions[known]] @ item_users).tocsr()
+        overlaps.sort_indices()
+
+        # A partition per row beats sorting every overlap of the block
+        owners, users, scores = [], [], []
+        for row, owner in enumerate(known):
+            idx = positions[owner]
+            start, end = overlaps.indptr[row], overlaps.indptr[row + 1]
+            others = overlaps.indices[start:end].astype(np.int64)
+            counts = overlaps.data[start:end]
+            keep = others != idx
+            others, counts = others[keep], counts[keep]
+            similarity = counts / (self._row_nnz[idx] + self._row_nnz[others] - counts)
+            top = top_k_indices(similarity, limit)
+            owners.append(np.full(len(top), owner))
+            users.append(others[top])
+            scores.append(similarity[top])
+        if not owners:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(owners), np.concatenate(users), np.concatenate(scores)
+
+    def _ranked(self, users: np.ndarray, scores: np.ndarray,
+                limit: Optional[int]) -> List[Tuple[str, float]]:
+        order = top_k_indices(scores, len(scores) if limit is None else limit)
+        return [(self.user_ids[users[i]], float(scores[i])) for i in order]
+
+    def _co_purchase_counts(self, items: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Count shared purchases between ``items`` and every overlapping user"""
+        # Compacted rows: one gather over the item -> user CSR
+        indexed_items = items[items < self._item_users.shape[0]]
+        co_purchasers = self._item_users[indexed_items].indices
+        users, counts = np.unique(co_purchasers, return_counts=True)
+
+        if not self._dirty:
+            return users, counts
+
+        # Rows changed since the last compaction are scored directly
+        dirty = np.fromiter(self._dirty, dtype=np.int64, count=len(self._dirty))
+        stale = np.isin(users, dirty)
+        users, counts = users[~stale], counts[~stale]
+
+        dirty_counts = self._overlaps(items, dirty).astype(counts.dtype)
+        touched = dirty_counts > 0
+
+        return (
+            np.concatenate([users, dirty[touched]]),
+            np.concatenate([counts, dirty_counts[touched]]),
+        )
+
+    def _overlaps(self, items: np.ndarray, users: np.ndarray) -> np.ndarray:
+        """Number of ``items`` present in each of the given users' rows"""
+        if not len(users):
+            return np.zeros(0, dtype=np.int64)
+        flat, lengths = self.rows_for(users)
+        hits = np.isin(flat, items)
+        return np.bincount(
+            np.repeat(np.arange(len(users)), lengths), weights=hits, minlength=len(users)
+        ).astype(np.int64)
+
+
+def _concatenate(rows: List[Optional[np.ndarray]], dtype) -> np.ndarray:
+    rows = [row for row in rows if row is not None]
+    return np.concatenate(rows) if rows else np.zeros(0, dtype=dtype)
@@ -0,0 +1,269 @@
+"""Write-behind aggregation for the denormalized engagement counters.
+
+Incrementing ``Post.like_count`` once per like makes every viewer of a
+viral post wait on the same row lock. Callers instead record deltas in a
+buffer. Deltas are coalesced per object and field, and ``flush`` writes
+them with one ``UPDATE ... FROM (VALUES ...)`` statement per batch of
+objects. ``LocalCounterBuffer`` keeps deltas in process memory.
+``RedisCounterBuffer`` keeps them in Redis, so every worker shares one
+buffer and deltas survive a worker restart.
+
+Counters can still drift: a crash between draining and writing, or a
+write that bypasses the buffer. ``reconcile_counters`` recomputes counts
+from the Like, Share and Comment tables and fixes the rows that differ.
+``view_count`` has no source table and is not reconciled.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Count
+from redis.exceptions import ResponseError
+
+from .models import Comment, Like, Post, Share
+
+COUNTER_FIELDS = {
+    Post: ('like_count', 'comment_count', 'share_count', 'view_count'),
+    Comment: ('like_count', 'reply_count'),
+}
+# Where each reconciled counter is counted from: (source model, foreign key)
+COUNTER_SOURCES = {
+    Post: {'like_count': (Like, 'post'), 'comment_count': (Comment, 'post'), 'share_count': (Share, 'post')},
+    Comment: {'like_count': (Like, 'comment'), 'reply_count': (Comment, 'parent_comment')},
+}
+FLUSH_BATCH_SIZE = 1000
+FLUSH_INTERVAL = 5.0  # seconds
+RECONCILE_BATCH_SIZE = 1000
+RECONCILE_TIME_BUDGET = 60.0  # seconds per run
+
+_MODELS = {model._meta.label: model for model in COUNTER_FIELDS}
+
+# (model label, object id, field) -> delta
+Deltas = Dict[Tuple[str, str, str], int]
+
+
+class CounterBuffer(ABC):
+    """Coalesces counter deltas and writes them back in bulk"""
+
+    def __init__(self, batch_size: int = FLUSH_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._flusher: Optional[threading.Thread] = None
+
+    def increment(self, obj, field: str, delta: int = 1):
+        """Buffer ``delta`` for ``obj.field``; ``obj`` is a Post or a Comment"""
+        self.add_many({(obj._meta.label, str(obj.pk), field): delta})
+
+    def add_many(self, deltas: Deltas):
+        for (label, _, field) in deltas:
+            if field not in COUNTER_FIELDS[_MODELS[label]]:
+                raise ValueError(f'{label}.{field} is not a buffered counter')
+        self._add(deltas)
+
+    def flush(self) -> int:
+        """Write every buffered delta; returns the number of rows updated.
+
+        Deltas that fail to write go back into the buffer.
+        """
+        batches = list(_batches(self._drain(), self.batch_size))
+        updated = 0
+        for i, (model, fields, rows) in enumerate(batches):
+            try:
+                with transaction.atomic():
+                    updated += _update_batch(model, fields, rows, relative=True)
+            except Exception:
+                self._add({
+                    (model._meta.label, object_id, field): delta
+                    for model, _, rows in batches[i:] for object_id, row in rows for field, delta in row.items()
+                })
+                raise
+        return updated
+
+    def start_flusher(self, interval: float = FLUSH_INTERVAL):
+        """Flush every ``interval`` seconds on a daemon thread"""
+        if self._flusher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except Exception:
+                    # Deltas were put back; the next round retries them
+                    pass
+
+        self._flusher = threading.Thread(target=run, name='counter-flusher', daemon=True)
+        self._flusher.start()
+
+    @abstractmethod
+    def _add(self, deltas: Deltas):
+        """Add ``deltas`` to the buffer"""
+
+    @abstractmethod
+    def _drain(self) -> Deltas:
+        """Remove and return everything buffered"""
+
+
+class LocalCounterBuffer(CounterBuffer):
+    """Deltas held in this process; lost if it dies before a flush"""
+
+    def __init__(self, batch_size: int = FLUSH_BATCH_SIZE):
+        super().__init__(batch_size)
+        self._deltas: Deltas = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _add(self, deltas: Deltas):
+        with self._lock:
+            for key, delta in deltas.items():
+                self._deltas[key] += delta
+
+    def _drain(self) -> Deltas:
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+        return {key: delta for key, delta in deltas.items() if delta}
+
+
+class RedisCounterBuffer(CounterBuffer):
+    """Deltas held in one Redis hash shared by every worker.
+
+    ``flush`` renames the hash before reading it, so increments arriving
+    during the flush go into a fresh hash. The renamed hash is read and
+    deleted atomically, so concurrent flushes never apply it twice. A
+    renamed hash left behind by a crashed flush is flushed before the live
+    one is renamed again.
+    """
+
+    def __init__(self, client, key: str = 'counter_deltas', batch_size: int = FLUSH_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.client = client
+        self.key = key
+        self.flushing_key = f'{key}:flushing'
+
+    def _add(self, deltas: Deltas):
+        pipe = self.client.pipeline(transaction=False)
+        for (label, object_id, field), delta in deltas.items():
+            pipe.hincrby(self.key, f'{label}:{object_id}:{field}', delta)
+        pipe.execute()
+
+    def _drain(self) -> Deltas:
+        try:
+            self.client.renamenx(self.key, self.flushing_key)
+        except ResponseError:
+            pass  # nothing buffered
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self.flushing_key)
+        pipe.delete(self.flushing_key)
+        fields, _ = pipe.execute()
+        deltas = {}
+        for name, delta in fields.items():
+            label, object_id, field = (name.decode() if isinstance(name, bytes) else name).split(':')
+            if int(delta):
+                deltas[(label, object_id, field)] = int(delta)
+        return deltas
+
+
+def write_counters(values: Deltas, batch_size: int = FLUSH_BATCH_SIZE, relative: bool = True) -> int:
+    """Add (``relative``) or assign counter values with one statement per batch.
+
+    Objects are written in primary-key order so that concurrent flushes
+    lock rows in the same order. Counts never go below zero.
+    """
+    updated = 0
+    for model, fields, rows in _batches(values, batch_size):
+        with transaction.atomic():
+            updated += _update_batch(model, fields, rows, relative)
+    return updated
+
+
+def _batches(values: Deltas, batch_size: int):
+    """(model, fields, [(object_id, {field: value})]) per ``batch_size`` objects, in key order"""
+    by_model: Dict[str, Dict[str, Dict[str, int]]] = defaultdict(lambda: defaultdict(dict))
+    for (label, object_id, field), value in values.items():
+        by_model[label][object_id][field] = value
+    for label, rows in by_model.items():
+        model = _MODELS[label]
+        fields = [f for f in COUNTER_FIELDS[model] if any(f in row for row in rows.values())]
+        object_ids = sorted(rows)
+        for start in range(0, len(object_ids), batch_size):
+            yield model, fields, [(i, rows[i]) for i in object_ids[start:start + batch_size]]
+
+
+def _update_batch(model, fields: List[str], rows: List[Tuple[str, Dict[str, int]]], relative: bool) -> int:
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    columns = [connection.ops.quote_name(model._meta.get_field(f).column) for f in fields]
+    if relative:
+        # Missing deltas are 0: the column keeps its value
+        assignments = [f'{c} = GREATEST(t.{c} + v.{c}, 0)' for c in columns]
+        params = [value for object_id, row in rows for value in (object_id, *(row.get(f, 0) for f in fields))]
+    else:
+        # Missing values are NULL: the column keeps its value
+        assignments = [f'{c} = COALESCE(v.{c}, t.{c})' for c in columns]
+        params = [value for object_id, row in rows for value in (object_id, *(row.get(f) for f in fields))]
+    placeholders = '(' + ', '.join(['%s::uuid'] + ['%s::integer'] * len(fields)) + ')'
+    sql = (
+        f'UPDATE {table} AS t SET {", ".join(assignments)} '
+        f'FROM (VALUES {", ".join([placeholders] * len(rows))}) AS v({pk}, {", ".join(columns)}) '
+        f'WHERE t.{pk} = v.{pk}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def count_from_sources(model, object_ids: Iterable) -> Dict[str, Dict[str, int]]:
+    """Actual counts per object for each reconciled counter of ``model``, from the source tables"""
+    object_ids = list(object_ids)
+    counts: Dict[str, Dict[str, int]] = {str(i): {} for i in object_ids}
+    for field, (source, foreign_key) in COUNTER_SOURCES[model].items():
+        column = f'{foreign_key}_id'
+        rows = (
+            source.objects.filter(**{f'{column}__in': object_ids})
+            .order_by()
+            .values(column)
+            .annotate(n=Count('pk'))
+            .values_list(column, 'n')
+        )
+        found = {str(object_id): n for object_id, n in rows}
+        for object_id in counts:
+            counts[object_id][field] = found.get(object_id, 0)
+    return counts
+
+
+def reconcile_counters(model, after=None, batch_size: int = RECONCILE_BATCH_SIZE,
+                       time_budget: float = RECONCILE_TIME_BUDGET) -> Tuple[Optional[object], Dict[str, int]]:
+    """Recompute ``model``'s counters from the source tables and fix rows that drifted.
+
+    Walks objects in primary-key order after ``after`` until the time budget
+    runs out. Returns the key to resume after (None once done) and counts.
+    Deltas still buffered when a row is fixed are applied on top of the
+    recomputed count, so flush the buffer first to keep that window small.
+    """
+    fields = list(COUNTER_SOURCES[model])
+    deadline = time.monotonic() + time_budget
+    stats = {'checked': 0, 'fixed': 0}
+    while time.monotonic() < deadline:
+        rows = model.objects.order_by('pk')
+        if after is not None:
+            rows = rows.filter(pk__gt=after)
+        batch = list(rows.values_list('pk', *fields)[:batch_size])
+        if not batch:
+            return None, stats
+        actual = count_from_sources(model, [row[0] for row in batch])
+        drifted = {}
+        for object_id, *stored in batch:
+            counts = actual[str(object_id)]
+            for field, value in zip(fields, stored):
+                if counts[field] != value:
+                    drifted[(model._meta.label, str(object_id), field)] = counts[field]
+        if drifted:
+            write_counters(drifted, batch_size, relative=False)
+        stats['checked'] += len(batch)
+        stats['fixed'] += len({object_id for _, object_id, _ in drifted})
+        after = batch[-1][0]
+        if len(batch) < batch_size:
+            return None, stats
+    return after, stats
@@ -0,0 +1,246 @@
+"""Feed materialization for UserFeed.
+
+Posts by ordinary authors are pushed into their followers' feeds when
+published (fan-out on write). Posts by authors with at least
+FANOUT_FOLLOWER_LIMIT followers are not copied. They are pulled and scored
+when a follower reads the feed (fan-out on read), so one popular post does
+not turn into millions of inserts. Reading a materialized feed is a single
+range scan on the (user_id, final_score) index.
+
+The follow graph lives in user-service, so callers pass in follower IDs and
+follower counts rather than this module querying them.
+"""
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Value, Window
+from django.db.models.functions import Extract, Ln, RowNumber
+from django.utils import timezone
+
+from .models import Post, UserFeed
+
+# Authors with this many followers are merged at read time instead of fanned out
+FANOUT_FOLLOWER_LIMIT = 10000
+# Feed rows kept per user. Fan-out trims a random 1 in FEED_TRIM_SLACK
+# recipients, so a feed typically overshoots by about that many rows;
+# trim_all_feeds, run on a schedule, bounds every feed
+FEED_MAX_LENGTH = 500
+FEED_TRIM_SLACK = 50
+FEED_BATCH_SIZE = 1000
+FEED_TRIM_CHUNK_SIZE = 1000  # users per trim_all_feeds query
+FEED_TRIM_TIME_BUDGET = 30.0  # seconds per run
+FEED_PAGE_SIZE = 20
+# How far back read-time merging looks for posts by high-follower authors
+PULL_WINDOW = timedelta(days=3)
+
+# final_score = relevance + engagement + recency, each weighted. Recency is
+# the post's age measured from a fixed epoch in RECENCY_SCALE units. Scores
+# therefore never need recomputing as posts age: a post must be e^1 times
+# more engaging to outrank one RECENCY_SCALE seconds newer.
+RELEVANCE_WEIGHT = 1.0
+ENGAGEMENT_WEIGHT = 1.0
+RECENCY_SCALE = 12 * 3600.0
+ENGAGEMENT_WEIGHTS = {'like_count': 1.0, 'comment_count': 2.0, 'share_count': 3.0, 'view_count': 0.05}
+
+FOLLOWED_AUTHOR = 'followed_author'
+
+
+def is_high_follower(follower_count: int) -> bool:
+    return follower_count >= FANOUT_FOLLOWER_LIMIT
+
+
+def engagement_score(post: Post) -> float:
+    return math.log1p(sum(getattr(post, field) * weight for field, weight in ENGAGEMENT_WEIGHTS.items()))
+
+
+def recency_score(post: Post) -> float:
+    return post.created_at.timestamp() / RECENCY_SCALE
+
+
+def feed_entry(user_id, post: Post, relevance: float = 1.0, reason: str = FOLLOWED_AUTHOR) -> UserFeed:
+    """Unsaved UserFeed row for ``post`` in ``user_id``'s feed, fully scored"""
+    engagement = engagement_score(post)
+    recency = recency_score(post)
+    return UserFeed(
+        user_id=user_id,
+        post=post,
+        relevance_score=relevance,
+        engagement_score=engagement,
+        recency_score=recency,
+        final_score=RELEVANCE_WEIGHT * relevance + ENGAGEMENT_WEIGHT * engagement + recency,
+        reason=reason,
+    )
+
+
+def _pulled_score():
+    """``feed_entry``'s final_score at relevance 1.0, as a query expression"""
+    engagement = sum(F(field) * weight for field, weight in ENGAGEMENT_WEIGHTS.items())
+    recency = Extract('created_at', 'epoch', tzinfo=dt_timezone.utc) / RECENCY_SCALE
+    return ExpressionWrapper(
+        Value(RELEVANCE_WEIGHT) + ENGAGEMENT_WEIGHT * Ln(engagement + 1.0) + recency,
+        output_field=FloatField(),
+    )
+
+
+def is_feedable(post: Post) -> bool:
+    return post.is_public and post.is_approved and not post.is_flagged
+
+
+def fan_out_post(post: Post, follower_ids: Iterable, follower_count: int,
+                 relevance: Optional[Dict] = None) -> int:
+    """Insert ``post`` into its followers' feeds unless its author is high-follower.
+
+    ``relevance`` optionally maps follower IDs to a per-follower relevance
+    (1.0 otherwise). Rows go in with ``bulk_create`` in FEED_BATCH_SIZE
+    batches, each in its own transaction. A post already in a feed is
+    skipped. Returns the number of rows inserted.
+    """
+    if not is_feedable(post) or is_high_follower(follower_count):
+        return 0
+    relevance = relevance or {}
+    written = 0
+    batch = []
+    for follower_id in follower_ids:
+        batch.append(follower_id)
+        if len(batch) == FEED_BATCH_SIZE:
+            written += _insert_batch(post, batch, relevance)
+            batch = []
+    if batch:
+        written += _insert_batch(post, batch, relevance)
+    return written
+
+
+def _insert_batch(post: Post, follower_ids: List, relevance: Dict) -> int:
+    with transaction.atomic():
+        # bulk_create cannot report rows skipped as conflicts, so leave out
+        # the feeds that already hold the post
+        present = {str(user_id) for user_id in UserFeed.objects.filter(
+            post=post, user_id__in=follower_ids).values_list('user_id', flat=True)}
+        rows = [feed_entry(f, post, relevance.get(f, 1.0)) for f in follower_ids if str(f) not in present]
+        UserFeed.objects.bulk_create(rows, batch_size=FEED_BATCH_SIZE, ignore_conflicts=True)
+        trim_feeds([f for f in follower_ids if random.random() * FEED_TRIM_SLACK < 1])
+    return len(rows)
+
+
+def trim_feeds(user_ids: List, max_length: int = FEED_MAX_LENGTH) -> int:
+    """Delete rows beyond each user's best ``max_length``; one ranked query for all users"""
+    if not user_ids:
+        return 0
+    overflow = (
+        UserFeed.objects.filter(user_id__in=user_ids)
+        .annotate(rank=Window(
+            RowNumber(), partition_by=[F('user_id')],
+            order_by=[F('final_score').desc(), F('created_at').desc()],
+        ))
+        .filter(rank__gt=max_length)
+        .values_list('id', flat=True)
+    )
+    deleted, _ = UserFeed.objects.filter(id__in=list(overflow)).delete()
+    return deleted
+
+
+def backfill_feed(user_id, author_id, follower_count: int, limit: int = FEED_PAGE_SIZE) -> int:
+    """Copy an ordinary author's recent posts into a new follower's feed; returns rows inserted"""
+    if is_high_follower(follower_count):
+        return 0
+    posts = Post.objects.filter(
+        author_id=author_id, is_public=True, is_approved=True, is_flagged=False,
+        created_at__gte=timezone.now() - PULL_WINDOW,
+    ).exclude(userfeed__user_id=user_id).order_by('-created_at')[:limit]
+    rows = [feed_entry(user_id, post) for post in posts]
+    UserFeed.objects.bulk_create(rows, batch_size=FEED_BATCH_SIZE, ignore_conflicts=True)
+    trim_feeds([user_id])
+    return len(rows)
+
+
+def trim_all_feeds(after=None, time_budget: float = FEED_TRIM_TIME_BUDGET,
+                   chunk_size: int = FEED_TRIM_CHUNK_SIZE,
+                   max_length: int = FEED_MAX_LENGTH) -> Tuple[Optional[object], Dict[str, int]]:
+    """Trim every feed longer than ``max_length``, walking users after ``after`` in user_id order.
+
+    Row counts come from the (user_id, final_score) index, ``chunk_size``
+    users per query. Returns the user ID to resume after (None once the
+    last feed is done) and counts. The budget is checked between chunks.
+    """
+    deadline = time.monotonic() + time_budget
+    stats = {'users': 0, 'trimmed': 0, 'deleted': 0}
+    while time.monotonic() < deadline:
+        counts = UserFeed.objects.order_by('user_id').values('user_id').annotate(rows=Count('id'))
+        if after is not None:
+            counts = counts.filter(user_id__gt=after)
+        chunk = list(counts.values_list('user_id', 'rows')[:chunk_size])
+        if not chunk:
+            return None, stats
+        over = [user_id for user_id, rows in chunk if rows > max_length]
+        stats['deleted'] += trim_feeds(over, max_length)
+        stats['users'] += len(chunk)
+        stats['trimmed'] += len(over)
+        after = chunk[-1][0]
+        if len(chunk) < chunk_size:
+            return None, stats
+    return after, stats
+
+
+def remove_author(user_id, author_id) -> int:
+    """Drop an unfollowed author's posts from a user's feed"""
+    deleted, _ = UserFeed.objects.filter(user_id=user_id, post__author_id=author_id).delete()
+    return deleted
+
+
+def rescore_post(post: Post) -> int:
+    """Refresh the engagement part of ``post``'s feed rows after its counters change; one UPDATE"""
+    engagement = engagement_score(post)
+    return UserFeed.objects.filter(post=post).update(
+        engagement_score=engagement,
+        final_score=F('relevance_score') * RELEVANCE_WEIGHT + ENGAGEMENT_WEIGHT * engagement + F('recency_score'),
+    )
+
+
+def read_feed(user_id, high_follower_author_ids: Iterable = (), limit: int = FEED_PAGE_SIZE,
+              before: Optional[Tuple[float, object]] = None) -> List[UserFeed]:
+    """One page of ``user_id``'s feed, best first, ties broken by post ID.
+
+    Materialized rows come from one range scan on (user_id, final_score),
+    with their posts joined in. The best ``limit`` posts below the cursor
+    within PULL_WINDOW by the followed high-follower authors are scored in
+    the query and merged in as unsaved rows. Pass the last row's
+    ``(final_score, post_id)`` as ``before`` to get the next page; the post
+    ID keeps rows tied on score from being skipped at a page boundary.
+    Pulled rows get a fresh ID on every read, so the cursor cannot use it.
+    """
+    rows = UserFeed.objects.filter(
+        user_id=user_id, post__is_public=True, post__is_approved=True, post__is_flagged=False
+    )
+    if before is not None:
+        score, post_id = before
+        # As in hashtag_timeline: the ANDed lte bound lets the scan seek,
+        # the OR only breaks ties
+        rows = rows.filter(
+            Q(final_score__lt=score) | Q(final_score=score, post_id__lt=post_id), final_score__lte=score
+        )
+    feed = list(rows.select_related('post').order_by('-final_score', '-post_id')[:limit])
+
+    high_follower_author_ids = list(high_follower_author_ids)
+    if not high_follower_author_ids:
+        return feed
+    posts = Post.objects.filter(
+        author_id__in=high_follower_author_ids, is_public=True, is_approved=True, is_flagged=False,
+        created_at__gte=timezone.now() - PULL_WINDOW,
+    ).annotate(feed_score=_pulled_score())
+    if before is not None:
+        # Engagement only adds to a score, so a post created after this
+        # cannot score below the cursor; the bound lets the scan stop there.
+        # Scores computed in SQL may differ from feed_entry's in the last
+        # bits, so the cursor is applied exactly once the rows are built
+        latest = datetime.fromtimestamp((score - RELEVANCE_WEIGHT) * RECENCY_SCALE, dt_timezone.utc)
+        posts = posts.filter(created_at__lte=latest, feed_score__lte=score)
+    posts = posts.order_by('-feed_score', '-id')[:limit]
+    seen = {row.post_id for row in feed}
+    pulled = [feed_entry(user_id, post) for post in posts if post.id not in seen]
+    if before is not None:
+        pulled = [row for row in pulled if (row.final_score, row.post_id) < (score, post_id)]
+    return sorted(feed + pulled, key=lambda row: (row.final_score, row.post_id), reverse=True)[:limit]
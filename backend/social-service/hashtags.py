@@ -0,0 +1,315 @@
+"""Streaming trending hashtags.
+
+Tags are extracted from a post's content when it is written and counted in
+memory with exponentially decayed counters, one set per window. Each window
+is a Space-Saving sketch holding at most ``capacity`` tags. A new tag
+replaces the lowest-scoring one and inherits its score as an error bound,
+so memory stays fixed however many distinct tags appear. "Trending now" is
+answered from the sketches. A scheduled flush writes the top tags'
+trending_score, post_count and last_used to Hashtag, so readers in other
+processes also never touch the posts table.
+
+Each process has its own sketches, so feed every post through the one
+process that flushes.
+
+PostHashtag maps tags to visible posts. ``index_posts`` fills it when posts
+are created, and ``backfill_post_hashtags`` fills it for older posts.
+``hashtag_timeline`` pages through a tag's posts, newest first, with
+index-only scans on (hashtag, created_at, post).
+"""
+import heapq
+import math
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Hashtag, Post, PostHashtag
+
+HASHTAG_PATTERN = re.compile(r'(?<![\w#])#(\w{1,100})')
+TRENDING_WINDOWS = {'1h': 3600.0, '24h': 86400.0}  # half-lives in seconds
+TRENDING_SCORE_WINDOW = '24h'  # the window stored in Hashtag.trending_score
+SKETCH_CAPACITY = 10000
+FLUSH_TOP = 1000
+FLUSH_INTERVAL = 60.0  # seconds
+INDEX_BATCH_SIZE = 1000
+BACKFILL_TIME_BUDGET = 60.0  # seconds per run
+TIMELINE_PAGE_SIZE = 20
+
+
+def extract_hashtags(content: str) -> List[str]:
+    """Distinct lowercased hashtags in ``content``, in order of first use"""
+    return list(dict.fromkeys(tag.lower() for tag in HASHTAG_PATTERN.findall(content)))
+
+
+def post_hashtags(post: Post) -> List[str]:
+    """Tags in ``post.content`` followed by any other tags already in ``post.hashtags``"""
+    return list(dict.fromkeys(extract_hashtags(post.content) + [t.lower() for t in post.hashtags or []]))
+
+
+def is_indexed(post: Post) -> bool:
+    return post.is_public and post.is_approved and not post.is_flagged
+
+
+class DecayedSpaceSaving:
+    """Space-Saving heavy hitters over exponentially decayed counts.
+
+    Counts use forward decay: a hit at time t is stored as
+    ``exp((t - landmark) / tau)``, so older counters never need updating and
+    every count shares one scale. The scale is folded back into the counts
+    before the exponent grows large. Because the scale is shared, the
+    min-heap used for eviction stays ordered; stale heap entries are
+    skipped lazily.
+    """
+
+    def __init__(self, capacity: int, half_life: float, now: Optional[float] = None):
+        self.capacity = capacity
+        self.tau = half_life / math.log(2)
+        self.landmark = time.time() if now is None else now
+        self._counts: Dict[str, List[float]] = {}  # tag -> [scaled count, scaled error]
+        self._heap: List[Tuple[float, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def add(self, tag: str, weight: float = 1.0, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        if (now - self.landmark) / self.tau > 50:
+            self._rescale(now)
+        scaled = weight * math.exp((now - self.landmark) / self.tau)
+
+        entry = self._counts.get(tag)
+        if entry is None:
+            if len(self._counts) < self.capacity:
+                entry = self._counts[tag] = [0.0, 0.0]
+            else:
+                floor, _ = self._pop_min()
+                entry = self._counts[tag] = [floor, floor]
+        entry[0] += scaled
+        heapq.heappush(self._heap, (entry[0], tag))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(count, t) for t, (count, _) in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, n: int, now: Optional[float] = None) -> List[Tuple[str, float, float]]:
+        """Best ``n`` tags as (tag, decayed count, overestimate bound)"""
+        now = time.time() if now is None else now
+        scale = math.exp(-(now - self.landmark) / self.tau)
+        best = heapq.nlargest(n, self._counts.items(), key=lambda item: item[1][0])
+        return [(tag, count * scale, error * scale) for tag, (count, error) in best]
+
+    def _pop_min(self) -> Tuple[float, str]:
+        while True:
+            count, tag = heapq.heappop(self._heap)
+            entry = self._counts.get(tag)
+            if entry is not None and entry[0] == count:
+                del self._counts[tag]
+                return count, tag
+
+    def _rescale(self, now: float):
+        scale = math.exp(-(now - self.landmark) / self.tau)
+        for entry in self._counts.values():
+            entry[0] *= scale
+            entry[1] *= scale
+        self.landmark = now
+        self._heap = [(count, tag) for tag, (count, _) in self._counts.items()]
+        heapq.heapify(self._heap)
+
+
+class TrendingHashtags:
+    """Decayed hashtag counts per window, plus post counts pending a flush"""
+
+    def __init__(self, windows: Dict[str, float] = TRENDING_WINDOWS, capacity: int = SKETCH_CAPACITY,
+                 score_window: str = TRENDING_SCORE_WINDOW):
+        self.windows = dict(windows)
+        self.score_window = score_window
+        self._sketches = {name: DecayedSpaceSaving(capacity, half_life) for name, half_life in windows.items()}
+        self._pending: Counter = Counter()
+        self._last_used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def record(self, tags: Iterable[str], now: Optional[float] = None):
+        now = time.time() if now is None else now
+        with self._lock:
+            for tag in tags:
+                for sketch in self._sketches.values():
+                    sketch.add(tag, now=now)
+                self._pending[tag] += 1
+                self._last_used[tag] = now
+
+    def record_post(self, post: Post, now: Optional[float] = None) -> List[str]:
+        """Set ``post.hashtags`` from its content and count them; call before saving, then ``index_posts``"""
+        tags = post.hashtags = post_hashtags(post)
+        if is_indexed(post):
+            self.record(tags, now)
+        return tags
+
+    def trending(self, n: int = 10, window: Optional[str] = None,
+                 now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """Top ``n`` (tag, score) pairs for ``window``, from memory only"""
+        with self._lock:
+            top = self._sketches[window or self.score_window].top(n, now)
+        return [(tag, score) for tag, score, _ in top]
+
+    def flush(self, top: int = FLUSH_TOP, now: Optional[float] = None) -> int:
+        """Write the top tags' scores and the pending post counts to Hashtag.
+
+        Tags that left the top list have their trending_score zeroed. Runs
+        as one transaction. Pending counts are kept if the write fails.
+        """
+        with self._lock:
+            scores = dict((tag, score) for tag, score, _ in self._sketches[self.score_window].top(top, now))
+            pending, self._pending = self._pending, Counter()
+            last_used, self._last_used = self._last_used, {}
+        try:
+            with transaction.atomic():
+                _write_hashtags(scores, pending, last_used)
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+                for tag, used in last_used.items():
+                    self._last_used[tag] = max(used, self._last_used.get(tag, used))
+            raise
+        return len(scores)
+
+    def start_flusher(self, interval: float = FLUSH_INTERVAL):
+        """Flush every ``interval`` seconds on a daemon thread"""
+        if self._flusher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except Exception:
+                    # Pending counts were put back; the next round retries them
+                    pass
+
+        self._flusher = threading.Thread(target=run, name='hashtag-flusher', daemon=True)
+        self._flusher.start()
+
+
+def _write_hashtags(scores: Dict[str, float], pending: Counter, last_used: Dict[str, float]):
+    names = sorted(set(scores) | set(pending))
+    if not names:
+        return
+    now = datetime.now(dt_timezone.utc)
+    epoch = datetime.fromtimestamp(0, dt_timezone.utc)
+    used = {
+        name: datetime.fromtimestamp(last_used[name], dt_timezone.utc) if name in last_used else epoch
+        for name in names
+    }
+    table = connection.ops.quote_name(Hashtag._meta.db_table)
+
+    # New tags are inserted with the time they were used; bulk_create would
+    # let auto_now stamp last_used with the flush time instead
+    placeholders = ', '.join(['(%s::uuid, %s, 0, 0.0, %s::timestamptz, %s::timestamptz)'] * len(names))
+    insert = (
+        f'INSERT INTO {table} (id, name, post_count, trending_score, created_at, last_used) '
+        f'VALUES {placeholders} ON CONFLICT (name) DO NOTHING'
+    )
+    Hashtag.objects.filter(trending_score__gt=0).exclude(name__in=list(scores)).update(trending_score=0.0)
+
+    rows = [(name, scores.get(name), pending.get(name, 0), used[name]) for name in names]
+    placeholders = ', '.join(['(%s, %s::double precision, %s::integer, %s::timestamptz)'] * len(rows))
+    # A NULL score leaves trending_score alone; last_used only moves forward
+    update = (
+        f'UPDATE {table} AS h SET '
+        f'trending_score = COALESCE(v.score, h.trending_score), '
+        f'post_count = h.post_count + v.posts, '
+        f'last_used = GREATEST(h.last_used, v.last_used) '
+        f'FROM (VALUES {placeholders}) AS v(name, score, posts, last_used) '
+        f'WHERE h.name = v.name'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(insert, [value for name in names for value in (uuid.uuid4(), name, now, used[name])])
+        cursor.execute(update, [value for row in rows for value in row])
+
+
+def trending_hashtags(n: int = 10) -> List[Tuple[str, float]]:
+    """Top tags as last flushed, for processes without the sketches; reads only Hashtag"""
+    return list(
+        Hashtag.objects.filter(trending_score__gt=0)
+        .order_by('-trending_score')
+        .values_list('name', 'trending_score')[:n]
+    )
+
+
+def index_posts(posts: Iterable[Post], batch_size: int = INDEX_BATCH_SIZE) -> int:
+    """Add saved posts' ``hashtags`` to PostHashtag; existing links are skipped"""
+    rows = [
+        PostHashtag(post_id=post.pk, hashtag=tag, created_at=post.created_at)
+        for post in posts if is_indexed(post) for tag in dict.fromkeys(post.hashtags or [])
+    ]
+    PostHashtag.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+    return len(rows)
+
+
+def unindex_post(post: Post) -> int:
+    """Drop a post from hashtag timelines, e.g. once it is hidden, flagged or re-tagged"""
+    deleted, _ = PostHashtag.objects.filter(post=post).delete()
+    return deleted
+
+
+def backfill_post_hashtags(after=None, batch_size: int = INDEX_BATCH_SIZE,
+                           time_budget: float = BACKFILL_TIME_BUDGET) -> Tuple[Optional[object], Dict[str, int]]:
+    """Index existing posts in primary-key order after ``after`` until the time budget runs out.
+
+    Returns the key to resume after (None once done) and counts. Posts with
+    an empty ``hashtags`` list get it filled in from their content.
+    """
+    deadline = time.monotonic() + time_budget
+    stats = {'posts': 0, 'links': 0}
+    while time.monotonic() < deadline:
+        rows = Post.objects.order_by('pk').only('id', 'content', 'hashtags', 'created_at',
+                                                'is_public', 'is_approved', 'is_flagged')
+        if after is not None:
+            rows = rows.filter(pk__gt=after)
+        batch = list(rows[:batch_size])
+        if not batch:
+            return None, stats
+        untagged = []
+        for post in batch:
+            tags = post_hashtags(post)
+            if tags != post.hashtags:
+                post.hashtags = tags
+                untagged.append(post)
+        with transaction.atomic():
+            Post.objects.bulk_update(untagged, ['hashtags'], batch_size=batch_size)
+            stats['links'] += index_posts(batch, batch_size)
+        stats['posts'] += len(batch)
+        after = batch[-1].pk
+        if len(batch) < batch_size:
+            return None, stats
+    return after, stats
+
+
+def hashtag_timeline(tag: str, limit: int = TIMELINE_PAGE_SIZE,
+                     before: Optional[Tuple[datetime, object]] = None) -> Tuple[List[Post], Optional[Tuple]]:
+    """One page of ``tag``'s posts, newest first, and the ``before`` cursor for the next page.
+
+    Post IDs come from an index-only scan on (hashtag, created_at, post),
+    starting just below the (created_at, post ID) cursor; the posts are then
+    fetched by primary key. The cursor is None after the last page.
+    """
+    links = PostHashtag.objects.filter(hashtag=tag.lower().lstrip('#'))
+    if before is not None:
+        created_at, post_id = before
+        # The ANDed lte bound lets the scan seek to the cursor; the OR only
+        # breaks ties within its timestamp
+        links = links.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, post_id__lt=post_id),
+            created_at__lte=created_at,
+        )
+    page = list(links.order_by('-created_at', '-post_id').values_list('created_at', 'post_id')[:limit])
+    posts = Post.objects.in_bulk([post_id for _, post_id in page])
+    cursor = page[-1] if len(page) == limit else None
+    return [posts[post_id] for _, post_id in page if post_id in posts], cursor
@@ -57,6 +57,8 @@ class Post(models.Model):
         db_table = 'posts'
         indexes = [
             models.Index(fields=['author_id']),
+            # Read-time feed merging of high-follower authors' recent posts
+            models.Index(fields=['author_id', 'created_at']),
             models.Index(fields=['post_type']),
             models.Index(fields=['product_id']),
             models.Index(fields=['created_at']),
@@ -167,8 +169,24 @@ class Hashtag(models.Model):
             models.Index(fields=['last_used']),
         ]
 
+class PostHashtag(models.Model):
+    """Hashtag-to-post index for hashtag timelines, maintained by hashtags.py"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='hashtag_links')
+    hashtag = models.CharField(max_length=100)
+
+    created_at = models.DateTimeField()  # Copied from the post
+
+    class Meta:
+        db_table = 'post_hashtags'
+        unique_together = ('hashtag', 'post')
+        indexes = [
+            # Timeline pages are index-only range scans on this
+            models.Index(fields=['hashtag', 'created_at', 'post']),
+        ]
+
 class UserFeed(models.Model):
-    """Personalized user feed entries"""
+    """Personalized user feed entries, materialized by feed.py"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.UUIDField()  # Reference to User in user-service
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
@@ -191,6 +209,7 @@ class UserFeed(models.Model):
         unique_together = ('user_id', 'post')
         indexes = [
             models.Index(fields=['user_id', 'final_score']),
+            models.Index(fields=['user_id', 'id']),  # rescoring.py keyset scan
             models.Index(fields=['user_id', 'is_seen']),
             models.Index(fields=['created_at']),
         ]
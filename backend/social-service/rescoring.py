@@ -0,0 +1,113 @@
+"""Batch re-scoring of materialized UserFeed rows.
+
+Feed rows are scored once, when fanned out. Afterwards their posts keep
+collecting likes, comments, shares and views. Changes to the feed.py
+weights or RECENCY_SCALE also leave stored scores behind. This job walks
+every feed in (user_id, id) order, in large chunks, and recomputes
+engagement, recency and final_score with NumPy. It writes back, in bulk,
+only the rows that moved within their user's feed or whose score drifted
+by more than a tolerance. Each run stops after a time budget and returns a
+cursor to resume from, so a scheduler can call it repeatedly.
+
+Relevance is not recomputed. It is a per-follower input that the caller
+of ``fan_out_post`` supplies, and none of its inputs are stored in this
+service, so the stored relevance_score is the authoritative value and is
+only carried into final_score.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .feed import ENGAGEMENT_WEIGHT, ENGAGEMENT_WEIGHTS, FEED_BATCH_SIZE, RECENCY_SCALE, RELEVANCE_WEIGHT
+from django.db.models import Q
+
+from .models import UserFeed
+
+RESCORE_CHUNK_SIZE = 50000
+RESCORE_TIME_BUDGET = 30.0  # seconds per run
+# Score drift that is written back even when ranks hold; new rows are scored
+# fresh, so old rows must not drift far. 0.05 is about 36 minutes of recency.
+RESCORE_TOLERANCE = 0.05
+
+_COUNTERS = list(ENGAGEMENT_WEIGHTS)
+_FIELDS = ('id', 'user_id', 'relevance_score', 'final_score', 'post__created_at',
+           *(f'post__{counter}' for counter in _COUNTERS))
+_WEIGHTS = np.asarray([ENGAGEMENT_WEIGHTS[counter] for counter in _COUNTERS])
+
+
+def rescore_feeds(time_budget: float = RESCORE_TIME_BUDGET, after=None,
+                  chunk_size: int = RESCORE_CHUNK_SIZE,
+                  tolerance: float = RESCORE_TOLERANCE) -> Tuple[Optional[object], Dict[str, int]]:
+    """Re-score feed rows after the ``(user_id, id)`` cursor ``after`` until done or out of time.
+
+    Returns the cursor to pass as ``after`` next time (None once the last
+    feed is done) and row counts. Chunks end on a user boundary, so each
+    user's ranks are compared over their whole feed, unless one user's
+    feed fills a chunk alone. That feed is then re-scored a chunk at a
+    time, with ranks compared within each part. The budget is checked
+    between chunks.
+    """
+    deadline = time.monotonic() + time_budget
+    stats = {'users': 0, 'rows': 0, 'updated': 0}
+    while time.monotonic() < deadline:
+        rows = UserFeed.objects.order_by('user_id', 'id')
+        if after is not None:
+            user_id, row_id = after
+            rows = rows.filter(Q(user_id__gt=user_id) | Q(user_id=user_id, id__gt=row_id))
+        chunk = list(rows.values_list(*_FIELDS)[:chunk_size])
+        last_chunk = len(chunk) < chunk_size
+        if not last_chunk:
+            # The last user's feed may continue past the chunk; leave it for
+            # the next one unless that user alone fills the chunk
+            last_user = chunk[-1][1]
+            cut = next(i for i, row in enumerate(chunk) if row[1] == last_user)
+            chunk = chunk[:cut] or chunk
+        if chunk:
+            users, updated = _rescore_chunk(chunk, tolerance)
+            stats['users'] += users
+            stats['rows'] += len(chunk)
+            stats['updated'] += updated
+            after = (chunk[-1][1], chunk[-1][0])
+        if last_chunk:
+            return None, stats
+    return after, stats
+
+
+def _rescore_chunk(chunk: List[tuple], tolerance: float) -> Tuple[int, int]:
+    columns = list(zip(*chunk))
+    ids, users = columns[0], columns[1]
+    relevance = np.asarray(columns[2], dtype=np.float64)
+    stored = np.asarray(columns[3], dtype=np.float64)
+    created = np.asarray([created_at.timestamp() for created_at in columns[4]])
+    counters = np.asarray(columns[5:], dtype=np.float64)
+
+    engagement = np.log1p(_WEIGHTS @ counters)
+    recency = created / RECENCY_SCALE
+    final = RELEVANCE_WEIGHT * relevance + ENGAGEMENT_WEIGHT * engagement + recency
+
+    # Rows arrive grouped by user; number the groups to rank within each
+    starts = np.ones(len(chunk), dtype=bool)
+    starts[1:] = [a != b for a, b in zip(users[1:], users[:-1])]
+    groups = np.cumsum(starts) - 1
+    first = np.flatnonzero(starts)
+    moved = _ranks(groups, stored, first) != _ranks(groups, final, first)
+    changed = np.flatnonzero(moved | (np.abs(final - stored) > tolerance))
+
+    UserFeed.objects.bulk_update(
+        [
+            UserFeed(id=ids[i], engagement_score=engagement[i], recency_score=recency[i], final_score=final[i])
+            for i in changed
+        ],
+        ['engagement_score', 'recency_score', 'final_score'],
+        batch_size=FEED_BATCH_SIZE,
+    )
+    return len(first), len(changed)
+
+
+def _ranks(groups: np.ndarray, scores: np.ndarray, first: np.ndarray) -> np.ndarray:
+    """Each row's 0-based position within its group, best score first"""
+    order = np.lexsort((-scores, groups))
+    ranks = np.empty(len(scores), dtype=np.int64)
+    ranks[order] = np.arange(len(scores)) - first[groups[order]]
+    return ranks